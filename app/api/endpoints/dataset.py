@@ -1,42 +1,208 @@
-import json, asyncio, io, zipfile
-from fastapi import APIRouter, Request, HTTPException
-from fastapi.responses import StreamingResponse
+import json
+from typing import Literal, Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
-from app.core.dataset_manager import genera_dataset_steps
+from app.core.dataset_manager import genera_dataset_steps, genera_dataset_streaming
+from app.core.job_manager import job_manager, Job
+from app.core.result_store import result_store
+from app.services.generators.gemini_cache import get_cache_gemini
+from app.services.exporters.formati import verifica_dipendenze_formato
+from app.services.exporters.sql_export import stream_dump_sql, stream_copy_postgres
+from app.services.exporters.zip_stream import stream_zip_tabelle
+from app.services.utils.tabelle import pagina_tabella, encode_split, encode_arrow_ipc
 
 router = APIRouter()
 
-@router.get("/generate")
-async def generate_dataset(n_utenti: int, n_corsi: int, n_risorse: int, request: Request):
+
+def _get_job(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' non trovato")
+    return job
+
+
+def _stream_eventi(job: Job) -> EventSourceResponse:
     async def event_generator():
-        for step in genera_dataset_steps(n_utenti, n_corsi, n_risorse, request):
-            yield {"event": "message", "data": json.dumps(step)}
-            if step.get("progress") == 100:
-                return
-            
-            await asyncio.sleep(0.1)
-    
+        async for evento in job_manager.ascolta(job):
+            yield {"event": "message", "data": json.dumps(evento)}
+
     return EventSourceResponse(event_generator())
 
 
+@router.post("/jobs", status_code=202)
+def crea_job_generazione(n_utenti: int, n_corsi: int, n_risorse: int):
+    job = job_manager.crea_job(
+        genera_dataset_steps,
+        n_utenti=n_utenti,
+        n_corsi=n_corsi,
+        n_risorse=n_risorse
+    )
+    return job.snapshot()
+
+
+@router.post("/jobs/streaming", status_code=202)
+def crea_job_streaming(
+    n_utenti: int,
+    n_corsi: int,
+    n_risorse: int,
+    formato: Literal["csv", "csv.gz", "parquet", "sql"] = "parquet",
+    righe_chunk: Optional[int] = Query(None, ge=1)
+):
+    """
+    Generazione a chunk direttamente su file, per dataset più grandi della
+    memoria: l'evento finale indica la cartella di output invece delle tabelle.
+    """
+    if formato == "parquet":
+        try:
+            verifica_dipendenze_formato(formato)
+        except ImportError as e:
+            raise HTTPException(status_code=501, detail=f"Formato {formato} non disponibile: {e}")
+
+    job = job_manager.crea_job(
+        genera_dataset_streaming,
+        n_utenti=n_utenti,
+        n_corsi=n_corsi,
+        n_risorse=n_risorse,
+        formato=formato,
+        righe_chunk=righe_chunk
+    )
+    return job.snapshot()
+
+
+@router.get("/jobs")
+def lista_job():
+    return [job.snapshot() for job in job_manager.lista()]
 
-@router.get("/download_all")
-def download_all_tables(request: Request):
-    dfs = getattr(request.app.state, "last_dfs", None)
-    if not dfs:
-        raise HTTPException(status_code=404, detail="Nessun dataset generato ancora")
 
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        for name, df in dfs.items():
-            csv_buffer = io.StringIO()
-            df.to_csv(csv_buffer, index=False)
-            zip_file.writestr(f"{name}.csv", csv_buffer.getvalue())
+@router.get("/jobs/{job_id}")
+def stato_job(job_id: str):
+    return _get_job(job_id).snapshot()
+
+
+@router.get("/jobs/{job_id}/events")
+async def eventi_job(job_id: str):
+    return _stream_eventi(_get_job(job_id))
+
+
+@router.get("/cache/gemini")
+def statistiche_cache_gemini():
+    cache = get_cache_gemini()
+    if cache is None:
+        return {"abilitata": False}
+    return {"abilitata": True, **cache.statistiche()}
+
+
+@router.delete("/cache/gemini")
+def svuota_cache_gemini():
+    cache = get_cache_gemini()
+    if cache is not None:
+        cache.svuota()
+    return {"abilitata": cache is not None}
+
+
+@router.get("/generate")
+async def generate_dataset(n_utenti: int, n_corsi: int, n_risorse: int):
+    job = job_manager.crea_job(
+        genera_dataset_steps,
+        n_utenti=n_utenti,
+        n_corsi=n_corsi,
+        n_risorse=n_risorse
+    )
+    return _stream_eventi(job)
 
-    zip_buffer.seek(0)
+
+
+def _get_risultato(job_id: str) -> dict:
+    dfs = result_store.get(job_id)
+    if dfs is None:
+        raise HTTPException(status_code=404, detail=f"Nessun dataset disponibile per il job '{job_id}'")
+    return dfs
+
+
+@router.get("/{job_id}/tables")
+def lista_tabelle(job_id: str):
+    righe = result_store.righe(job_id)
+    if righe is None:
+        raise HTTPException(status_code=404, detail=f"Nessun dataset disponibile per il job '{job_id}'")
+    return righe
+
+
+@router.get("/{job_id}/tables/{name}")
+def leggi_tabella(
+    job_id: str,
+    name: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=10000),
+    columns: Optional[str] = None,
+    format: Literal["split", "arrow"] = "split"
+):
+    df = _get_risultato(job_id).get(name)
+    if df is None:
+        raise HTTPException(status_code=404, detail=f"Tabella '{name}' non trovata")
+
+    colonne = [c.strip() for c in columns.split(",") if c.strip()] if columns else None
+    try:
+        pagina = pagina_tabella(df, offset, limit, colonne)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=e.args[0])
+
+    if format == "arrow":
+        try:
+            contenuto = encode_arrow_ipc(pagina)
+        except ImportError:
+            raise HTTPException(status_code=501, detail="Formato arrow non disponibile: pyarrow non installato")
+        return Response(
+            contenuto,
+            media_type="application/vnd.apache.arrow.stream",
+            headers={"X-Total-Rows": str(len(df))}
+        )
+
+    contenuto = encode_split(pagina, table=name, total=len(df), offset=offset, limit=limit)
+    return Response(contenuto, media_type="application/json")
+
+
+@router.get("/{job_id}/download_all")
+def download_all_tables(
+    job_id: str,
+    format: Literal["csv", "csv.gz", "csv.zst", "parquet", "arrow", "feather"] = "csv"
+):
+    dfs = _get_risultato(job_id)
+
+    if format != "csv":
+        try:
+            verifica_dipendenze_formato(format)
+        except ImportError as e:
+            raise HTTPException(status_code=501, detail=f"Formato {format} non disponibile: {e}")
 
     return StreamingResponse(
-        zip_buffer,
+        stream_zip_tabelle(dfs, format),
         media_type="application/zip",
         headers={"Content-Disposition": "attachment; filename=dataset.zip"}
-    )
\ No newline at end of file
+    )
+
+
+
+@router.get("/{job_id}/export_sql")
+def export_sql(
+    job_id: str,
+    formato: Literal["sql", "copy"] = "sql",
+    dialetto: Literal["postgresql", "mysql", "sqlite"] = "postgresql",
+    batch_size: int = Query(1000, ge=1, le=100_000),
+    transaction_size: int = Query(50_000, ge=1),
+    crea_tabelle: bool = False
+):
+    dfs = _get_risultato(job_id)
+
+    if formato == "copy":
+        if dialetto != "postgresql":
+            raise HTTPException(status_code=422, detail="Il formato copy è disponibile solo per postgresql")
+        contenuto = stream_copy_postgres(dfs, batch_size, transaction_size, crea_tabelle)
+    else:
+        contenuto = stream_dump_sql(dfs, dialetto, batch_size, transaction_size, crea_tabelle)
+
+    return StreamingResponse(
+        (blocco.encode("utf-8") for blocco in contenuto),
+        media_type="application/sql",
+        headers={"Content-Disposition": "attachment; filename=dataset.sql"}
+    )
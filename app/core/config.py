@@ -1,5 +1,5 @@
 import secrets
-from typing import Annotated, Any, Literal, Union
+from typing import Annotated, Any, Literal, Optional, Union
 
 from pydantic import (
     AnyUrl,
@@ -42,4 +42,77 @@ class Settings(BaseSettings):
 
     PROJECT_NAME: str = "Synthetic Data Generator"
 
+    # Job di generazione in background
+    JOB_MAX_WORKERS: int = 4
+    JOB_RETENTION_SECONDS: int = 60 * 60
+
+    # Store dei risultati dei job (LRU + TTL)
+    RESULT_STORE_MAX_BYTES: int = 2 * 1024 ** 3
+    RESULT_STORE_TTL_SECONDS: int = 60 * 60
+    RESULT_STORE_SPILL_DIR: Optional[str] = None
+
+    # Backend LLM: "vertex" (Gemini su Vertex AI) oppure "locale", stub
+    # deterministico senza rete per esecuzioni offline e benchmark
+    GEMINI_BACKEND: Literal["vertex", "locale"] = "vertex"
+    GEMINI_PROGETTO: str = "prj-mlai-quelixolivet-demo-001"
+    GEMINI_LOCATION: str = "us-central1"
+    # file del service account; vuoto per le credenziali di default dell'ambiente
+    GEMINI_CREDENZIALI: Optional[str] = "app/credentials/vertex_service_account.json"
+
+    # Backend locale: latenza (primo token + per token di uscita) e
+    # probabilità di errori, 429 e risposte troncate per chiamata
+    GEMINI_LOCALE_LATENZA: float = 0.5
+    GEMINI_LOCALE_LATENZA_TOKEN: float = 0.002
+    GEMINI_LOCALE_ERRORI: float = 0.0
+    GEMINI_LOCALE_RATE_LIMIT: float = 0.0
+    GEMINI_LOCALE_TRONCAMENTI: float = 0.0
+    GEMINI_LOCALE_SEED: int = 0
+
+    # Chiamate Gemini concorrenti (limite AIMD)
+    GEMINI_CONCORRENZA_INIZIALE: int = 4
+    GEMINI_CONCORRENZA_MAX: int = 16
+
+    # Cache persistente delle risposte Gemini
+    GEMINI_CACHE_ENABLED: bool = True
+    GEMINI_CACHE_PATH: str = "app/data/cache/gemini_cache.sqlite"
+    GEMINI_CACHE_MAX_BYTES: int = 256 * 1024 ** 2
+
+    # Generazione fusa: una risposta JSON per riga riempie più colonne
+    GEMINI_GENERAZIONE_FUSA: bool = True
+
+    # Generazione a flusso: ogni riga passa alla colonna successiva appena
+    # i suoi ingressi sono pronti; un batch parziale parte dopo ATTESA secondi
+    GEMINI_FLUSSO: bool = True
+    GEMINI_FLUSSO_ATTESA: float = 0.5
+
+    # Risposte lette in streaming: ogni riga viene assegnata appena arriva
+    GEMINI_STREAMING: bool = True
+
+    # Giri di richiesta mirata per le sole righe mancanti o non valide di un batch
+    GEMINI_RICHIESTE_MIRATE: int = 2
+
+    # Batch dimensionati per token stimati (modello MODEL_NAME): le chiamate più
+    # lente di LATENZA_OBIETTIVO secondi, troncate o incomplete riducono i batch
+    GEMINI_BUDGET_TOKEN_INGRESSO: int = 32_000
+    GEMINI_BUDGET_TOKEN_USCITA: int = 6_000
+    GEMINI_BATCH_RIGHE_MAX: int = 500
+    GEMINI_LATENZA_OBIETTIVO: float = 45.0
+
+    # Valori Faker pre-generati per tipo, campionati con numpy
+    FAKER_POOL_SIZE: int = 20_000
+
+    # Stadio Faker a shard in processi separati: con lo stesso seed l'output
+    # è identico per qualsiasi numero di processi (seed None = casuale, loggato)
+    FAKER_SEED: Optional[int] = None
+    # riferimento (unix) dei timestamp generati; None = ora, oppure una data fissa
+    # (1/1/2025 UTC) se il seed è fissato, così l'output non dipende dal giorno del run
+    FAKER_ADESSO: Optional[int] = None
+    FAKER_PROCESSI: Optional[int] = None    # None = numero di CPU
+    FAKER_SHARD_RIGHE: int = 100_000
+
+    # Generazione a chunk verso file su disco (tabelle più grandi della memoria):
+    # i chunk vengono arrotondati a un multiplo di FAKER_SHARD_RIGHE
+    STREAMING_CHUNK_RIGHE: int = 200_000
+    STREAMING_DIR: str = "app/data/streaming"
+
 settings = Settings()  # type: ignore
\ No newline at end of file
@@ -1,17 +1,17 @@
 import logging
+import numpy as np
 import pandas as pd
 import os
-import warnings
-from fastapi import Request
-
-warnings.filterwarnings("ignore", category=FutureWarning)
-warnings.filterwarnings("ignore", category=UserWarning)
+from typing import Callable, Optional
 
 from app.services.generators.key_generator import (
+    GeneratoreChiaviEsterne,
     genera_chiavi_primarie,
     genera_chiavi_esterne
 )
-from app.services.generators.faker_generator import riempi_colonne_da_schema, riempi_utenti_coerenti
+from app.services.generators.faker_generator import RegistroUnivoci
+from app.services.generators.faker_parallelo import StadioFaker, riempi_tabelle_faker
+from app.services.exporters.sink import SinkTabelle, crea_sink
 from app.schemas.faker_schemas import (
     faker_schema_user,
     faker_schema_course,
@@ -19,7 +19,15 @@ from app.schemas.faker_schemas import (
     faker_schema_context,
     faker_schema_role_assignments
 )
-from app.services.generators.gemini_client import init_vertex_ai
+from app.schemas.fk_schemas import (
+    fk_schema_course_category,
+    fk_schema_resource_course,
+    fk_schema_resource_uploaded_by
+)
+from app.core.config import settings
+from app.core.result_store import result_store
+from app.core.scheduler import SchedulerStadi, Stadio
+from app.services.generators.gemini_client import get_backend
 from app.services.builders.gemini_builders import (
     build_course_fullname,
     build_course_shortname,
@@ -27,7 +35,10 @@ from app.services.builders.gemini_builders import (
     build_course_level,
     build_resource_name,
     build_resource_intro,
-    build_resource_level
+    build_resource_level,
+    build_course_testi,
+    build_resource_testi,
+    build_testi_flusso
 )
 from app.services.builders.tag_builders import (
     genera_tabella_tag,
@@ -62,34 +73,30 @@ def check_or_raise(condition: bool, message: str):
 
 
 def safe_init_gemini():
+    """
+    Inizializza il backend LLM scelto da settings.GEMINI_BACKEND. Se fallisce
+    le colonne Gemini restano vuote: per esecuzioni senza rete usare
+    GEMINI_BACKEND=locale.
+    """
+    backend = get_backend()
     try:
-        service_account_path = os.path.join("app", "credentials", "vertex_service_account.json")
-        project_id = "prj-mlai-quelixolivet-demo-001"
-        location = "us-central1"
-
-        init_vertex_ai(project_id, location, service_account_path)
+        backend.inizializza()
         return True
     except Exception as e:
-        logger.error(f"Gemini non inizializzato: {e}")
+        logger.error(f"Backend LLM '{backend.nome}' non inizializzato, le colonne Gemini resteranno vuote: {e}")
         return False
     
 
 
-# --- Orchestratore ---
-def genera_dataset(n_utenti: int, n_corsi: int, n_risorse: int, json_tag_path: str):
-    """
-    Orchestratore end-to-end:
-    1. prepara i dataset con intestazioni corrette e tabelle statiche
-    2. popola con chiavi primarie e chiavi esterne
-    3. genera mdl_context e mdl_role_assignments
-    4. Faker per colonne non essenziali
-    5. Gemini per colonne semantiche
-    6. genera tabelle dei tag
+# --- Tabelle vuote e tabelle fisse ---
+def prepara_tabelle():
     """
+    Dataset vuoti con le intestazioni Moodle e tabelle statiche (categorie e ruoli).
 
-    logger.info("=== Avvio generazione dataset sintetico ===")
-
-    # 1. Preparazione dataset vuoti con intestazioni
+    Returns:
+        (df_user, df_course, df_resource, df_context, df_role_assignments,
+         df_course_categories, df_role)
+    """
     df_user = pd.DataFrame(columns=[
         "id","auth","confirmed","policyagreed","deleted","suspended","mnethostid",
         "username","password","idnumber","firstname","lastname","email","emailstop",
@@ -149,6 +156,28 @@ def genera_dataset(n_utenti: int, n_corsi: int, n_risorse: int, json_tag_path: s
         [8,"","frontpage","",8,"frontpage"]
     ], columns=["id","name","shortname","description","sortorder","archetype"])
 
+    return df_user, df_course, df_resource, df_context, df_role_assignments, df_course_categories, df_role
+
+
+
+# --- Orchestratore ---
+def genera_dataset(n_utenti: int, n_corsi: int, n_risorse: int, json_tag_path: str):
+    """
+    Orchestratore end-to-end:
+    1. prepara i dataset con intestazioni corrette e tabelle statiche
+    2. popola con chiavi primarie e chiavi esterne
+    3. genera mdl_context e mdl_role_assignments
+    4. Faker per colonne non essenziali
+    5. Gemini per colonne semantiche
+    6. genera tabelle dei tag
+    """
+
+    logger.info("=== Avvio generazione dataset sintetico ===")
+
+    # 1. Preparazione dataset vuoti con intestazioni
+    (df_user, df_course, df_resource, df_context, df_role_assignments,
+     df_course_categories, df_role) = prepara_tabelle()
+
 
     # 2. Chiavi primarie e chiavi esterne
     df_user = genera_chiavi_primarie(df_user, n_utenti)
@@ -160,9 +189,12 @@ def genera_dataset(n_utenti: int, n_corsi: int, n_risorse: int, json_tag_path: s
     check_or_raise(verifica_chiavi_primarie(df_resource), "PK non valide in mdl_resource")
 
 
-    df_course = genera_chiavi_esterne(df_course, "category", df_course_categories, "id")
-    df_resource = genera_chiavi_esterne(df_resource, "course", df_course, "id")
-    df_resource = genera_chiavi_esterne(df_resource, "uploaded_by", df_user, "id")
+    df_course = genera_chiavi_esterne(df_course, "category", df_course_categories, "id",
+                                      distribuzione=fk_schema_course_category)
+    df_resource = genera_chiavi_esterne(df_resource, "course", df_course, "id",
+                                        distribuzione=fk_schema_resource_course)
+    df_resource = genera_chiavi_esterne(df_resource, "uploaded_by", df_user, "id",
+                                        distribuzione=fk_schema_resource_uploaded_by)
 
     check_or_raise(verifica_chiavi_esterne(df_course, "category", df_course_categories, "id"),
                    "FK category non valida in mdl_course")
@@ -181,11 +213,19 @@ def genera_dataset(n_utenti: int, n_corsi: int, n_risorse: int, json_tag_path: s
 
 
     # 4. Faker
-    df_user = riempi_colonne_da_schema(df_user, faker_schema_user)
-    df_course = riempi_colonne_da_schema(df_course, faker_schema_course)
-    df_resource = riempi_colonne_da_schema(df_resource, faker_schema_resource)
-    df_context = riempi_colonne_da_schema(df_context, faker_schema_context)
-    df_role_assignments = riempi_colonne_da_schema(df_role_assignments, faker_schema_role_assignments)
+    # shard in processi separati, riproducibili con settings.FAKER_SEED
+    riempite = riempi_tabelle_faker({
+        "user": (df_user, faker_schema_user),
+        "course": (df_course, faker_schema_course),
+        "resource": (df_resource, faker_schema_resource),
+        "context": (df_context, faker_schema_context),
+        "role_assignments": (df_role_assignments, faker_schema_role_assignments)
+    }, tabella_utenti="user")
+    df_user = riempite["user"]
+    df_course = riempite["course"]
+    df_resource = riempite["resource"]
+    df_context = riempite["context"]
+    df_role_assignments = riempite["role_assignments"]
 
     check_or_raise(verifica_range(df_resource, "feedback_score", 1.0, 5.0), "Valori fuori range in feedback_score")
 
@@ -229,204 +269,435 @@ def genera_dataset(n_utenti: int, n_corsi: int, n_risorse: int, json_tag_path: s
 
 
 
-# versione a step
-def genera_dataset_steps(n_utenti: int, n_corsi: int, n_risorse: int, request: Request):
+# --- Pipeline come grafo di stadi ---
+def stadi_pipeline(
+    n_utenti: int,
+    n_corsi: int,
+    n_risorse: int,
+    json_tag_path: str,
+    stadio_faker: StadioFaker,
+    usa_gemini: bool = True,
+    al_progresso_gemini: Optional[Callable[[int, int], None]] = None
+) -> list[Stadio]:
     """
-    Orchestratore end-to-end:
-    1. prepara i dataset con intestazioni corrette e tabelle statiche
-    2. popola con chiavi primarie e chiavi esterne
-    3. genera mdl_context e mdl_role_assignments
-    4. Faker per colonne non essenziali
-    5. Gemini per colonne semantiche
-    6. genera tabelle dei tag
+    Stadi della generazione con ingressi e uscite espliciti, nell'ordine in
+    cui andrebbero eseguiti in sequenza: le dipendenze vengono ricavate da
+    SchedulerStadi, che esegue in parallelo gli stadi indipendenti (es. Faker
+    su mdl_user durante i testi Gemini dei corsi, tag e category_tag subito).
+
+    Args:
+        n_utenti, n_corsi, n_risorse: righe da generare
+        json_tag_path: file JSON con la mappa categorie -> tag
+        stadio_faker: StadioFaker condiviso dagli stadi Faker
+        usa_gemini: se False i testi Gemini dei corsi e delle risorse vengono saltati
+        al_progresso_gemini: chiamata con (righe scritte, righe totali) dallo stadio
+            gemini_flusso per ogni riga completata
+
+    Returns:
+        lista di Stadio
     """
 
-    logger.info("=== Avvio generazione dataset sintetico ===")
-
-    # path fisso al file JSON
-    json_tag_path = os.path.join("app", "data", "tag_map.json")
-
-    # 1. Preparazione dataset vuoti con intestazioni
-    yield {"progress": 0, "message": "Preparazione dataset..."}
-
-    df_user = pd.DataFrame(columns=[
-        "id","auth","confirmed","policyagreed","deleted","suspended","mnethostid",
-        "username","password","idnumber","firstname","lastname","email","emailstop",
-        "icq","skype","yahoo","aim","msn","phone1","phone2","institution","department",
-        "address","city","country","lang","calendartype","theme","timezone","firstaccess",
-        "lastaccess","lastlogin","currentlogin","lastip","secret","picture","url",
-        "description","descriptionformat","mailformat","maildigest","maildisplay",
-        "autosubscribe","trackforums","timecreated","timemodified","trustbitmask",
-        "imagealt","lastnamephonetic","firstnamephonetic","middlename","alternatename",
-        "moodlenetprofile"
-    ])
-
-    df_course = pd.DataFrame(columns=[
-        "id","category","sortorder","fullname","shortname","idnumber","summary","summaryformat",
-        "format","showgrades","newsitems","startdate","enddate","relativedatesmode","marker",
-        "maxbytes","legacyfiles","showreports","visible","visibleold","downloadcontent",
-        "groupmode","groupmodeforce","defaultgroupingid","lang","calendartype","theme",
-        "timecreated","timemodified","requested","enablecompletion","completionnotify",
-        "cacherev","originalcourseid","showactivitydates","showcompletionconditions",
-        "pdfexportfont","course_level"
-    ])
-
-    df_resource = pd.DataFrame(columns=[
-        "id","course","name","intro","introformat","tobemigrated","legacyfiles",
-        "legacyfileslast","display","displayoptions","filterfiles","revision",
-        "timemodified","resource_level","feedback_score","uploaded_by"
-    ])
-
-    df_context = pd.DataFrame(columns=[
-        "id","contextlevel","instanceid","path","depth","locked"
-    ])
-
-    df_role_assignments = pd.DataFrame(columns=[
-        "id","roleid","contextid","userid","timemodified","modifierid","component","itemid","sortorder"
-    ])
-
-    # tabelle fisse
-    df_course_categories = pd.DataFrame([
-        [30,"Abilità Comunicative",None,"Sviluppo delle capacità di espressione, ascolto e interazione efficace.",0,0,0,0,1,1,0,0,None,None],
-        [31,"Abilità Informatiche",None,"Competenze digitali e tecniche per l'uso consapevole delle tecnologie",0,0,0,0,1,1,0,0,None,None],
-        [32,"Competenze in Economia",None,"Conoscenze di base e avanzate in economia, finanza e gestione.",0,0,0,0,1,1,0,0,None,None],
-        [33,"Sviluppo Personale",None,"Percorsi per la crescita individuale, la motivazione e la consapevolezza.",0,0,0,0,1,1,0,0,None,None],
-        [34,"Visione Imprenditoriale",None,"Formazione orientata all'innovazione, leadership e creazione d'impresa.",0,0,0,0,1,1,0,0,None,None]
-    ], columns=[
-        "id","name","idnumber","description","descriptionformat","parent","sortorder",
-        "coursecount","visible","visibleold","timemodified","depth","path","theme"
-    ])
-
-    df_role = pd.DataFrame([
-        [1,"","manager","",1,"manager"],
-        [2,"","coursecreator","",2,"coursecreator"],
-        [3,"","editingteacher","",3,"editingteacher"],
-        [4,"","teacher","",4,"teacher"],
-        [5,"","student","",5,"student"],
-        [6,"","guest","",6,"guest"],
-        [7,"","user","",7,"user"],
-        [8,"","frontpage","",8,"frontpage"]
-    ], columns=["id","name","shortname","description","sortorder","archetype"])
+    # chiavi primarie e chiavi esterne
+    def chiavi_user(t):
+        df_user = genera_chiavi_primarie(t["user"], n_utenti)
+        check_or_raise(verifica_chiavi_primarie(df_user), "PK non valide in mdl_user")
+        return {"user": df_user}
+
+    def chiavi_course(t):
+        df_course = genera_chiavi_primarie(t["course"], n_corsi)
+        check_or_raise(verifica_chiavi_primarie(df_course), "PK non valide in mdl_course")
+        df_course = genera_chiavi_esterne(df_course, "category", t["course_categories"], "id",
+                                          distribuzione=fk_schema_course_category)
+        check_or_raise(verifica_chiavi_esterne(df_course, "category", t["course_categories"], "id"),
+                       "FK category non valida in mdl_course")
+        return {"course": df_course}
+
+    def chiavi_resource(t):
+        df_resource = genera_chiavi_primarie(t["resource"], n_risorse)
+        check_or_raise(verifica_chiavi_primarie(df_resource), "PK non valide in mdl_resource")
+        df_resource = genera_chiavi_esterne(df_resource, "course", t["course"], "id",
+                                            distribuzione=fk_schema_resource_course)
+        df_resource = genera_chiavi_esterne(df_resource, "uploaded_by", t["user"], "id",
+                                            distribuzione=fk_schema_resource_uploaded_by)
+        check_or_raise(verifica_chiavi_esterne(df_resource, "course", t["course"], "id"),
+                       "FK course non valida in mdl_resource")
+        check_or_raise(verifica_chiavi_esterne(df_resource, "uploaded_by", t["user"], "id"),
+                       "FK uploaded_by non valida in mdl_resource")
+        return {"resource": df_resource}
+
+    # context e role_assignments
+    def context(t):
+        df_context = build_mdl_context(t["course"], t["resource"])
+        check_or_raise(verifica_context(df_context, t["course"], t["resource"]), "mdl_context non valida.")
+        return {"context": df_context}
+
+    def role_assignments(t):
+        df_role_assignments = build_mdl_role_assignments(t["context"], t["resource"], t["user"])
+        check_or_raise(verifica_role_assignments(df_role_assignments, t["context"], t["user"]),
+                       "mdl_role_assignments non valida.")
+        return {"role_assignments": df_role_assignments}
+
+    # Faker: uno stadio per tabella, shard sui processi condivisi di stadio_faker
+    def faker(nome):
+        def esegui(t):
+            riempite = stadio_faker.riempi({nome: t[nome]})
+            if nome == "resource":
+                check_or_raise(verifica_range(riempite[nome], "feedback_score", 1.0, 5.0),
+                               "Valori fuori range in feedback_score")
+            return riempite
+        uscite = [f"{nome}.{col}" for col in stadio_faker.colonne_generate(nome)]
+        return Stadio(f"faker_{nome}", esegui, [f"{nome}.id"], uscite)
+
+    # Gemini
+    def course_testi(t):
+        df_course = build_course_testi(t["course"], t["course_categories"])
+        check_or_raise(verifica_range(df_course, "course_level", 1, 5), "Valori fuori range in course_level")
+        return {"course": df_course}
 
+    def resource_testi(t):
+        df_resource = build_resource_testi(t["resource"], t["course"])
+        check_or_raise(verifica_range(df_resource, "resource_level", 1, 5), "Valori fuori range in resource_level")
+        return {"resource": df_resource}
 
-    # 2. Chiavi primarie e chiavi esterne
-    yield {"progress": 15, "message": "Generazione chiavi primarie e chiavi esterne..."}
+    def course_level(t):
+        df_course = build_course_level(t["course"])
+        check_or_raise(verifica_range(df_course, "course_level", 1, 5), "Valori fuori range in course_level")
+        return {"course": df_course}
 
-    df_user = genera_chiavi_primarie(df_user, n_utenti)
-    df_course = genera_chiavi_primarie(df_course, n_corsi)
-    df_resource = genera_chiavi_primarie(df_resource, n_risorse)
+    def resource_level(t):
+        df_resource = build_resource_level(t["resource"], t["course"])
+        check_or_raise(verifica_range(df_resource, "resource_level", 1, 5), "Valori fuori range in resource_level")
+        return {"resource": df_resource}
+
+    # tag
+    def tag(t):
+        return {"tag": genera_tabella_tag(json_tag_path)}
+
+    def category_tag(t):
+        return {"category_tag": genera_tabella_category_tag(json_tag_path, t["course_categories"], t["tag"])}
+
+    def course_tag(t):
+        return {"course_tag": genera_tabella_course_tag(t["course"], t["category_tag"], t["tag"])}
+
+    def resource_tag(t):
+        df_tag, df_resource_tag = genera_tabella_resource_tag(t["resource"], t["tag"])
+        check_or_raise(verifica_unicita(df_tag, "name"), "Duplicati in tag.name")
+        return {"tag": df_tag, "resource_tag": df_resource_tag}
+
+    stadi = [
+        Stadio("chiavi_user", chiavi_user, ["user"], ["user"]),
+        Stadio("chiavi_course", chiavi_course, ["course", "course_categories"], ["course"]),
+        Stadio("chiavi_resource", chiavi_resource, ["resource", "course.id", "user.id"], ["resource"]),
+        Stadio("context", context, ["course.id", "resource.id"], ["context"]),
+        Stadio("role_assignments", role_assignments,
+               ["context.id", "context.contextlevel", "context.instanceid",
+                "resource.id", "resource.uploaded_by", "user.id"],
+               ["role_assignments"]),
+        faker("user"),
+        faker("course"),
+        faker("resource"),
+        faker("context"),
+        faker("role_assignments")
+    ]
+
+    def testi_flusso(t):
+        df_course, df_resource = build_testi_flusso(
+            t["course"], t["resource"], t["course_categories"], settings.GEMINI_GENERAZIONE_FUSA,
+            al_progresso_gemini
+        )
+        check_or_raise(verifica_range(df_course, "course_level", 1, 5), "Valori fuori range in course_level")
+        check_or_raise(verifica_range(df_resource, "resource_level", 1, 5), "Valori fuori range in resource_level")
+        return {"course": df_course, "resource": df_resource}
+
+    if usa_gemini and settings.GEMINI_FLUSSO:
+        # corsi e risorse in un unico stadio: le righe avanzano tra le colonne una per una
+        stadi.append(Stadio(
+            "gemini_flusso", testi_flusso,
+            ["course.id", "course.category", "course_categories", "resource.course"],
+            ["course.fullname", "course.shortname", "course.summary", "course.course_level",
+             "resource.name", "resource.intro", "resource.resource_level"],
+            "gemini"
+        ))
+    elif usa_gemini and settings.GEMINI_GENERAZIONE_FUSA:
+        # una risposta JSON per riga riempie tutte le colonne testuali
+        stadi += [
+            Stadio("gemini_course", course_testi,
+                   ["course.category", "course_categories"],
+                   ["course.fullname", "course.shortname", "course.summary", "course.course_level"], "gemini"),
+            Stadio("gemini_resource", resource_testi,
+                   ["resource.course", "course.id", "course.fullname", "course.summary", "course.course_level"],
+                   ["resource.name", "resource.intro", "resource.resource_level"], "gemini")
+        ]
+    elif usa_gemini:
+        # una colonna per stadio: shortname e summary partono insieme dopo fullname
+        stadi += [
+            Stadio("gemini_course_fullname", lambda t: {"course": build_course_fullname(t["course"], t["course_categories"])},
+                   ["course.category", "course_categories"], ["course.fullname"], "gemini"),
+            Stadio("gemini_course_shortname", lambda t: {"course": build_course_shortname(t["course"])},
+                   ["course.fullname"], ["course.shortname"], "gemini"),
+            Stadio("gemini_course_summary", lambda t: {"course": build_course_summary(t["course"])},
+                   ["course.fullname"], ["course.summary"], "gemini"),
+            Stadio("gemini_course_level", course_level,
+                   ["course.fullname", "course.summary"], ["course.course_level"], "gemini"),
+            Stadio("gemini_resource_name", lambda t: {"resource": build_resource_name(t["resource"], t["course"])},
+                   ["resource.course", "course.id", "course.fullname", "course.summary"], ["resource.name"], "gemini"),
+            Stadio("gemini_resource_intro", lambda t: {"resource": build_resource_intro(t["resource"])},
+                   ["resource.name"], ["resource.intro"], "gemini"),
+            Stadio("gemini_resource_level", resource_level,
+                   ["resource.course", "resource.name", "resource.intro", "course.id", "course.course_level"],
+                   ["resource.resource_level"], "gemini")
+        ]
+
+    stadi += [
+        Stadio("tag", tag, [], ["tag"], "io"),
+        Stadio("category_tag", category_tag, ["course_categories", "tag"], ["category_tag"], "io"),
+        Stadio("course_tag", course_tag,
+               ["course.id", "course.category", "course.fullname", "course.summary", "category_tag", "tag"],
+               ["course_tag"], "gemini"),
+        Stadio("resource_tag", resource_tag,
+               ["resource.id", "resource.name", "resource.intro", "tag"],
+               ["tag", "resource_tag"], "gemini")
+    ]
+    return stadi
 
-    check_or_raise(verifica_chiavi_primarie(df_user), "PK non valide in mdl_user")
-    check_or_raise(verifica_chiavi_primarie(df_course), "PK non valide in mdl_course")
-    check_or_raise(verifica_chiavi_primarie(df_resource), "PK non valide in mdl_resource")
 
 
-    df_course = genera_chiavi_esterne(df_course, "category", df_course_categories, "id")
-    df_resource = genera_chiavi_esterne(df_resource, "course", df_course, "id")
-    df_resource = genera_chiavi_esterne(df_resource, "uploaded_by", df_user, "id")
+# versione a step
+def genera_dataset_steps(n_utenti: int, n_corsi: int, n_risorse: int, job_id: str):
+    """
+    Orchestratore end-to-end, eseguito in un thread del JobManager:
+    1. prepara i dataset con intestazioni corrette e tabelle statiche
+    2. esegue gli stadi di stadi_pipeline (chiavi, context e role_assignments,
+       Faker, Gemini, tag) appena i loro ingressi sono pronti, in parallelo
+    3. salva il risultato e riporta il percorso critico
 
-    check_or_raise(verifica_chiavi_esterne(df_course, "category", df_course_categories, "id"),
-                   "FK category non valida in mdl_course")
-    check_or_raise(verifica_chiavi_esterne(df_resource, "course", df_course, "id"),
-                   "FK course non valida in mdl_resource")
-    check_or_raise(verifica_chiavi_esterne(df_resource, "uploaded_by", df_user, "id"),
-                   "FK uploaded_by non valida in mdl_resource")
-    
+    Un evento di avanzamento per ogni stadio completato e, durante la
+    generazione a flusso, uno al secondo con le righe Gemini completate.
+    """
 
-    # 3. context e role_assignments
-    yield {"progress": 30, "message": "Popolamento mdl_context e mdl_role_assignments..."}
+    logger.info("=== Avvio generazione dataset sintetico ===")
 
-    df_context = build_mdl_context(df_course, df_resource)
-    df_role_assignments = build_mdl_role_assignments(df_context, df_resource, df_user)
+    # path fisso al file JSON
+    json_tag_path = os.path.join("app", "data", "tag_map.json")
 
-    check_or_raise(verifica_context(df_context, df_course, df_resource), "mdl_context non valida.")
-    check_or_raise(verifica_role_assignments(df_role_assignments, df_context, df_user), "mdl_role_assignments non valida.")
+    # 1. Preparazione dataset vuoti con intestazioni
+    yield {"progress": 0, "message": "Preparazione dataset..."}
 
+    (df_user, df_course, df_resource, df_context, df_role_assignments,
+     df_course_categories, df_role) = prepara_tabelle()
+    tabelle = {
+        "user": df_user,
+        "course": df_course,
+        "resource": df_resource,
+        "context": df_context,
+        "role_assignments": df_role_assignments,
+        "course_categories": df_course_categories,
+        "role": df_role
+    }
+    usa_gemini = safe_init_gemini()
 
-    # 4. Faker
-    yield {"progress": 45, "message": "Generazione con Faker..."}
 
-    df_user = riempi_colonne_da_schema(df_user, faker_schema_user)
-    df_user = riempi_utenti_coerenti(df_user)
-    df_course = riempi_colonne_da_schema(df_course, faker_schema_course)
-    df_resource = riempi_colonne_da_schema(df_resource, faker_schema_resource)
-    df_context = riempi_colonne_da_schema(df_context, faker_schema_context)
-    df_role_assignments = riempi_colonne_da_schema(df_role_assignments, faker_schema_role_assignments)
+    # 2. Stadi eseguiti per dipendenze
+    # shard Faker in processi separati, riproducibili con settings.FAKER_SEED
+    schemi_faker = {
+        "user": faker_schema_user,
+        "course": faker_schema_course,
+        "resource": faker_schema_resource,
+        "context": faker_schema_context,
+        "role_assignments": faker_schema_role_assignments
+    }
+    with StadioFaker(schemi_faker, tabella_utenti="user", righe_max=max(n_utenti, n_corsi + n_risorse)) as stadio_faker:
+        # aggiornato dal thread dello stadio Gemini, letto qui a ogni intervallo
+        righe_gemini = {}
+        stadi = stadi_pipeline(
+            n_utenti, n_corsi, n_risorse, json_tag_path, stadio_faker, usa_gemini,
+            al_progresso_gemini=lambda scritte, totali: righe_gemini.update(scritte=scritte, totali=totali)
+        )
+        scheduler = SchedulerStadi(stadi, tabelle)
+        completati = 0
+        ultimo_avanzamento = None
+        for stadio in scheduler.esegui(intervallo=1.0):
+            if stadio is None:
+                avanzamento = (righe_gemini.get("scritte"), righe_gemini.get("totali"))
+                if righe_gemini and avanzamento != ultimo_avanzamento:
+                    ultimo_avanzamento = avanzamento
+                    yield {
+                        "progress": 5 + 90 * completati // len(stadi),
+                        "message": f"Testi Gemini: {righe_gemini['scritte']}/{righe_gemini['totali']} righe"
+                    }
+                continue
+            completati += 1
+            yield {
+                "progress": 5 + 90 * completati // len(stadi),
+                "message": f"Stadio {stadio.nome} completato ({completati}/{len(stadi)})"
+            }
 
-    check_or_raise(verifica_range(df_resource, "feedback_score", 1.0, 5.0), "Valori fuori range in feedback_score")
+    logger.info("=== Dataset generato e validato con successo ===")
 
-    # 5. Gemini
-    yield {"progress": 60, "message": "Generazione con Gemini..."}
+    # i valori nulli restano NA: ci pensano CSV/JSON/Arrow a serializzarli
+    dfs = {
+        "mdl_user": scheduler.tabelle["user"],
+        "mdl_course": scheduler.tabelle["course"],
+        "mdl_resource": scheduler.tabelle["resource"],
+        "mdl_context": scheduler.tabelle["context"],
+        "mdl_role": scheduler.tabelle["role"],
+        "mdl_role_assignments": scheduler.tabelle["role_assignments"],
+        "mdl_course_categories": scheduler.tabelle["course_categories"],
+        "tag": scheduler.tabelle["tag"],
+        "category_tag": scheduler.tabelle["category_tag"],
+        "course_tag": scheduler.tabelle["course_tag"],
+        "resource_tag": scheduler.tabelle["resource_tag"]
+    }
+    dfs = {nome: df.infer_objects() for nome, df in dfs.items()}
 
-    if safe_init_gemini():
-        df_course = build_course_fullname(df_course, df_course_categories)
-        df_course = build_course_shortname(df_course)
-        df_course = build_course_summary(df_course)
-        df_course = build_course_level(df_course)
+    result_store.salva(job_id, dfs)
 
-        df_resource = build_resource_name(df_resource, df_course)
-        df_resource = build_resource_intro(df_resource)
-        df_resource = build_resource_level(df_resource, df_course)
+    # l'evento finale porta solo il conteggio righe: i dati si leggono a pagine da /dataset/{job_id}/tables
+    yield {
+        "progress": 100, 
+        "message": "Generazione dati sintetici completata!", 
+        "tables": {nome: len(df) for nome, df in dfs.items()},
+        "critical_path": scheduler.percorso_critico()
+    }
+    return
+    
 
-        check_or_raise(verifica_range(df_course, "course_level", 1, 5), "Valori fuori range in course_level")
-        check_or_raise(verifica_range(df_resource, "resource_level", 1, 5), "Valori fuori range in resource_level")
 
+# versione a chunk, verso file su disco
+def genera_dataset_streaming(
+    n_utenti: int,
+    n_corsi: int,
+    n_risorse: int,
+    job_id: str,
+    formato: str = "csv",
+    righe_chunk: Optional[int] = None,
+    sink: Optional[SinkTabelle] = None
+):
+    """
+    Orchestratore a chunk per dataset più grandi della memoria, eseguito in un
+    thread del JobManager. Chiavi, Faker, context/role_assignments e
+    validazione lavorano un chunk per volta e ogni chunk finito viene scritto
+    subito sul sink: la memoria resta proporzionale a righe_chunk (più uno
+    stato per riga genitore: pesi delle FK e hash degli username).
+
+    Le tabelle escono nell'ordine di caricamento: ruoli e categorie, utenti,
+    corsi (con i loro context e role_assignments), risorse (idem). Le colonne
+    Gemini e le tabelle dei tag richiedono le tabelle intere e non vengono
+    generate in questa modalità.
+
+    Args:
+        n_utenti, n_corsi, n_risorse: righe delle tabelle principali
+        job_id: id del job, usato per la cartella di output
+        formato: csv, csv.gz, parquet o sql (ignorato se si passa sink)
+        righe_chunk: righe per chunk (default settings.STREAMING_CHUNK_RIGHE)
+        sink: destinazione alternativa (es. SinkDb)
+    """
+    logger.info("=== Avvio generazione dataset sintetico a chunk ===")
 
-    # 6. Tag
-    yield {"progress": 90, "message": "Generazione tag..."}
-    df_tag = genera_tabella_tag(json_tag_path)
-    df_category_tag = genera_tabella_category_tag(json_tag_path, df_course_categories, df_tag)
-    df_course_tag = genera_tabella_course_tag(df_course, df_category_tag, df_tag)
-    df_tag, df_resource_tag = genera_tabella_resource_tag(df_resource, df_tag)
+    # chunk multipli degli shard Faker e stesse chiavi e righe_max dello StadioFaker
+    # in memoria: con lo stesso seed gli utenti escono identici alla generazione in memoria
+    righe_shard = settings.FAKER_SHARD_RIGHE
+    righe_chunk = righe_chunk or settings.STREAMING_CHUNK_RIGHE
+    righe_chunk = max(righe_shard, righe_chunk // righe_shard * righe_shard)
 
-    check_or_raise(verifica_unicita(df_tag, "name"), "Duplicati in tag.name")
+    directory = None
+    if sink is None:
+        directory = os.path.join(settings.STREAMING_DIR, job_id)
+        sink = crea_sink(formato, directory)
 
-    logger.info("=== Dataset generato e validato con successo ===")
+    yield {"progress": 0, "message": "Preparazione dataset..."}
 
-    df_user = df_user.fillna("").infer_objects(copy=False)
-    df_course = df_course.fillna("").infer_objects(copy=False)
-    df_resource = df_resource.fillna("").infer_objects(copy=False)
-    df_context = df_context.fillna("").infer_objects(copy=False)
-    df_role = df_role.fillna("").infer_objects(copy=False)
-    df_role_assignments = df_role_assignments.fillna("").infer_objects(copy=False)
-    df_course_categories = df_course_categories.fillna("").infer_objects(copy=False)
-    df_tag = df_tag.fillna("").infer_objects(copy=False)
-    df_category_tag = df_category_tag.fillna("").infer_objects(copy=False)
-    df_course_tag = df_course_tag.fillna("").infer_objects(copy=False)
-    df_resource_tag = df_resource_tag.fillna("").infer_objects(copy=False)
-
-    result = {
-        "mdl_user": df_user.to_dict(orient="records"),
-        "mdl_course": df_course.to_dict(orient="records"),
-        "mdl_resource": df_resource.to_dict(orient="records"),
-        "mdl_context": df_context.to_dict(orient="records"),
-        "mdl_role": df_role.to_dict(orient="records"),
-        "mdl_role_assignments": df_role_assignments.to_dict(orient="records"),
-        "mdl_course_categories": df_course_categories.to_dict(orient="records"),
-        "tag": df_tag.to_dict(orient="records"),
-        "category_tag": df_category_tag.to_dict(orient="records"),
-        "course_tag": df_course_tag.to_dict(orient="records"),
-        "resource_tag": df_resource_tag.to_dict(orient="records")
-    }
+    (df_user, df_course, df_resource, df_context, df_role_assignments,
+     df_course_categories, df_role) = prepara_tabelle()
 
-    request.app.state.last_dfs = {
-        "mdl_user": df_user,
-        "mdl_course": df_course,
-        "mdl_resource": df_resource,
-        "mdl_context": df_context,
-        "mdl_role": df_role,
-        "mdl_role_assignments": df_role_assignments,
-        "mdl_course_categories": df_course_categories,
-        "tag": df_tag,
-        "category_tag": df_category_tag,
-        "course_tag": df_course_tag,
-        "resource_tag": df_resource_tag
+    schemi = {
+        "user": faker_schema_user,
+        "course": faker_schema_course,
+        "resource": faker_schema_resource,
+        "context": faker_schema_context,
+        "role_assignments": faker_schema_role_assignments
     }
+    totale = n_utenti + 2 * n_corsi + 2 * n_risorse
+    scritte = 0
+
+    with sink, StadioFaker(schemi, tabella_utenti="user", righe_max=max(n_utenti, n_corsi + n_risorse)) as stadio:
+        rng = np.random.default_rng(np.random.SeedSequence([stadio.seed, 0]))
+        id_utenti = (1, n_utenti)
+
+        sink.scrivi("mdl_role", df_role)
+        sink.scrivi("mdl_course_categories", df_course_categories)
+
+        # utenti: univocità degli username tra chunk tramite gli hash già assegnati
+        registro = RegistroUnivoci()
+        for inizio in range(0, n_utenti, righe_chunk):
+            chunk = genera_chiavi_primarie(df_user.iloc[:0].copy(), min(righe_chunk, n_utenti - inizio),
+                                           primo_id=inizio + 1)
+            check_or_raise(verifica_chiavi_primarie(chunk), "PK non valide in mdl_user")
+            chunk = stadio.riempi({"user": chunk}, registro)["user"]
+            sink.scrivi("mdl_user", chunk)
+
+            scritte += len(chunk)
+            yield {"progress": 5 + 90 * scritte // totale, "message": f"mdl_user: {inizio + len(chunk)}/{n_utenti} righe"}
+
+        # corsi, con i loro context e role_assignments
+        fk_category = GeneratoreChiaviEsterne(n_corsi, df_course_categories["id"].to_numpy(), rng,
+                                              fk_schema_course_category)
+        for inizio in range(0, n_corsi, righe_chunk):
+            chunk = genera_chiavi_primarie(df_course.iloc[:0].copy(), min(righe_chunk, n_corsi - inizio),
+                                           primo_id=inizio + 1)
+            check_or_raise(verifica_chiavi_primarie(chunk), "PK non valide in mdl_course")
+            chunk["category"] = fk_category.prossime(len(chunk))
+            check_or_raise(verifica_chiavi_esterne(chunk, "category", df_course_categories, "id"),
+                           "FK category non valida in mdl_course")
+
+            ctx = build_mdl_context(chunk, df_resource.iloc[:0], primo_id=inizio + 1)
+            ra = build_mdl_role_assignments(ctx, df_resource.iloc[:0], rng=rng, primo_id=inizio + 1,
+                                            id_utenti=id_utenti)
+            check_or_raise(verifica_range(ra, "userid", *id_utenti), "mdl_role_assignments non valida.")
+
+            riempite = stadio.riempi({"course": chunk, "context": ctx, "role_assignments": ra})
+            sink.scrivi("mdl_course", riempite["course"])
+            sink.scrivi("mdl_context", riempite["context"])
+            sink.scrivi("mdl_role_assignments", riempite["role_assignments"])
+
+            scritte += 2 * len(chunk)
+            yield {"progress": 5 + 90 * scritte // totale, "message": f"mdl_course: {inizio + len(chunk)}/{n_corsi} righe"}
+
+        # risorse, con i loro context e role_assignments (id dopo quelli dei corsi)
+        fk_course = GeneratoreChiaviEsterne(n_risorse, np.arange(1, n_corsi + 1, dtype=np.int64), rng,
+                                            fk_schema_resource_course)
+        fk_uploaded_by = GeneratoreChiaviEsterne(n_risorse, np.arange(1, n_utenti + 1, dtype=np.int64), rng,
+                                                 fk_schema_resource_uploaded_by)
+        for inizio in range(0, n_risorse, righe_chunk):
+            chunk = genera_chiavi_primarie(df_resource.iloc[:0].copy(), min(righe_chunk, n_risorse - inizio),
+                                           primo_id=inizio + 1)
+            check_or_raise(verifica_chiavi_primarie(chunk), "PK non valide in mdl_resource")
+            chunk["course"] = fk_course.prossime(len(chunk))
+            chunk["uploaded_by"] = fk_uploaded_by.prossime(len(chunk))
+            check_or_raise(verifica_range(chunk, "course", 1, n_corsi), "FK course non valida in mdl_resource")
+            check_or_raise(verifica_range(chunk, "uploaded_by", *id_utenti), "FK uploaded_by non valida in mdl_resource")
+
+            ctx = build_mdl_context(df_course.iloc[:0], chunk, primo_id=n_corsi + inizio + 1)
+            ra = build_mdl_role_assignments(ctx, chunk, rng=rng, primo_id=n_corsi + inizio + 1,
+                                            id_utenti=id_utenti)
+            check_or_raise(verifica_range(ra, "userid", *id_utenti), "mdl_role_assignments non valida.")
+
+            riempite = stadio.riempi({"resource": chunk, "context": ctx, "role_assignments": ra})
+            check_or_raise(verifica_range(riempite["resource"], "feedback_score", 1.0, 5.0),
+                           "Valori fuori range in feedback_score")
+            sink.scrivi("mdl_resource", riempite["resource"])
+            sink.scrivi("mdl_context", riempite["context"])
+            sink.scrivi("mdl_role_assignments", riempite["role_assignments"])
+
+            scritte += 2 * len(chunk)
+            yield {"progress": 5 + 90 * scritte // totale, "message": f"mdl_resource: {inizio + len(chunk)}/{n_risorse} righe"}
+
+    righe = dict(sink.righe)
+    logger.info("=== Dataset a chunk generato e validato con successo ===")
 
     yield {
-        "progress": 100, 
-        "message": "Generazione dati sintetici completata!", 
-        "result": result
+        "progress": 100,
+        "message": "Generazione dati sintetici completata!",
+        "tables": righe,
+        "output": directory
     }
-    return
-    
\ No newline at end of file
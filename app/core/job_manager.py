@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# STATI DEL JOB
+
+STATO_IN_CODA = "in_coda"
+STATO_IN_ESECUZIONE = "in_esecuzione"
+STATO_COMPLETATO = "completato"
+STATO_ERRORE = "errore"
+
+STATI_FINALI = {STATO_COMPLETATO, STATO_ERRORE}
+
+
+
+# JOB
+
+class Job:
+    """
+    Singola esecuzione della pipeline di generazione.
+
+    Il job viene aggiornato dal thread worker e letto dall'event loop:
+    ogni evento viene salvato nello storico e inoltrato alle code asyncio
+    degli iscritti tramite call_soon_threadsafe.
+    """
+
+    def __init__(self, parametri: dict):
+        self.id = uuid.uuid4().hex
+        self.parametri = parametri
+        self.stato = STATO_IN_CODA
+        self.progress = 0
+        self.message = "In coda..."
+        self.errore: Optional[str] = None
+        self.creato = time.time()
+        self.aggiornato = self.creato
+        self.eventi: list[dict] = []
+        self._iscritti: list[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def terminato(self) -> bool:
+        return self.stato in STATI_FINALI
+
+    def snapshot(self) -> dict:
+        """Stato corrente del job, senza lo storico degli eventi."""
+        return {
+            "job_id": self.id,
+            "status": self.stato,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.errore,
+            "parametri": self.parametri,
+            "creato": self.creato,
+            "aggiornato": self.aggiornato
+        }
+
+    def pubblica(self, evento: dict):
+        """
+        Registra un evento e lo inoltra agli iscritti. Thread-safe.
+        """
+        evento = {"job_id": self.id, "status": self.stato, **evento}
+        with self._lock:
+            self.progress = evento.get("progress", self.progress)
+            self.message = evento.get("message", self.message)
+            self.aggiornato = time.time()
+            self.eventi.append(evento)
+            iscritti = list(self._iscritti)
+
+        for loop, coda in iscritti:
+            try:
+                loop.call_soon_threadsafe(coda.put_nowait, evento)
+            except RuntimeError:
+                # event loop già chiuso: l'iscritto non è più in ascolto
+                pass
+
+    def iscrivi(self, loop: asyncio.AbstractEventLoop) -> asyncio.Queue:
+        """
+        Crea una coda asyncio già popolata con lo storico degli eventi.
+        Va chiamata dall'event loop che consumerà la coda.
+        """
+        coda: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            for evento in self.eventi:
+                coda.put_nowait(evento)
+            self._iscritti.append((loop, coda))
+        return coda
+
+    def disiscrivi(self, coda: asyncio.Queue):
+        with self._lock:
+            self._iscritti = [(l, c) for l, c in self._iscritti if c is not coda]
+
+
+
+# GESTORE DEI JOB
+
+class JobManager:
+    """
+    Esegue le pipeline di generazione su un pool di thread,
+    così l'event loop di uvicorn resta libero per le altre richieste.
+    """
+
+    def __init__(self, max_workers: int, retention_seconds: int):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def crea_job(self, pipeline: Callable[..., Iterator[dict]], **parametri: Any) -> Job:
+        """
+        Registra un nuovo job e ne avvia l'esecuzione in background.
+
+        Args:
+            pipeline: generatore che produce eventi {"progress": int, "message": str, ...};
+                riceve job_id come argomento keyword
+            parametri: argomenti passati alla pipeline
+
+        Returns:
+            Job creato
+        """
+        self._pulisci_scaduti()
+
+        job = Job({k: v for k, v in parametri.items() if isinstance(v, (int, float, str, bool))})
+        with self._lock:
+            self._jobs[job.id] = job
+
+        job.pubblica({"progress": 0, "message": job.message})
+        self._executor.submit(self._esegui, job, pipeline, parametri)
+        logger.info(f"Job {job.id} creato con parametri {job.parametri}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def lista(self) -> list[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _esegui(self, job: Job, pipeline: Callable[..., Iterator[dict]], parametri: dict):
+        job.stato = STATO_IN_ESECUZIONE
+        try:
+            for step in pipeline(job_id=job.id, **parametri):
+                if step.get("progress") == 100:
+                    job.stato = STATO_COMPLETATO
+                job.pubblica(step)
+                if job.stato == STATO_COMPLETATO:
+                    break
+            else:
+                job.stato = STATO_COMPLETATO
+                job.pubblica({"progress": 100, "message": "Generazione completata"})
+            logger.info(f"Job {job.id} completato")
+        except Exception as e:
+            logger.exception(f"Job {job.id} fallito: {e}")
+            job.errore = str(e)
+            job.stato = STATO_ERRORE
+            job.pubblica({"message": f"Errore: {e}", "error": str(e)})
+
+    async def ascolta(self, job: Job) -> AsyncIterator[dict]:
+        """
+        Restituisce gli eventi del job (storico + nuovi) fino allo stato finale.
+        """
+        coda = job.iscrivi(asyncio.get_running_loop())
+        try:
+            while True:
+                evento = await coda.get()
+                yield evento
+                if evento.get("status") in STATI_FINALI:
+                    return
+        finally:
+            job.disiscrivi(coda)
+
+    def _pulisci_scaduti(self):
+        """Rimuove i job terminati da più di retention_seconds."""
+        limite = time.time() - self.retention_seconds
+        with self._lock:
+            scaduti = [jid for jid, j in self._jobs.items() if j.terminato and j.aggiornato < limite]
+            for jid in scaduti:
+                del self._jobs[jid]
+        if scaduti:
+            logger.info(f"Rimossi {len(scaduti)} job scaduti")
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+job_manager = JobManager(settings.JOB_MAX_WORKERS, settings.JOB_RETENTION_SECONDS)
@@ -0,0 +1,174 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import pandas as pd
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def memoria_tabelle(dfs: dict[str, pd.DataFrame]) -> int:
+    """Occupazione in byte di un insieme di DataFrame (stringhe incluse)."""
+    return int(sum(df.memory_usage(index=True, deep=True).sum() for df in dfs.values()))
+
+
+
+# VOCE DELLO STORE
+
+class _Risultato:
+    def __init__(self, job_id: str, dfs: Optional[dict[str, pd.DataFrame]], n_bytes: int):
+        self.job_id = job_id
+        self.dfs = dfs                  # None se il risultato è stato scaricato su disco
+        self.n_bytes = n_bytes
+        self.righe = {nome: len(df) for nome, df in (dfs or {}).items()}
+        self.creato = time.time()
+        self.ultimo_accesso = self.creato
+        self.su_disco: Optional[str] = None
+
+    @property
+    def in_memoria(self) -> bool:
+        return self.dfs is not None
+
+
+
+# STORE DEI RISULTATI
+
+class ResultStore:
+    """
+    Conserva i DataFrame generati da ciascun job, indicizzati per job_id.
+
+    - LRU: i risultati meno usati di recente vengono rimossi (o scaricati
+      su disco se spill_dir è configurata) quando si supera max_bytes
+    - TTL: i risultati più vecchi di ttl_seconds vengono eliminati
+    """
+
+    def __init__(self, max_bytes: int, ttl_seconds: int, spill_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self._risultati: "OrderedDict[str, _Risultato]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    @property
+    def bytes_in_memoria(self) -> int:
+        return sum(r.n_bytes for r in self._risultati.values() if r.in_memoria)
+
+    def salva(self, job_id: str, dfs: dict[str, pd.DataFrame]):
+        """
+        Registra le tabelle di un job e applica le politiche di eviction.
+        """
+        risultato = _Risultato(job_id, dfs, memoria_tabelle(dfs))
+        with self._lock:
+            self._rimuovi(job_id)
+            self._risultati[job_id] = risultato
+            logger.info(f"Risultato del job {job_id} salvato ({risultato.n_bytes / 1e6:.1f} MB)")
+            self._applica_limiti()
+
+    def get(self, job_id: str) -> Optional[dict[str, pd.DataFrame]]:
+        """
+        Restituisce le tabelle del job, ricaricandole da disco se necessario.
+        None se il job non esiste o è scaduto.
+        """
+        with self._lock:
+            self._rimuovi_scaduti()
+            risultato = self._risultati.get(job_id)
+            if risultato is None:
+                return None
+
+            risultato.ultimo_accesso = time.time()
+            self._risultati.move_to_end(job_id)
+
+            if not risultato.in_memoria:
+                risultato.dfs = self._carica_da_disco(risultato)
+                self._applica_limiti()
+            return risultato.dfs
+
+    def get_tabella(self, job_id: str, nome: str) -> Optional[pd.DataFrame]:
+        dfs = self.get(job_id)
+        if dfs is None:
+            return None
+        return dfs.get(nome)
+
+    def righe(self, job_id: str) -> Optional[dict[str, int]]:
+        """Numero di righe per tabella, senza ricaricare i dati da disco."""
+        with self._lock:
+            risultato = self._risultati.get(job_id)
+            return dict(risultato.righe) if risultato else None
+
+    def rimuovi(self, job_id: str):
+        with self._lock:
+            self._rimuovi(job_id)
+
+    def statistiche(self) -> dict:
+        with self._lock:
+            return {
+                "risultati": len(self._risultati),
+                "in_memoria": sum(1 for r in self._risultati.values() if r.in_memoria),
+                "su_disco": sum(1 for r in self._risultati.values() if not r.in_memoria),
+                "bytes_in_memoria": self.bytes_in_memoria,
+                "max_bytes": self.max_bytes
+            }
+
+
+
+    # EVICTION
+
+    def _applica_limiti(self):
+        self._rimuovi_scaduti()
+
+        # il risultato più recente resta sempre in memoria, anche se da solo supera il budget
+        candidati = [r for r in list(self._risultati.values())[:-1] if r.in_memoria]
+        for risultato in candidati:
+            if self.bytes_in_memoria <= self.max_bytes:
+                break
+            if self.spill_dir:
+                self._scarica_su_disco(risultato)
+            else:
+                logger.info(f"Eviction LRU del job {risultato.job_id}")
+                self._rimuovi(risultato.job_id)
+
+    def _rimuovi_scaduti(self):
+        limite = time.time() - self.ttl_seconds
+        scaduti = [jid for jid, r in self._risultati.items() if r.creato < limite]
+        for job_id in scaduti:
+            logger.info(f"Risultato del job {job_id} scaduto (TTL)")
+            self._rimuovi(job_id)
+
+    def _rimuovi(self, job_id: str):
+        risultato = self._risultati.pop(job_id, None)
+        if risultato is not None and risultato.su_disco:
+            shutil.rmtree(risultato.su_disco, ignore_errors=True)
+
+
+
+    # SPILL SU DISCO
+
+    def _scarica_su_disco(self, risultato: _Risultato):
+        cartella = os.path.join(self.spill_dir, risultato.job_id)
+        if risultato.su_disco is None:
+            os.makedirs(cartella, exist_ok=True)
+            for nome, df in risultato.dfs.items():
+                df.to_pickle(os.path.join(cartella, f"{nome}.pkl"))
+            risultato.su_disco = cartella
+        risultato.dfs = None
+        logger.info(f"Risultato del job {risultato.job_id} scaricato su disco in {cartella}")
+
+    def _carica_da_disco(self, risultato: _Risultato) -> dict[str, pd.DataFrame]:
+        logger.info(f"Ricarico da disco il risultato del job {risultato.job_id}")
+        return {
+            nome: pd.read_pickle(os.path.join(risultato.su_disco, f"{nome}.pkl"))
+            for nome in risultato.righe
+        }
+
+
+result_store = ResultStore(
+    settings.RESULT_STORE_MAX_BYTES,
+    settings.RESULT_STORE_TTL_SECONDS,
+    settings.RESULT_STORE_SPILL_DIR
+)
@@ -0,0 +1,245 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+import pandas as pd
+
+from app.services.generators.faker_generator import sostituisci_colonne
+
+logger = logging.getLogger(__name__)
+
+# cpu: calcolo locale (lo stadio Faker distribuisce gli shard sui processi)
+# gemini: richieste al modello, eseguite come task asyncio dallo stadio
+# io: lettura di file
+TIPI_STADIO = ("cpu", "gemini", "io")
+
+
+
+# STADI DELLA PIPELINE
+
+class Stadio:
+    """
+    Passo della pipeline con ingressi e uscite dichiarati come "tabella"
+    (tabella intera) o "tabella.colonna".
+
+    La funzione riceve {tabella: DataFrame} con le tabelle degli ingressi e
+    restituisce {tabella: DataFrame}: per le uscite "tabella" viene presa la
+    tabella restituita, per le uscite "tabella.colonna" solo le colonne
+    dichiarate, scritte nella tabella corrente.
+    """
+
+    def __init__(
+        self,
+        nome: str,
+        funzione: Callable[[Dict[str, pd.DataFrame]], Dict[str, pd.DataFrame]],
+        ingressi: Iterable[str] = (),
+        uscite: Iterable[str] = (),
+        tipo: str = "cpu"
+    ):
+        if tipo not in TIPI_STADIO:
+            raise ValueError(f"Tipo di stadio '{tipo}' non valido. Tipi disponibili: {list(TIPI_STADIO)}")
+        self.nome = nome
+        self.funzione = funzione
+        self.ingressi = list(ingressi)
+        self.uscite = list(uscite)
+        self.tipo = tipo
+
+    @property
+    def tabelle_ingresso(self) -> list[str]:
+        return list(dict.fromkeys(_tabella(voce) for voce in self.ingressi))
+
+    def __repr__(self):
+        return f"Stadio({self.nome!r}, tipo={self.tipo!r})"
+
+
+def _tabella(voce: str) -> str:
+    return voce.split(".", 1)[0]
+
+
+def _sovrapposte(a: str, b: str) -> bool:
+    """True se le due voci toccano gli stessi dati (una tabella intera copre le sue colonne)."""
+    if a == b:
+        return True
+    return _tabella(a) == _tabella(b) and ("." not in a or "." not in b)
+
+
+def _ultimi_scrittori(precedenti: list[Stadio], voce: str) -> set[str]:
+    """
+    Stadi di cui voce vede le scritture: risalendo all'indietro, tutti quelli
+    che scrivono dati sovrapposti fino al primo che la copre per intero.
+    """
+    scrittori = set()
+    for stadio in reversed(precedenti):
+        uscite = [u for u in stadio.uscite if _sovrapposte(u, voce)]
+        if not uscite:
+            continue
+        scrittori.add(stadio.nome)
+        if any(u == voce or "." not in u for u in uscite):
+            break
+    return scrittori
+
+
+def calcola_dipendenze(stadi: list[Stadio], tabelle_iniziali: Iterable[str] = ()) -> Dict[str, set[str]]:
+    """
+    Dipendenze tra stadi ricavate da ingressi e uscite, rispettando l'ordine
+    in cui gli stadi sono elencati: ogni stadio vede gli stessi dati che
+    vedrebbe eseguendo la lista in sequenza.
+
+    - lettura dopo scrittura: chi legge un dato aspetta gli stadi precedenti che lo scrivono
+    - scrittura dopo scrittura: due scritture sugli stessi dati restano in ordine
+    - scrittura dopo lettura: chi sovrascrive un dato aspetta chi lo legge prima
+
+    Raises:
+        ValueError: nomi duplicati o ingressi che nessuno produce
+    """
+    iniziali = set(tabelle_iniziali)
+    nomi = [stadio.nome for stadio in stadi]
+    duplicati = {nome for nome in nomi if nomi.count(nome) > 1}
+    if duplicati:
+        raise ValueError(f"Nomi di stadio duplicati: {sorted(duplicati)}")
+
+    dipendenze: Dict[str, set[str]] = {}
+    for i, stadio in enumerate(stadi):
+        precedenti = stadi[:i]
+        dip = set()
+        for voce in stadio.ingressi:
+            scrittori = _ultimi_scrittori(precedenti, voce)
+            if not scrittori and _tabella(voce) not in iniziali:
+                raise ValueError(f"Ingresso '{voce}' dello stadio '{stadio.nome}' non prodotto da nessuno stadio precedente")
+            dip |= scrittori
+        for voce in stadio.uscite:
+            dip |= _ultimi_scrittori(precedenti, voce)
+            dip |= {
+                p.nome for p in precedenti
+                if any(_sovrapposte(voce, ingresso) for ingresso in p.ingressi)
+            }
+        dipendenze[stadio.nome] = dip
+    return dipendenze
+
+
+
+# ESECUZIONE PER DIPENDENZE
+
+class SchedulerStadi:
+    """
+    Esegue gli stadi appena i loro ingressi sono pronti, in parallelo su un
+    pool di thread: gli stadi cpu pesanti delegano il calcolo ai processi
+    (StadioFaker), gli stadi gemini eseguono le richieste come task asyncio
+    sul proprio event loop, quindi i thread restano per lo più in attesa.
+
+    Ogni stadio riceve una copia superficiale delle tabelle presa quando
+    parte; i risultati vengono scritti nelle tabelle dal thread che consuma
+    esegui(), uno stadio alla volta, quindi non servono lock.
+    """
+
+    def __init__(
+        self,
+        stadi: list[Stadio],
+        tabelle: Dict[str, pd.DataFrame],
+        max_thread: Optional[int] = None
+    ):
+        self.stadi = {stadio.nome: stadio for stadio in stadi}
+        self.dipendenze = calcola_dipendenze(stadi, tabelle)
+        self.tabelle = dict(tabelle)
+        self.max_thread = max_thread or max(1, len(stadi))
+        self.inizio: Dict[str, float] = {}
+        self.fine: Dict[str, float] = {}
+
+    def _esegui_stadio(self, stadio: Stadio, ingressi: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+        self.inizio[stadio.nome] = time.perf_counter()
+        try:
+            return stadio.funzione(ingressi)
+        finally:
+            self.fine[stadio.nome] = time.perf_counter()
+
+    def _applica(self, stadio: Stadio, risultato: Dict[str, pd.DataFrame]):
+        colonne_per_tabella: Dict[str, list[str]] = {}
+        for voce in stadio.uscite:
+            if "." in voce:
+                tabella, colonna = voce.split(".", 1)
+                colonne_per_tabella.setdefault(tabella, []).append(colonna)
+            else:
+                self.tabelle[voce] = risultato[voce]
+
+        for tabella, colonne in colonne_per_tabella.items():
+            base = self.tabelle[tabella]
+            blocco = risultato[tabella][colonne]
+            if len(blocco) != len(base):
+                raise ValueError(
+                    f"Lo stadio '{stadio.nome}' ha restituito {len(blocco)} righe per '{tabella}', attese {len(base)}"
+                )
+            blocco.index = base.index
+            self.tabelle[tabella] = sostituisci_colonne(base, [blocco])
+
+    def esegui(self, intervallo: Optional[float] = None) -> Iterator[Optional[Stadio]]:
+        """
+        Esegue tutti gli stadi e restituisce ciascuno quando termina, già
+        applicato alle tabelle. Al primo errore gli stadi non ancora partiti
+        vengono annullati, si attendono quelli in corso e l'errore viene propagato.
+
+        Con intervallo, restituisce None ogni intervallo secondi senza stadi
+        completati, così chi consuma può riportare l'avanzamento degli stadi lunghi.
+        """
+        mancanti = {nome: set(dip) for nome, dip in self.dipendenze.items()}
+        futuri: Dict[Future, Stadio] = {}
+        inizio = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_thread, thread_name_prefix="stadio") as executor:
+            try:
+                while mancanti or futuri:
+                    pronti = [nome for nome, dip in mancanti.items() if not dip]
+                    for nome in pronti:
+                        del mancanti[nome]
+                        stadio = self.stadi[nome]
+                        ingressi = {t: self.tabelle[t].copy(deep=False) for t in stadio.tabelle_ingresso}
+                        futuri[executor.submit(self._esegui_stadio, stadio, ingressi)] = stadio
+                        logger.info(f"Stadio '{nome}' avviato ({stadio.tipo})")
+
+                    completati, _ = wait(futuri, timeout=intervallo, return_when=FIRST_COMPLETED)
+                    if not completati:
+                        yield None
+                    for futuro in completati:
+                        stadio = futuri.pop(futuro)
+                        self._applica(stadio, futuro.result())
+                        for dip in mancanti.values():
+                            dip.discard(stadio.nome)
+                        logger.info(f"Stadio '{stadio.nome}' completato in {self.durata(stadio.nome):.2f}s")
+                        yield stadio
+            except BaseException:
+                for futuro in futuri:
+                    futuro.cancel()
+                raise
+
+        self._registra_riepilogo(time.perf_counter() - inizio)
+
+    def durata(self, nome: str) -> float:
+        return self.fine[nome] - self.inizio[nome]
+
+    def percorso_critico(self) -> list[dict]:
+        """
+        Catena di dipendenze che ha determinato la durata totale: si parte
+        dallo stadio finito per ultimo e si risale ogni volta alla dipendenza
+        finita per ultima.
+        """
+        if not self.fine:
+            return []
+        nome = max(self.fine, key=self.fine.get)
+        percorso = []
+        while nome is not None:
+            percorso.append(nome)
+            dip = [d for d in self.dipendenze[nome] if d in self.fine]
+            nome = max(dip, key=self.fine.get) if dip else None
+        return [
+            {"stage": nome, "type": self.stadi[nome].tipo, "seconds": round(self.durata(nome), 3)}
+            for nome in reversed(percorso)
+        ]
+
+    def _registra_riepilogo(self, totale: float):
+        somma = sum(self.durata(nome) for nome in self.fine)
+        percorso = self.percorso_critico()
+        catena = " -> ".join(f"{p['stage']} {p['seconds']:.2f}s" for p in percorso)
+        logger.info(
+            f"Pipeline: {len(self.fine)} stadi in {totale:.2f}s (somma delle durate {somma:.2f}s). "
+            f"Percorso critico ({sum(p['seconds'] for p in percorso):.2f}s): {catena}"
+        )
@@ -71,6 +71,8 @@ faker_schema_role_assignments = {
 }
 
 # schema per mdl_user
+# firstname, lastname, username, email, password e timestamp di accesso
+# vengono generati insieme da riempi_utenti_coerenti
 faker_schema_user = {
     "auth": {"func": "riempi_colonna_lista", "args": {"valori": ["email", "manual", "oauth2"]}},
     "confirmed": {"func": "riempi_colonna_default", "args": {"valore": 0}},
@@ -78,7 +80,6 @@ faker_schema_user = {
     "deleted": {"func": "riempi_colonna_default", "args": {"valore": 0}},
     "suspended": {"func": "riempi_colonna_default", "args": {"valore": 0}},
     "mnethostid": {"func": "riempi_colonna_default", "args": {"valore": 1}},
-    "password": {"func": "riempi_colonna_faker", "args": {"tipo": "password"}},
     "idnumber": {"func": "riempi_colonna_default", "args": {"valore": ""}},
     "emailstop": {"func": "riempi_colonna_default", "args": {"valore": 0}},
     "icq": {"func": "riempi_colonna_default", "args": {"valore": ""}},
@@ -97,10 +98,6 @@ faker_schema_user = {
     "calendartype": {"func": "riempi_colonna_default", "args": {"valore": "gregorian"}},
     "theme": {"func": "riempi_colonna_default", "args": {"valore": ""}},
     "timezone": {"func": "riempi_colonna_default", "args": {"valore": 99}},
-    "firstaccess": {"func": "riempi_colonna_faker", "args": {"tipo": "timestamp"}},
-    "lastaccess": {"func": "riempi_colonna_faker", "args": {"tipo": "timestamp"}},
-    "lastlogin": {"func": "riempi_colonna_faker", "args": {"tipo": "timestamp"}},
-    "currentlogin": {"func": "riempi_colonna_faker", "args": {"tipo": "timestamp"}},
     "lastip": {"func": "riempi_colonna_faker", "args": {"tipo": "ip"}},
     "secret": {"func": "riempi_colonna_default", "args": {"valore": ""}},
     "picture": {"func": "riempi_colonna_default", "args": {"valore": 0}},
@@ -112,8 +109,6 @@ faker_schema_user = {
     "maildisplay": {"func": "riempi_colonna_default", "args": {"valore": 2}},
     "autosubscribe": {"func": "riempi_colonna_default", "args": {"valore": 1}},
     "trackforums": {"func": "riempi_colonna_default", "args": {"valore": 0}},
-    "timecreated": {"func": "riempi_colonna_faker", "args": {"tipo": "timestamp"}},
-    "timemodified": {"func": "riempi_colonna_faker", "args": {"tipo": "timestamp"}},
     "trustbitmask": {"func": "riempi_colonna_default", "args": {"valore": 0}},
     "imagealt": {"func": "riempi_colonna_null"},
     "lastnamephonetic": {"func": "riempi_colonna_null"},
@@ -0,0 +1,30 @@
+"""
+Distribuzioni delle chiavi esterne, una per relazione figlio -> genitore.
+Ogni schema è un dizionario:
+    {"distribuzione": nome, "args": {...}, "min_figli": n, "max_figli": n}
+Distribuzioni disponibili (app/services/generators/distribuzioni.py):
+- bilanciata: circa lo stesso numero di figli per genitore (±1)
+- uniforme: ogni figlio sceglie un genitore a caso
+- zipf: pochi genitori con molti figli (args: s, default 1.0)
+- lognormale: coda lunga più morbida di Zipf (args: sigma, default 1.0)
+- pesi: pesi espliciti (args: pesi, lista allineata ai genitori o {id: peso})
+min_figli e max_figli sono opzionali.
+"""
+
+# mdl_course.category -> mdl_course_categories.id
+fk_schema_course_category = {
+    "distribuzione": "bilanciata"
+}
+
+# mdl_resource.course -> mdl_course.id: pochi corsi concentrano la maggior parte delle risorse
+fk_schema_resource_course = {
+    "distribuzione": "zipf",
+    "args": {"s": 1.0},
+    "min_figli": 1
+}
+
+# mdl_resource.uploaded_by -> mdl_user.id: pochi docenti caricano la maggior parte delle risorse
+fk_schema_resource_uploaded_by = {
+    "distribuzione": "lognormale",
+    "args": {"sigma": 1.5}
+}
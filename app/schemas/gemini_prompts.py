@@ -56,4 +56,29 @@ prompt_resource_level = (
     "Titolo della risorsa: {name}\n"
     "Descrizione della risorsa: {intro}\n"
     "Rispondi solo con il numero."
-)
\ No newline at end of file
+)
+
+
+# generazione fusa (una risposta JSON per riga)
+
+prompt_course_fused = (
+    "Immagina un corso della seguente categoria:\n"
+    "Nome: {category_name}\n"
+    "Descrizione: {category_description}\n"
+    "fullname: nome del corso coerente con la categoria; "
+    "shortname: nome abbreviato del corso; "
+    "summary: breve descrizione chiara del contenuto del corso, coerente con il titolo; "
+    "course_level: livello di difficoltà da 1 (molto facile) a 5 (molto difficile), solo il numero."
+)
+
+prompt_resource_fused = (
+    "Immagina una risorsa didattica testuale che rappresenti un possibile capitolo o sezione del corso descritto qui sotto "
+    "(non necessariamente l'inizio).\n"
+    "Nome del corso: {course_name}\n"
+    "Descrizione del corso: {course_summary}\n"
+    "Livello del corso: {course_level}\n"
+    "name: titolo coerente e specifico della risorsa; "
+    "intro: breve descrizione chiara del contenuto della risorsa, coerente con il titolo; "
+    "resource_level: livello di difficoltà da 1 (molto facile) a 5 (molto difficile), "
+    "coerente con il livello del corso, solo il numero."
+)
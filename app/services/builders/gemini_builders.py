@@ -1,33 +1,46 @@
 import pandas as pd
 import logging
-from app.services.generators.gemini_generator import riempi_colonna_gemini
-from app.services.utils.helpers import get_value_by_id, valida_interi
+from typing import Callable, Optional
+from app.services.generators.gemini_generator import riempi_colonna_gemini, riempi_colonne_gemini
+from app.services.generators.gemini_flusso import PassoGemini, riempi_tabelle_gemini_flusso
+from app.services.utils.helpers import valida_livelli
+from app.services.utils.indici import colonna_da
 from app.schemas import gemini_prompts as prompts
 
 logger = logging.getLogger(__name__)
 
+# token stimati per valore generato, punto di partenza dei batch per budget di
+# token (vedi DimensionatoreBatch): la stima si adatta alle risposte reali
+TOKEN_NOME = 20
+TOKEN_SIGLA = 10
+TOKEN_DESCRIZIONE = 120
+TOKEN_LIVELLO = 3
+TOKEN_CORSO_JSON = 200
+TOKEN_RISORSA_JSON = 160
+
 
 
 # mdl_course
 
 def build_course_fullname(df_course: pd.DataFrame, df_course_categories: pd.DataFrame) -> pd.DataFrame:
     colonne_temp = {
-    "category_name": lambda row: get_value_by_id(df_course_categories, row["category"], "name"),
-    "category_description": lambda row: get_value_by_id(df_course_categories, row["category"], "description")
+        "category_name": colonna_da(df_course_categories, "name", chiave="category"),
+        "category_description": colonna_da(df_course_categories, "description", chiave="category")
     }
     return riempi_colonna_gemini(
         df_course,
         "fullname",
         prompts.prompt_fullname_course,
         colonne_temp=colonne_temp,
-        batch_size=500
+        token_uscita=TOKEN_NOME
     )
 
 def build_course_shortname(df_course: pd.DataFrame) -> pd.DataFrame:
     return riempi_colonna_gemini(
         df_course,
         "shortname",
-        prompts.prompt_shortname_course
+        prompts.prompt_shortname_course,
+        token_uscita=TOKEN_SIGLA
     )
 
 def build_course_summary(df_course: pd.DataFrame) -> pd.DataFrame:
@@ -35,7 +48,7 @@ def build_course_summary(df_course: pd.DataFrame) -> pd.DataFrame:
         df_course,
         "summary",
         prompts.prompt_summary_course,
-        batch_size=20
+        token_uscita=TOKEN_DESCRIZIONE
     )
 
 def build_course_level(df_course: pd.DataFrame) -> pd.DataFrame:
@@ -43,7 +56,8 @@ def build_course_level(df_course: pd.DataFrame) -> pd.DataFrame:
         df_course,
         "course_level",
         prompts.prompt_course_level,
-        validatore=valida_interi
+        validatore=valida_livelli,
+        token_uscita=TOKEN_LIVELLO
     )
 
 
@@ -52,15 +66,15 @@ def build_course_level(df_course: pd.DataFrame) -> pd.DataFrame:
 
 def build_resource_name(df_resource: pd.DataFrame, df_course: pd.DataFrame) -> pd.DataFrame:
     colonne_temp = {
-        "course_name": lambda row: get_value_by_id(df_course, row["course"], "fullname"),
-        "course_summary": lambda row: get_value_by_id(df_course, row["course"], "summary")
+        "course_name": colonna_da(df_course, "fullname", chiave="course"),
+        "course_summary": colonna_da(df_course, "summary", chiave="course")
     }
     return riempi_colonna_gemini(
         df_resource,
         "name",
         prompts.prompt_name_resource,
         colonne_temp=colonne_temp,
-        batch_size=25
+        token_uscita=TOKEN_NOME
     )
 
 def build_resource_intro(df_resource: pd.DataFrame) -> pd.DataFrame:
@@ -68,18 +82,121 @@ def build_resource_intro(df_resource: pd.DataFrame) -> pd.DataFrame:
         df_resource,
         "intro",
         prompts.prompt_intro_resource,
-        batch_size=25
+        token_uscita=TOKEN_DESCRIZIONE
     )
 
 def build_resource_level(df_resource: pd.DataFrame, df_course: pd.DataFrame) -> pd.DataFrame:
     colonne_temp = {
-        "course_level": lambda row: get_value_by_id(df_course, row["course"], "course_level")
+        "course_level": colonna_da(df_course, "course_level", chiave="course")
     }
     return riempi_colonna_gemini(
         df_resource,
         "resource_level",
         prompts.prompt_resource_level,
         colonne_temp=colonne_temp,
-        batch_size=100,
-        validatore=valida_interi
-    )
\ No newline at end of file
+        validatore=valida_livelli,
+        token_uscita=TOKEN_LIVELLO
+    )
+
+
+# generazione fusa: una chiamata riempie più colonne coerenti tra loro
+
+def build_course_testi(df_course: pd.DataFrame, df_course_categories: pd.DataFrame) -> pd.DataFrame:
+    colonne_temp = {
+        "category_name": colonna_da(df_course_categories, "name", chiave="category"),
+        "category_description": colonna_da(df_course_categories, "description", chiave="category")
+    }
+    return riempi_colonne_gemini(
+        df_course,
+        {
+            "fullname": None,
+            "shortname": None,
+            "summary": None,
+            "course_level": valida_livelli
+        },
+        prompts.prompt_course_fused,
+        colonne_temp=colonne_temp,
+        token_uscita=TOKEN_CORSO_JSON
+    )
+
+def build_resource_testi(df_resource: pd.DataFrame, df_course: pd.DataFrame) -> pd.DataFrame:
+    colonne_temp = {
+        "course_name": colonna_da(df_course, "fullname", chiave="course"),
+        "course_summary": colonna_da(df_course, "summary", chiave="course"),
+        "course_level": colonna_da(df_course, "course_level", chiave="course")
+    }
+    return riempi_colonne_gemini(
+        df_resource,
+        {
+            "name": None,
+            "intro": None,
+            "resource_level": valida_livelli
+        },
+        prompts.prompt_resource_fused,
+        colonne_temp=colonne_temp,
+        token_uscita=TOKEN_RISORSA_JSON
+    )
+
+
+
+# generazione a flusso: ogni riga passa alla colonna successiva appena pronta
+# (stessi prompt e stime di token delle funzioni sopra)
+
+def passi_gemini(df_course_categories: pd.DataFrame, fusa: bool = True) -> list[PassoGemini]:
+    categoria = {
+        "category_name": colonna_da(df_course_categories, "name", chiave="category"),
+        "category_description": colonna_da(df_course_categories, "description", chiave="category")
+    }
+    corso = {
+        "course_name": ("course", "fullname", "course"),
+        "course_summary": ("course", "summary", "course"),
+        "course_level": ("course", "course_level", "course")
+    }
+
+    if fusa:
+        return [
+            PassoGemini(
+                "course",
+                {"fullname": None, "shortname": None, "summary": None, "course_level": valida_livelli},
+                prompts.prompt_course_fused,
+                colonne_temp=categoria,
+                token_uscita=TOKEN_CORSO_JSON
+            ),
+            PassoGemini(
+                "resource",
+                {"name": None, "intro": None, "resource_level": valida_livelli},
+                prompts.prompt_resource_fused,
+                riferimenti=corso,
+                token_uscita=TOKEN_RISORSA_JSON
+            )
+        ]
+
+    return [
+        PassoGemini(
+            "course", {"fullname": None}, prompts.prompt_fullname_course,
+            colonne_temp=categoria, token_uscita=TOKEN_NOME
+        ),
+        PassoGemini("course", {"shortname": None}, prompts.prompt_shortname_course, token_uscita=TOKEN_SIGLA),
+        PassoGemini("course", {"summary": None}, prompts.prompt_summary_course, token_uscita=TOKEN_DESCRIZIONE),
+        PassoGemini("course", {"course_level": valida_livelli}, prompts.prompt_course_level, token_uscita=TOKEN_LIVELLO),
+        PassoGemini("resource", {"name": None}, prompts.prompt_name_resource, riferimenti=corso, token_uscita=TOKEN_NOME),
+        PassoGemini("resource", {"intro": None}, prompts.prompt_intro_resource, token_uscita=TOKEN_DESCRIZIONE),
+        PassoGemini(
+            "resource", {"resource_level": valida_livelli}, prompts.prompt_resource_level,
+            riferimenti=corso, token_uscita=TOKEN_LIVELLO
+        )
+    ]
+
+def build_testi_flusso(
+    df_course: pd.DataFrame,
+    df_resource: pd.DataFrame,
+    df_course_categories: pd.DataFrame,
+    fusa: bool = True,
+    al_progresso: Optional[Callable[[int, int], None]] = None
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    tabelle = riempi_tabelle_gemini_flusso(
+        {"course": df_course, "resource": df_resource},
+        passi_gemini(df_course_categories, fusa),
+        al_progresso=al_progresso
+    )
+    return tabelle["course"], tabelle["resource"]
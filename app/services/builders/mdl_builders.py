@@ -1,79 +1,99 @@
+import numpy as np
 import pandas as pd
 import logging
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
-def build_mdl_context(df_course: pd.DataFrame, df_resource: pd.DataFrame) -> pd.DataFrame:
+CONTEXTLEVEL_COURSE = 50
+CONTEXTLEVEL_RESOURCE = 70
+ROLEID_STUDENT = 3
+
+
+def build_mdl_context(df_course: pd.DataFrame, df_resource: pd.DataFrame, primo_id: int = 1) -> pd.DataFrame:
     """
     Costruisce la tabella mdl_context a partire da corsi e risorse.
-    """
-    context_rows = []
-    context_id_counter = 1
-
-    # corsi -> contextlevel 50
-    for _, course in df_course.iterrows():
-        context_rows.append({
-            'id': context_id_counter,
-            'contextlevel': 50,
-            'instanceid': int(course['id']),
-            'path': '',
-            'depth': '',
-            'locked': ''
-        })
-        context_id_counter += 1
 
-    # risorse -> contextlevel 70
-    for _, resource in df_resource.iterrows():
-        context_rows.append({
-            'id': context_id_counter,
-            'contextlevel': 70,
-            'instanceid': int(resource['id']),
-            'path': '',
-            'depth': '',
-            'locked': ''
-        })
-        context_id_counter += 1
+    Prima i contesti dei corsi (contextlevel 50), poi quelli delle risorse
+    (contextlevel 70), con id consecutivi a partire da primo_id (per la
+    generazione a chunk, dove ogni chunk continua la numerazione).
+    """
+    n_course = len(df_course)
+    n_resource = len(df_resource)
+    n = n_course + n_resource
 
-    df_context = pd.DataFrame(context_rows)        
+    df_context = pd.DataFrame({
+        'id': np.arange(primo_id, primo_id + n, dtype=np.int64),
+        'contextlevel': np.repeat(
+            np.array([CONTEXTLEVEL_COURSE, CONTEXTLEVEL_RESOURCE], dtype=np.int64),
+            [n_course, n_resource]
+        ),
+        'instanceid': np.concatenate([
+            df_course['id'].to_numpy(dtype=np.int64),
+            df_resource['id'].to_numpy(dtype=np.int64)
+        ]),
+        'path': '',
+        'depth': '',
+        'locked': ''
+    })
+    logger.info(f"mdl_context: {n_course} contesti corso, {n_resource} contesti risorsa")
     return df_context
 
 
-def build_mdl_role_assignments(df_context: pd.DataFrame, df_resource: pd.DataFrame, df_user: pd.DataFrame) -> pd.DataFrame:
+def build_mdl_role_assignments(
+    df_context: pd.DataFrame,
+    df_resource: pd.DataFrame,
+    df_user: Optional[pd.DataFrame] = None,
+    rng: Optional[np.random.Generator] = None,
+    primo_id: int = 1,
+    id_utenti: Optional[tuple[int, int]] = None
+) -> pd.DataFrame:
     """
     Costruisce la tabella mdl_role_assignments a partire da context, risorse e utenti.
+
+    Ogni contesto di risorsa viene assegnato all'utente in uploaded_by;
+    i contesti di corso (e le risorse senza uploader) a un utente casuale.
+    I contesti con altri livelli vengono ignorati.
+
+    Nella generazione a chunk gli id partono da primo_id e gli utenti casuali
+    si estraggono dall'intervallo id_utenti (primo, ultimo), senza df_user.
     """
-    role_assignments_rows = []
-    role_assignments_id_counter = 1
+    rng = rng or np.random.default_rng()
 
-    for _, context in df_context.iterrows():
-        context_id = context['id']
-        contextlevel = context['contextlevel']
-        instance_id = context['instanceid']
+    livelli = df_context['contextlevel'].to_numpy()
+    df_ctx = df_context.loc[
+        (livelli == CONTEXTLEVEL_COURSE) | (livelli == CONTEXTLEVEL_RESOURCE),
+        ['id', 'contextlevel', 'instanceid']
+    ]
 
-        if contextlevel == 50:
-            userid = df_user.sample(1).iloc[0]['id']
+    # uploader delle risorse con un'unica merge (prima occorrenza per id)
+    userid = pd.Series(np.nan, index=df_ctx.index)
+    if 'uploaded_by' in df_resource.columns:
+        uploader = df_resource[['id', 'uploaded_by']].drop_duplicates('id')
+        unito = df_ctx[['contextlevel', 'instanceid']].merge(
+            uploader, how='left', left_on='instanceid', right_on='id'
+        )
+        uploaded_by = unito['uploaded_by'].where(unito['contextlevel'] == CONTEXTLEVEL_RESOURCE)
+        userid = pd.Series(uploaded_by.to_numpy(dtype=float), index=df_ctx.index)
 
-        elif contextlevel == 70:
-            resource_match = df_resource[df_resource['id'] == instance_id]
-            if not resource_match.empty and 'uploaded_by' in resource_match.columns:
-                userid = resource_match.iloc[0]['uploaded_by']
-            else:
-                userid = df_user.sample(1).iloc[0]['id']
+    # utente casuale per tutti gli altri, con un'unica estrazione
+    mancanti = userid.isna().to_numpy()
+    if mancanti.any():
+        if id_utenti is not None:
+            userid[mancanti] = rng.integers(id_utenti[0], id_utenti[1], size=int(mancanti.sum()), endpoint=True)
         else:
-            continue
-        
-        role_assignments_rows.append({
-            'id': int(role_assignments_id_counter),
-            'roleid': 3,
-            'contextid': int(context_id),
-            'userid': int(userid),
-            'timemodified': '',
-            'modifierid': '',
-            'component': '',
-            'itemid': '',
-            'sortorder': ''
-        })
-        role_assignments_id_counter += 1
-    
-    df_role_assignments = pd.DataFrame(role_assignments_rows)
-    return df_role_assignments
\ No newline at end of file
+            userid[mancanti] = rng.choice(df_user['id'].to_numpy(), size=int(mancanti.sum()))
+
+    n = len(df_ctx)
+    df_role_assignments = pd.DataFrame({
+        'id': np.arange(primo_id, primo_id + n, dtype=np.int64),
+        'roleid': np.full(n, ROLEID_STUDENT, dtype=np.int64),
+        'contextid': df_ctx['id'].to_numpy(dtype=np.int64),
+        'userid': userid.to_numpy().astype(np.int64),
+        'timemodified': '',
+        'modifierid': '',
+        'component': '',
+        'itemid': '',
+        'sortorder': ''
+    })
+    return df_role_assignments
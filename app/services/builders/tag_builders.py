@@ -2,7 +2,6 @@ import json
 import logging
 import pandas as pd
 from typing import Any, List, Tuple
-from app.services.utils.helpers import get_value_by_id
 from app.services.generators.tag_gemini import call_gemini_tag_selection, genera_prompt_risorsa, call_gemini_tag_generation
 
 logger = logging.getLogger(__name__)
@@ -59,23 +58,24 @@ def genera_tabella_category_tag(
     righe = []
     id_counter = 1
 
+    # primo id per nome, costruiti una volta invece di filtrare per ogni tag
+    categoria_id_per_nome = df_categorie.drop_duplicates("name").set_index("name")["id"].to_dict()
+    tag_id_per_nome = df_tag.drop_duplicates("name").set_index("name")["id"].to_dict()
+
     for nome_cat, lista_tag in categoria_to_tags.items():
         # trova l'id della categoria
-        match = df_categorie[df_categorie["name"] == nome_cat]
-        if match.empty:
+        category_id = categoria_id_per_nome.get(nome_cat)
+        if category_id is None:
             logger.warning(f"Categoria '{nome_cat}' non trovata in mdl_course_categories")
             continue
 
-        category_id = match.iloc[0]["id"]
-
         for tag in lista_tag:
             tag = tag.strip()
-            tag_match = df_tag[df_tag["name"] == tag]
-            if tag_match.empty:
+            tag_id = tag_id_per_nome.get(tag)
+            if tag_id is None:
                 logger.warning(f"Tag '{tag}' non trovato in tag.csv")
                 continue
 
-            tag_id = tag_match.iloc[0]["id"]
             righe.append({
                 "id": id_counter,
                 "category_id": category_id,
@@ -114,6 +114,14 @@ def genera_tabella_course_tag(
     
     tag_map = df_category_tag.groupby("category_id")["tag_id"].apply(list).to_dict()
     tag_lookup = df_tag.set_index("id")["name"].to_dict()
+    # primo id per nome, come la ricerca per nome su df_tag
+    tag_id_per_nome = df_tag.drop_duplicates("name").set_index("name")["id"].to_dict()
+
+    # i campi del corso si leggono per posizione: la riga è quella che si sta iterando
+    categorie = df_course["category"].to_numpy()
+    fullnames = df_course["fullname"].to_numpy()
+    summaries = df_course["summary"].to_numpy()
+    categoria_per_corso = dict(zip(df_course["id"], categorie))
 
     prompts = []
     course_ids = []
@@ -122,9 +130,9 @@ def genera_tabella_course_tag(
 
     for idx, course_id in enumerate(df_course["id"]):
         try:  
-            category_id = get_value_by_id(df_course, course_id, "category")
-            fullname = get_value_by_id(df_course, course_id, "fullname")
-            summary = get_value_by_id(df_course, course_id, "summary") or ""
+            category_id = categorie[idx]
+            fullname = fullnames[idx]
+            summary = summaries[idx] or ""
             tag_ids = tag_map.get(category_id, [])
 
             if not tag_ids or not fullname:
@@ -173,7 +181,7 @@ def genera_tabella_course_tag(
         if not isinstance(tag_list, list) or not tag_list:
             logger.info(f"Risposta vuota o non valida per corso {course_id}. Assegno fallback.")
             # fallback: assegna il primo tag disponibile per la categoria
-            fallback_tag_ids = tag_map.get(get_value_by_id(df_course, course_id, "category"), [])
+            fallback_tag_ids = tag_map.get(categoria_per_corso.get(course_id), [])
             for tid in fallback_tag_ids[:1]:    # solo uno
                 tag_name = tag_lookup.get(tid)
                 if tag_name:
@@ -185,12 +193,11 @@ def genera_tabella_course_tag(
         # loop che costruisce le righe
         for tag_name in tag_list[:7]:
             # trova il tag_id corrispondente
-            match = df_tag[df_tag["name"] == tag_name]
-            if match.empty:
+            tag_id = tag_id_per_nome.get(tag_name)
+            if tag_id is None:
                 logger.info(f"Tag '{tag_name}' non trovato in df_tag (corso {course_id})")
                 continue
 
-            tag_id = match.iloc[0]["id"]
             righe.append({
                 "id": id_counter,
                 "course_id": course_id,
@@ -0,0 +1,112 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from app.services.utils.tabelle import tabella_arrow
+
+logger = logging.getLogger(__name__)
+
+
+# formato -> estensione del file
+FORMATI = {
+    "csv": ".csv",
+    "csv.gz": ".csv.gz",
+    "csv.zst": ".csv.zst",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+    "feather": ".feather"
+}
+
+# formati già compressi: nello ZIP vanno salvati senza ricomprimerli
+FORMATI_COMPRESSI = {"csv.gz", "csv.zst", "parquet", "arrow", "feather"}
+
+
+def verifica_formato(formato: str) -> str:
+    if formato not in FORMATI:
+        raise ValueError(f"Formato '{formato}' non supportato. Formati disponibili: {list(FORMATI)}")
+    return formato
+
+
+def verifica_dipendenze_formato(formato: str):
+    """
+    Importa le librerie opzionali richieste dal formato,
+    così l'errore emerge prima di iniziare lo streaming.
+    """
+    verifica_formato(formato)
+    if formato in ("parquet", "arrow", "feather"):
+        import pyarrow  # noqa: F401
+    elif formato == "csv.zst":
+        import zstandard  # noqa: F401
+
+
+def nome_file(nome_base: str, formato: str) -> str:
+    return f"{nome_base}{FORMATI[verifica_formato(formato)]}"
+
+
+
+# ENCODING DI UNA TABELLA
+
+def scrivi_tabella(df: pd.DataFrame, destinazione, formato: str = "csv"):
+    """
+    Scrive il DataFrame nel formato richiesto.
+
+    Args:
+        df: DataFrame da scrivere
+        destinazione: percorso del file o buffer binario
+        formato: uno tra csv, csv.gz, csv.zst, parquet, arrow, feather
+
+    Raises:
+        ValueError: formato non supportato
+        ImportError: manca la libreria opzionale richiesta dal formato (pyarrow, zstandard)
+    """
+    verifica_formato(formato)
+
+    if formato == "csv":
+        df.to_csv(destinazione, index=False)
+    elif formato == "csv.gz":
+        df.to_csv(destinazione, index=False, compression={"method": "gzip", "compresslevel": 6, "mtime": 0})
+    elif formato == "csv.zst":
+        df.to_csv(destinazione, index=False, compression={"method": "zstd", "level": 3})
+    elif formato == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(tabella_arrow(df), destinazione, compression="zstd")
+    else:
+        # arrow e feather: Arrow IPC file (feather v2) con dtype preservati
+        import pyarrow.feather as feather
+        feather.write_feather(tabella_arrow(df), destinazione, compression="zstd")
+
+
+def encode_tabella(df: pd.DataFrame, formato: str = "csv") -> bytes:
+    """Come scrivi_tabella, ma restituisce i byte prodotti."""
+    buffer = io.BytesIO()
+    scrivi_tabella(df, buffer, formato)
+    return buffer.getvalue()
+
+
+
+# ENCODING PARALLELO
+
+def encode_tabelle_parallelo(
+    dfs: dict[str, pd.DataFrame],
+    formato: str = "parquet",
+    max_workers: Optional[int] = None
+) -> Iterator[tuple[str, bytes]]:
+    """
+    Codifica tutte le tabelle su un pool di thread (pyarrow e i compressori
+    rilasciano il GIL) e le restituisce nell'ordine originale man mano che
+    sono pronte.
+
+    Returns:
+        Iteratore di coppie (nome_file, contenuto)
+    """
+    verifica_formato(formato)
+    nomi = list(dfs)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="encode") as executor:
+        risultati = executor.map(lambda nome: encode_tabella(dfs[nome], formato), nomi)
+        for nome, contenuto in zip(nomi, risultati):
+            logger.info(f"Tabella '{nome}' codificata in {formato} ({len(contenuto) / 1e6:.1f} MB)")
+            yield nome_file(nome, formato), contenuto
@@ -0,0 +1,189 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import pandas as pd
+
+from app.services.exporters.formati import nome_file, scrivi_tabella
+from app.services.exporters.sql_export import (
+    Dialetto,
+    carica_in_db,
+    stream_dump_sql
+)
+from app.services.utils.tabelle import tabella_arrow
+
+logger = logging.getLogger(__name__)
+
+# formati delle destinazioni su file per la generazione a chunk
+FORMATI_SINK = ("csv", "csv.gz", "parquet", "sql")
+
+
+
+# DESTINAZIONI A CHUNK
+
+class SinkTabelle(ABC):
+    """
+    Destinazione di una generazione a chunk: riceve una tabella un pezzo
+    alla volta con scrivi() e non trattiene i dati già scritti.
+    """
+
+    def __init__(self):
+        self.righe: dict[str, int] = {}
+
+    def scrivi(self, nome: str, df: pd.DataFrame):
+        self._scrivi(nome, df, nome not in self.righe)
+        self.righe[nome] = self.righe.get(nome, 0) + len(df)
+
+    @abstractmethod
+    def _scrivi(self, nome: str, df: pd.DataFrame, primo: bool):
+        """Scrive un chunk della tabella; primo=True al primo chunk di quella tabella."""
+
+    def chiudi(self) -> dict[str, int]:
+        """Chiude la destinazione e restituisce le righe scritte per tabella."""
+        return dict(self.righe)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.chiudi()
+
+
+class SinkCsv(SinkTabelle):
+    """Un file CSV per tabella; i chunk successivi vengono accodati senza intestazione."""
+
+    def __init__(self, directory: str, formato: str = "csv"):
+        super().__init__()
+        if formato not in ("csv", "csv.gz"):
+            raise ValueError(f"Formato '{formato}' non supportato da SinkCsv")
+        self.directory = directory
+        self.formato = formato
+        os.makedirs(directory, exist_ok=True)
+
+    def _scrivi(self, nome: str, df: pd.DataFrame, primo: bool):
+        percorso = os.path.join(self.directory, nome_file(nome, self.formato))
+        if primo:
+            scrivi_tabella(df, percorso, self.formato)
+            return
+        # un file gzip può contenere più membri concatenati: si accoda un membro per chunk
+        compressione = {"method": "gzip", "compresslevel": 6, "mtime": 0} if self.formato == "csv.gz" else None
+        df.to_csv(percorso, index=False, header=False, mode="a", compression=compressione)
+
+
+class SinkParquet(SinkTabelle):
+    """
+    Un file Parquet per tabella, un row group per chunk. Lo schema è quello
+    del primo chunk; i successivi vengono convertiti allo stesso schema.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        import pyarrow.parquet  # noqa: F401
+        self.directory = directory
+        self._writer: dict[str, object] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _scrivi(self, nome: str, df: pd.DataFrame, primo: bool):
+        import pyarrow.parquet as pq
+
+        tabella = tabella_arrow(df)
+        writer = self._writer.get(nome)
+        if writer is None:
+            percorso = os.path.join(self.directory, nome_file(nome, "parquet"))
+            writer = pq.ParquetWriter(percorso, tabella.schema, compression="zstd")
+            self._writer[nome] = writer
+        elif tabella.schema != writer.schema:
+            tabella = tabella.cast(writer.schema)
+        writer.write_table(tabella)
+
+    def chiudi(self) -> dict[str, int]:
+        for writer in self._writer.values():
+            writer.close()
+        self._writer.clear()
+        return super().chiudi()
+
+
+class SinkDumpSql(SinkTabelle):
+    """Dump .sql unico con INSERT multi-riga, una transazione per chunk."""
+
+    def __init__(
+        self,
+        percorso: str,
+        dialetto: Dialetto = "postgresql",
+        batch_righe: int = 1000,
+        crea_tabelle: bool = False
+    ):
+        super().__init__()
+        self.dialetto = dialetto
+        self.batch_righe = batch_righe
+        self.crea_tabelle = crea_tabelle
+        os.makedirs(os.path.dirname(percorso) or ".", exist_ok=True)
+        self._file = open(percorso, "w", encoding="utf-8")
+
+    def _scrivi(self, nome: str, df: pd.DataFrame, primo: bool):
+        for blocco in stream_dump_sql(
+            {nome: df},
+            self.dialetto,
+            self.batch_righe,
+            righe_per_transazione=max(len(df), 1),
+            crea_tabelle=self.crea_tabelle and primo
+        ):
+            self._file.write(blocco)
+
+    def chiudi(self) -> dict[str, int]:
+        if not self._file.closed:
+            self._file.close()
+        return super().chiudi()
+
+
+class SinkDb(SinkTabelle):
+    """Caricamento diretto in un database DB-API, un commit per chunk."""
+
+    def __init__(
+        self,
+        conn,
+        paramstyle: str = "qmark",
+        dialetto: Dialetto = "postgresql",
+        batch_righe: int = 1000,
+        crea_tabelle: bool = False
+    ):
+        super().__init__()
+        self.conn = conn
+        self.paramstyle = paramstyle
+        self.dialetto = dialetto
+        self.batch_righe = batch_righe
+        self.crea_tabelle = crea_tabelle
+
+    def _scrivi(self, nome: str, df: pd.DataFrame, primo: bool):
+        carica_in_db(
+            self.conn,
+            {nome: df},
+            batch_righe=self.batch_righe,
+            righe_per_transazione=max(len(df), 1),
+            paramstyle=self.paramstyle,
+            dialetto=self.dialetto,
+            crea_tabelle=self.crea_tabelle and primo
+        )
+
+
+def crea_sink(formato: str, directory: str, dialetto: Optional[Dialetto] = None) -> SinkTabelle:
+    """
+    Destinazione su file per il formato richiesto.
+
+    Args:
+        formato: uno tra csv, csv.gz, parquet, sql
+        directory: cartella dei file prodotti
+        dialetto: dialetto del dump sql (default postgresql)
+
+    Raises:
+        ValueError: formato non supportato
+        ImportError: manca pyarrow per il formato parquet
+    """
+    if formato in ("csv", "csv.gz"):
+        return SinkCsv(directory, formato)
+    if formato == "parquet":
+        return SinkParquet(directory)
+    if formato == "sql":
+        return SinkDumpSql(os.path.join(directory, "dataset.sql"), dialetto or "postgresql", crea_tabelle=True)
+    raise ValueError(f"Formato '{formato}' non supportato. Formati disponibili: {list(FORMATI_SINK)}")
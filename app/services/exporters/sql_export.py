@@ -0,0 +1,282 @@
+import logging
+import math
+from typing import Any, Iterator, Literal, Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+Dialetto = Literal["postgresql", "mysql", "sqlite"]
+
+# ordine di caricamento: ogni tabella viene dopo quelle che referenzia
+ORDINE_TABELLE = [
+    "mdl_role",
+    "mdl_course_categories",
+    "mdl_user",
+    "mdl_course",
+    "mdl_resource",
+    "mdl_context",
+    "mdl_role_assignments",
+    "tag",
+    "category_tag",
+    "course_tag",
+    "resource_tag"
+]
+
+# segnaposto dei parametri DB-API
+PARAMSTYLE = {
+    "qmark": "?",
+    "format": "%s"
+}
+
+
+def ordina_tabelle(dfs: dict[str, pd.DataFrame]) -> list[tuple[str, pd.DataFrame]]:
+    """
+    Restituisce le tabelle in ordine di dipendenza; quelle non previste vanno in coda.
+    """
+    nomi = [n for n in ORDINE_TABELLE if n in dfs] + [n for n in dfs if n not in ORDINE_TABELLE]
+    return [(nome, dfs[nome]) for nome in nomi]
+
+
+def righe_python(df: pd.DataFrame) -> list[tuple]:
+    """Converte il DataFrame in tuple di valori Python nativi, con None al posto di NA."""
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def _batch(df: pd.DataFrame, batch_righe: int) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(df), batch_righe):
+        yield df.iloc[start:start + batch_righe]
+
+
+
+# FORMATTAZIONE SQL
+
+def quota_identificatore(nome: str, dialetto: Dialetto = "postgresql") -> str:
+    if dialetto == "mysql":
+        return f"`{nome}`"
+    return f'"{nome}"'
+
+
+def letterale_sql(valore: Any, dialetto: Dialetto = "postgresql") -> str:
+    """Rappresentazione SQL di un valore Python."""
+    if valore is None:
+        return "NULL"
+    if isinstance(valore, bool):
+        return "1" if valore else "0"
+    if isinstance(valore, int):
+        return str(valore)
+    if isinstance(valore, float):
+        return "NULL" if math.isnan(valore) else repr(valore)
+    testo = str(valore).replace("'", "''")
+    if dialetto == "mysql":
+        testo = testo.replace("\\", "\\\\")
+    return f"'{testo}'"
+
+
+def _tipo_sql(serie: pd.Series, dialetto: Dialetto) -> str:
+    if pd.api.types.is_bool_dtype(serie):
+        return "SMALLINT"
+    if pd.api.types.is_integer_dtype(serie):
+        return "BIGINT"
+    if pd.api.types.is_float_dtype(serie):
+        return {"postgresql": "DOUBLE PRECISION", "mysql": "DOUBLE", "sqlite": "REAL"}[dialetto]
+    return "TEXT"
+
+
+def genera_ddl(nome: str, df: pd.DataFrame, dialetto: Dialetto = "postgresql") -> str:
+    """
+    CREATE TABLE ricavato dai dtype del DataFrame. Serve per i test su un
+    database vuoto: su un'istanza Moodle le tabelle esistono già.
+    """
+    colonne = ",\n".join(
+        f"    {quota_identificatore(col, dialetto)} {_tipo_sql(df[col], dialetto)}"
+        for col in df.columns
+    )
+    return f"CREATE TABLE IF NOT EXISTS {quota_identificatore(nome, dialetto)} (\n{colonne}\n);\n"
+
+
+
+# DUMP SQL CON INSERT MULTI-RIGA
+
+def stream_dump_sql(
+    dfs: dict[str, pd.DataFrame],
+    dialetto: Dialetto = "postgresql",
+    batch_righe: int = 1000,
+    righe_per_transazione: int = 50_000,
+    crea_tabelle: bool = False
+) -> Iterator[str]:
+    """
+    Genera un dump .sql in streaming: una INSERT multi-riga ogni batch_righe
+    righe e un COMMIT ogni righe_per_transazione righe.
+
+    Args:
+        dfs: dizionario {nome_tabella: DataFrame}
+        dialetto: postgresql, mysql o sqlite (quoting ed escaping)
+        batch_righe: righe per ciascuna INSERT
+        righe_per_transazione: righe per transazione
+        crea_tabelle: se True, premette un CREATE TABLE IF NOT EXISTS per tabella
+
+    Returns:
+        Iteratore di blocchi di testo SQL
+    """
+    inizio = "START TRANSACTION;\n" if dialetto == "mysql" else "BEGIN;\n"
+    righe_in_transazione = 0
+    yield inizio
+
+    for nome, df in ordina_tabelle(dfs):
+        if crea_tabelle:
+            yield genera_ddl(nome, df, dialetto)
+        if df.empty:
+            continue
+
+        colonne = ", ".join(quota_identificatore(c, dialetto) for c in df.columns)
+        testa = f"INSERT INTO {quota_identificatore(nome, dialetto)} ({colonne}) VALUES\n"
+
+        for batch in _batch(df, batch_righe):
+            valori = ",\n".join(
+                "(" + ", ".join(letterale_sql(v, dialetto) for v in riga) + ")"
+                for riga in righe_python(batch)
+            )
+            yield testa + valori + ";\n"
+
+            righe_in_transazione += len(batch)
+            if righe_in_transazione >= righe_per_transazione:
+                yield "COMMIT;\n" + inizio
+                righe_in_transazione = 0
+
+        logger.info(f"Dump SQL di '{nome}' completato ({len(df)} righe)")
+
+    yield "COMMIT;\n"
+
+
+
+# DUMP POSTGRESQL COPY
+
+def _campo_copy(valore: Any) -> str:
+    if valore is None or (isinstance(valore, float) and math.isnan(valore)):
+        return "\\N"
+    if isinstance(valore, bool):
+        return "1" if valore else "0"
+    return (
+        str(valore)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def stream_copy_postgres(
+    dfs: dict[str, pd.DataFrame],
+    batch_righe: int = 10_000,
+    righe_per_transazione: int = 50_000,
+    crea_tabelle: bool = False
+) -> Iterator[str]:
+    """
+    Genera un dump nel formato testo di COPY ... FROM stdin (psql),
+    una tabella alla volta in ordine di dipendenza.
+
+    Args:
+        dfs: dizionario {nome_tabella: DataFrame}
+        batch_righe: righe per blocco di testo generato
+        righe_per_transazione: righe per transazione; al limite la COPY in
+            corso viene chiusa, si fa COMMIT e la tabella riprende in una nuova COPY
+        crea_tabelle: se True, premette un CREATE TABLE IF NOT EXISTS per tabella
+
+    Returns:
+        Iteratore di blocchi di testo
+    """
+    righe_in_transazione = 0
+    yield "BEGIN;\n"
+    for nome, df in ordina_tabelle(dfs):
+        if crea_tabelle:
+            yield genera_ddl(nome, df)
+        if df.empty:
+            continue
+        colonne = ", ".join(quota_identificatore(c) for c in df.columns)
+        testa = f"COPY {quota_identificatore(nome)} ({colonne}) FROM stdin;\n"
+        if righe_in_transazione >= righe_per_transazione:
+            yield "COMMIT;\nBEGIN;\n"
+            righe_in_transazione = 0
+        yield testa
+        for batch in _batch(df, batch_righe):
+            # il COMMIT cade prima di un batch, così non restano COPY vuote
+            if righe_in_transazione >= righe_per_transazione:
+                yield "\\.\nCOMMIT;\nBEGIN;\n" + testa
+                righe_in_transazione = 0
+            yield "".join(
+                "\t".join(_campo_copy(v) for v in riga) + "\n"
+                for riga in righe_python(batch)
+            )
+            righe_in_transazione += len(batch)
+        yield "\\.\n"
+        logger.info(f"COPY di '{nome}' completata ({len(df)} righe)")
+    yield "COMMIT;\n"
+
+
+# CARICAMENTO DIRETTO (DB-API)
+
+def carica_in_db(
+    conn,
+    dfs: dict[str, pd.DataFrame],
+    batch_righe: int = 1000,
+    righe_per_transazione: int = 50_000,
+    paramstyle: str = "qmark",
+    dialetto: Dialetto = "postgresql",
+    crea_tabelle: bool = False,
+    tabelle: Optional[list[str]] = None
+) -> dict[str, int]:
+    """
+    Carica le tabelle in un database tramite una connessione DB-API 2.0
+    (sqlite3, psycopg, pymysql, ...) con executemany a batch.
+
+    Args:
+        conn: connessione DB-API aperta
+        dfs: dizionario {nome_tabella: DataFrame}
+        batch_righe: righe per ogni executemany
+        righe_per_transazione: righe tra un commit e il successivo
+        paramstyle: "qmark" (sqlite3) o "format" (psycopg, pymysql)
+        dialetto: dialetto usato per quotare gli identificatori
+        crea_tabelle: se True, esegue prima un CREATE TABLE IF NOT EXISTS
+        tabelle: sottoinsieme di tabelle da caricare (default: tutte)
+
+    Returns:
+        Numero di righe inserite per tabella
+    """
+    if paramstyle not in PARAMSTYLE:
+        raise ValueError(f"paramstyle '{paramstyle}' non supportato: usa {list(PARAMSTYLE)}")
+    segnaposto = PARAMSTYLE[paramstyle]
+
+    inserite: dict[str, int] = {}
+    righe_in_transazione = 0
+    cursor = conn.cursor()
+
+    try:
+        for nome, df in ordina_tabelle(dfs):
+            if tabelle is not None and nome not in tabelle:
+                continue
+            if crea_tabelle:
+                cursor.execute(genera_ddl(nome, df, dialetto))
+
+            colonne = ", ".join(quota_identificatore(c, dialetto) for c in df.columns)
+            valori = ", ".join([segnaposto] * len(df.columns))
+            sql = f"INSERT INTO {quota_identificatore(nome, dialetto)} ({colonne}) VALUES ({valori})"
+
+            for batch in _batch(df, batch_righe):
+                cursor.executemany(sql, righe_python(batch))
+                righe_in_transazione += len(batch)
+                if righe_in_transazione >= righe_per_transazione:
+                    conn.commit()
+                    righe_in_transazione = 0
+
+            inserite[nome] = len(df)
+            logger.info(f"Caricate {len(df)} righe in '{nome}'")
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return inserite
@@ -0,0 +1,116 @@
+import io
+import logging
+import zipfile
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from app.services.exporters.formati import encode_tabelle_parallelo
+
+logger = logging.getLogger(__name__)
+
+CHUNK_RIGHE = 50_000
+
+
+
+# BUFFER DI USCITA NON SEEKABLE
+
+class _BufferStream(io.RawIOBase):
+    """
+    File-like in sola scrittura che accumula i byte prodotti da ZipFile
+    finché il generatore non li consegna alla risposta HTTP.
+    Non è seekable, quindi ZipFile usa i data descriptor dopo ogni file.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._posizione = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._posizione += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._posizione
+
+    def svuota(self) -> bytes:
+        dati = b"".join(self._chunks)
+        self._chunks.clear()
+        return dati
+
+
+
+# ZIP IN STREAMING
+
+def scrivi_csv_a_chunk(df: pd.DataFrame, destinazione, chunk_righe: int = CHUNK_RIGHE) -> Iterator[None]:
+    """
+    Scrive il DataFrame come CSV in un file binario, un blocco di righe alla volta.
+    Restituisce il controllo al chiamante dopo ogni blocco.
+    """
+    testo = io.TextIOWrapper(destinazione, encoding="utf-8", newline="")
+    for start in range(0, max(len(df), 1), chunk_righe):
+        df.iloc[start:start + chunk_righe].to_csv(testo, index=False, header=(start == 0))
+        testo.flush()
+        yield
+    testo.detach()
+
+
+def stream_zip_csv(
+    dfs: dict[str, pd.DataFrame],
+    chunk_righe: int = CHUNK_RIGHE,
+    compresslevel: int = 6
+) -> Iterator[bytes]:
+    """
+    Genera un archivio ZIP con un CSV per tabella, restituendo i byte compressi
+    man mano che vengono prodotti. La memoria usata dipende da chunk_righe,
+    non dalla dimensione del dataset.
+
+    Args:
+        dfs: dizionario {nome_tabella: DataFrame}
+        chunk_righe: righe convertite in CSV per ogni blocco
+        compresslevel: livello di compressione DEFLATE (0-9)
+
+    Returns:
+        Iteratore di blocchi di byte da passare a StreamingResponse
+    """
+    buffer = _BufferStream()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zip_file:
+        for nome, df in dfs.items():
+            with zip_file.open(f"{nome}.csv", "w", force_zip64=True) as entry:
+                for _ in scrivi_csv_a_chunk(df, entry, chunk_righe):
+                    dati = buffer.svuota()
+                    if dati:
+                        yield dati
+            logger.info(f"Tabella '{nome}' aggiunta allo ZIP ({len(df)} righe)")
+            yield buffer.svuota()
+
+    yield buffer.svuota()
+
+
+def stream_zip_tabelle(
+    dfs: dict[str, pd.DataFrame],
+    formato: str = "csv",
+    max_workers: Optional[int] = None
+) -> Iterator[bytes]:
+    """
+    Genera un archivio ZIP con un file per tabella nel formato richiesto.
+
+    Il CSV semplice passa da stream_zip_csv. Gli altri formati sono già
+    compressi: le tabelle vengono codificate in parallelo e salvate nello
+    ZIP senza ricomprimerle, nell'ordine originale.
+    """
+    if formato == "csv":
+        yield from stream_zip_csv(dfs)
+        return
+
+    buffer = _BufferStream()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zip_file:
+        for nome_file, contenuto in encode_tabelle_parallelo(dfs, formato, max_workers):
+            zip_file.writestr(nome_file, contenuto)
+            yield buffer.svuota()
+
+    yield buffer.svuota()
@@ -0,0 +1,289 @@
+import logging
+import math
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DISTRIBUZIONI = ("bilanciata", "uniforme", "zipf", "lognormale", "pesi")
+
+
+
+# CAMPIONAMENTO CON TABELLE ALIAS (Walker / Vose)
+
+class TabellaAlias:
+    """
+    Tabella alias di Walker (costruzione di Vose) per campionare indici
+    0..n-1 con probabilità proporzionali ai pesi: la costruzione è O(n),
+    ogni estrazione O(1) ed è vettoriale su numpy.
+    """
+
+    def __init__(self, pesi):
+        pesi = np.asarray(pesi, dtype=np.float64)
+        if pesi.ndim != 1 or len(pesi) == 0:
+            raise ValueError("Servono pesi monodimensionali non vuoti")
+        if (pesi < 0).any() or not np.isfinite(pesi).all():
+            raise ValueError("I pesi devono essere finiti e non negativi")
+        totale = pesi.sum()
+        if totale <= 0:
+            raise ValueError("La somma dei pesi deve essere positiva")
+
+        n = len(pesi)
+        scalati = pesi * (n / totale)
+        self.prob = np.ones(n, dtype=np.float64)
+        self.alias = np.arange(n, dtype=np.int64)
+
+        piccoli = list(np.flatnonzero(scalati < 1.0))
+        grandi = list(np.flatnonzero(scalati >= 1.0))
+        scalati = scalati.tolist()
+        while piccoli and grandi:
+            s = piccoli.pop()
+            g = grandi[-1]
+            self.prob[s] = scalati[s]
+            self.alias[s] = g
+            scalati[g] -= 1.0 - scalati[s]
+            if scalati[g] < 1.0:
+                grandi.pop()
+                piccoli.append(g)
+        # residui numerici: probabilità piena
+        for i in piccoli + grandi:
+            self.prob[i] = 1.0
+
+    def campiona(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        colonne = rng.integers(0, len(self.prob), size=n)
+        accetta = rng.random(n) < self.prob[colonne]
+        return np.where(accetta, colonne, self.alias[colonne])
+
+
+
+# PESI PER DISTRIBUZIONE
+
+def pesi_distribuzione(
+    distribuzione: str,
+    n: int,
+    rng: np.random.Generator,
+    args: Optional[dict] = None
+) -> np.ndarray:
+    """
+    Pesi relativi degli n genitori per la distribuzione richiesta.
+
+    - uniforme: stesso peso per tutti (figli assegnati indipendentemente)
+    - zipf: peso 1 / rango^s (args: s, default 1.0)
+    - lognormale: pesi estratti da una lognormale (args: sigma, default 1.0)
+    - pesi: pesi espliciti (args: pesi, lista allineata ai genitori)
+
+    L'ordine dei ranghi è casuale: i genitori "pesanti" non sono i primi id.
+    """
+    args = args or {}
+    if distribuzione == "uniforme":
+        return np.ones(n)
+    if distribuzione == "zipf":
+        s = float(args.get("s", 1.0))
+        if s <= 0:
+            raise ValueError("Il parametro s di Zipf deve essere positivo")
+        return rng.permutation(np.arange(1, n + 1, dtype=np.float64) ** -s)
+    if distribuzione == "lognormale":
+        sigma = float(args.get("sigma", 1.0))
+        return rng.lognormal(mean=0.0, sigma=sigma, size=n)
+    if distribuzione == "pesi":
+        pesi = np.asarray(args.get("pesi", []), dtype=np.float64)
+        if len(pesi) != n:
+            raise ValueError(f"Servono {n} pesi espliciti, ricevuti {len(pesi)}")
+        return pesi
+    raise ValueError(f"Distribuzione '{distribuzione}' non supportata. Disponibili: {list(DISTRIBUZIONI)}")
+
+
+
+# ASSEGNAZIONE DEI FIGLI AI GENITORI
+
+def conteggi_bilanciati(n_figli: int, n_genitori: int, rng: np.random.Generator) -> np.ndarray:
+    """Circa n_figli / n_genitori figli a testa, con variazione di ±1 e almeno 1."""
+    base = n_figli // n_genitori
+    residue = n_figli % n_genitori
+
+    conteggi = np.maximum(1, base + rng.integers(-1, 2, size=n_genitori))
+    conteggi[:residue] += 1
+
+    # taglio dell'eccesso e completamento casuale, come nell'assegnazione a lista
+    eccesso = int(conteggi.sum()) - n_figli
+    if eccesso > 0:
+        cumulati = np.cumsum(conteggi)
+        ultimo = int(np.searchsorted(cumulati, n_figli))
+        if ultimo < n_genitori:
+            conteggi[ultimo] -= cumulati[ultimo] - n_figli
+            conteggi[ultimo + 1:] = 0
+    elif eccesso < 0:
+        conteggi += np.bincount(rng.integers(0, n_genitori, size=-eccesso), minlength=n_genitori)
+    return conteggi
+
+
+def indici_figli(
+    n_figli: int,
+    pesi: np.ndarray,
+    rng: np.random.Generator,
+    min_figli: int = 0,
+    max_figli: Optional[int] = None
+) -> np.ndarray:
+    """
+    Genitore (come indice 0..n-1) di ciascuno degli n_figli, estratto in
+    proporzione ai pesi e già in ordine casuale, rispettando min_figli e
+    max_figli per genitore.
+
+    Ogni genitore occupa min_figli posizioni scelte a caso; le altre vengono
+    estratte con la tabella alias. Le estrazioni oltre max_figli vengono
+    respinte e riestratte tra i genitori non ancora saturi. Nessun passaggio
+    richiede di mescolare l'intero array.
+    """
+    return AssegnatoreFigli(n_figli, pesi, rng, min_figli, max_figli).prossimi(n_figli)
+
+
+class AssegnatoreFigli:
+    """
+    Come indici_figli, ma restituisce i genitori a blocchi successivi di
+    figli (in ordine di posizione), così la tabella figlia può essere
+    generata a chunk. Lo stato è proporzionale al numero di genitori:
+    tabella alias, posizioni riservate ai minimi e capienza residua.
+    """
+
+    def __init__(
+        self,
+        n_figli: int,
+        pesi: np.ndarray,
+        rng: np.random.Generator,
+        min_figli: int = 0,
+        max_figli: Optional[int] = None
+    ):
+        self.n_figli = n_figli
+        self.pesi = np.asarray(pesi, dtype=np.float64)
+        self.rng = rng
+        self.assegnati = 0
+        n_genitori = len(self.pesi)
+        min_figli, max_figli = limiti_fattibili(n_figli, n_genitori, min_figli, max_figli)
+
+        # senza massimo la tabella alias non cambia: si costruisce una volta
+        self._alias = None
+        if max_figli is None:
+            self._alias = TabellaAlias(self.pesi if self.pesi.sum() > 0 else np.ones(n_genitori))
+
+        riservati = min_figli * n_genitori
+        if riservati:
+            posizioni = rng.choice(n_figli, size=riservati, replace=False)
+            genitori = rng.permutation(np.repeat(np.arange(n_genitori), min_figli))
+            ordine = np.argsort(posizioni)
+            self._posizioni_riservate = posizioni[ordine]
+            self._genitori_riservati = genitori[ordine]
+        else:
+            self._posizioni_riservate = np.empty(0, dtype=np.int64)
+            self._genitori_riservati = np.empty(0, dtype=np.int64)
+
+        self._capienza = (
+            np.full(n_genitori, max_figli - min_figli, dtype=np.int64)
+            if max_figli is not None else None
+        )
+
+    def prossimi(self, n: int) -> np.ndarray:
+        """Genitori dei prossimi n figli (meno se i figli sono finiti)."""
+        inizio = self.assegnati
+        n = max(0, min(n, self.n_figli - inizio))
+        self.assegnati += n
+
+        if not len(self._posizioni_riservate) and self._capienza is None:
+            return self._alias.campiona(n, self.rng)
+
+        indici = np.empty(n, dtype=np.int64)
+        da, a = np.searchsorted(self._posizioni_riservate, [inizio, inizio + n])
+        if a > da:
+            posizioni = self._posizioni_riservate[da:a] - inizio
+            indici[posizioni] = self._genitori_riservati[da:a]
+            liberi = np.ones(n, dtype=bool)
+            liberi[posizioni] = False
+            da_riempire = np.flatnonzero(liberi)
+        else:
+            da_riempire = np.arange(n)
+
+        capienza = self._capienza
+        n_genitori = len(self.pesi)
+        while len(da_riempire):
+            if capienza is None:
+                estratti = self._alias.campiona(len(da_riempire), self.rng)
+                indici[da_riempire] = estratti
+                break
+
+            attivi = capienza > 0
+            p = np.where(attivi, self.pesi, 0.0)
+            if p.sum() <= 0:
+                # restano solo genitori a peso zero con posti liberi
+                p = attivi.astype(np.float64)
+
+            estratti = TabellaAlias(p).campiona(len(da_riempire), self.rng)
+            accettati = np.ones(len(estratti), dtype=bool)
+
+            saturi = np.bincount(estratti, minlength=n_genitori) > capienza
+            if saturi.any():
+                # per i genitori saturi si tengono le prime estrazioni fino alla capienza:
+                # id compatti su pochi bit, così l'ordinamento stabile è un radix sort
+                id_saturi = np.flatnonzero(saturi)
+                compatti = np.full(n_genitori, -1, dtype=np.int64)
+                compatti[id_saturi] = np.arange(len(id_saturi))
+                candidati = np.flatnonzero(saturi[estratti])
+                gruppo = compatti[estratti[candidati]].astype(np.min_scalar_type(-len(id_saturi)))
+                ordine = np.argsort(gruppo, kind="stable")
+                gruppo = gruppo[ordine]
+                inizio_gruppo = np.concatenate([[0], np.cumsum(np.bincount(gruppo))[:-1]])
+                rango = np.arange(len(gruppo)) - inizio_gruppo[gruppo]
+                accettati[candidati[ordine][rango >= capienza[id_saturi][gruppo]]] = False
+            capienza -= np.bincount(estratti[accettati], minlength=n_genitori)
+
+            indici[da_riempire[accettati]] = estratti[accettati]
+            da_riempire = da_riempire[~accettati]
+
+        return indici
+
+
+class AssegnatoreBilanciato:
+    """
+    Versione a blocchi dell'assegnazione bilanciata: i conteggi per genitore
+    sono fissati all'inizio e ogni blocco ne estrae una parte con una
+    ipergeometrica multivariata, che equivale a leggere a pezzi una
+    permutazione casuale dell'intera assegnazione. Costo O(genitori) per blocco.
+    """
+
+    def __init__(self, n_figli: int, n_genitori: int, rng: np.random.Generator):
+        self.rng = rng
+        self.rimanenti = rng.permutation(conteggi_bilanciati(n_figli, n_genitori, rng))
+
+    def prossimi(self, n: int) -> np.ndarray:
+        n = max(0, min(n, int(self.rimanenti.sum())))
+        conteggi = self.rng.multivariate_hypergeometric(self.rimanenti, n, method="marginals")
+        self.rimanenti = self.rimanenti - conteggi
+        indici = np.repeat(np.arange(len(conteggi)), conteggi)
+        self.rng.shuffle(indici)
+        return indici
+
+
+def limiti_fattibili(
+    n_figli: int,
+    n_genitori: int,
+    min_figli: int = 0,
+    max_figli: Optional[int] = None
+) -> tuple[int, Optional[int]]:
+    """
+    Adatta min/max figli se non compatibili con il numero di figli
+    (es. min 1 figlio per corso ma meno risorse che corsi).
+    """
+    if min_figli * n_genitori > n_figli:
+        nuovo_min = n_figli // n_genitori
+        logger.warning(
+            f"min_figli={min_figli} impossibile con {n_figli} figli e {n_genitori} genitori: uso {nuovo_min}"
+        )
+        min_figli = nuovo_min
+    if max_figli is not None and max_figli * n_genitori < n_figli:
+        nuovo_max = math.ceil(n_figli / n_genitori)
+        logger.warning(
+            f"max_figli={max_figli} impossibile con {n_figli} figli e {n_genitori} genitori: uso {nuovo_max}"
+        )
+        max_figli = nuovo_max
+    if max_figli is not None and max_figli < min_figli:
+        raise ValueError(f"max_figli ({max_figli}) minore di min_figli ({min_figli})")
+    return min_figli, max_figli
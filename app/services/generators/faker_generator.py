@@ -1,8 +1,14 @@
+import numpy as np
 import pandas as pd
-import random
 import logging
+import re
+import time
+import unicodedata
+import zlib
 from faker import Faker
-from typing import Callable, Dict, Any
+from typing import Callable, Dict, Any, Iterable, Optional
+
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -48,14 +54,251 @@ def faker_lookup(tipo: str) -> Callable[[], Any]:
 
 
 
+# POOL DI VALORI FAKER
+
+# tipi Faker campionati da un pool pre-generato: metodo Faker per tipo
+METODI_POOL = {
+    "stringa": "word",
+    "nome": "first_name",
+    "cognome": "last_name",
+    "username": "user_name",
+    "istituzione": "company",
+    "dipartimento": "bs",
+    "indirizzo": "address",
+    "città": "city",
+    "paese": "country",
+    "telefono": "phone_number",
+    "dominio_email": "free_email_domain"
+}
+
+# tipi i cui provider it_IT pescano da una lista costruita da un set, con un
+# ordine che cambia tra processi (PYTHONHASHSEED): il pool parte dagli elementi
+# ordinati, mescolati con numpy. {tipo: (provider, attributo con gli elementi)}
+ELEMENTI_POOL = {
+    "città": ("faker.providers.address", "cities")
+}
+
+# pool usati dai tipi ricombinati a partire da altri valori
+POOL_PER_TIPO = {
+    "email": ("username", "dominio_email"),
+    "telefono": ("telefono",)
+}
+
+
+class PoolFaker:
+    """
+    Pool di valori Faker pre-generati per tipo, campionati poi con numpy.
+
+    Un pool contiene al più `dimensione` valori e viene esteso solo quando
+    serve, così un dataset piccolo non paga la generazione di un pool grande.
+    Con un seed ogni tipo ha un'istanza Faker dedicata e seminata, quindi i
+    primi k valori di un pool sono sempre gli stessi, indipendentemente
+    dall'ordine delle richieste: pool(tipo, n) restituisce esattamente quel prefisso.
+
+    I provider it_IT che partono da un set (es. le città, vedi ELEMENTI_POOL)
+    vengono campionati da numpy sugli elementi ordinati, così i pool non
+    dipendono dal processo. prepara() li genera una volta sola per passarli
+    ai worker con pool_iniziali.
+    """
+
+    def __init__(
+        self,
+        faker_instance: Faker,
+        dimensione: int,
+        seed: Optional[int] = None,
+        pool_iniziali: Optional[Dict[str, np.ndarray]] = None
+    ):
+        self.faker = faker_instance
+        self.dimensione = dimensione
+        self.seed = seed
+        self._pool: Dict[str, np.ndarray] = dict(pool_iniziali or {})
+        self._faker_per_tipo: Dict[str, Faker] = {}
+        self._normalizzati: Dict[str, np.ndarray] = {}
+        self._elementi: Dict[str, np.ndarray] = {}
+
+    def _faker(self, tipo: str) -> Faker:
+        if self.seed is None:
+            return self.faker
+        istanza = self._faker_per_tipo.get(tipo)
+        if istanza is None:
+            istanza = Faker("it_IT")
+            istanza.seed_instance(int(self._sequenza(tipo).generate_state(1)[0]))
+            self._faker_per_tipo[tipo] = istanza
+        return istanza
+
+    def _sequenza(self, tipo: str) -> np.random.SeedSequence:
+        return np.random.SeedSequence([self.seed, zlib.crc32(tipo.encode("utf-8"))])
+
+    def _da_elementi(self, tipo: str, n: int) -> np.ndarray:
+        """
+        Primi n valori del pool di un tipo in ELEMENTI_POOL: gli elementi
+        ordinati in una permutazione fissata dal seed, ripetuta se n è maggiore.
+        """
+        mescolati = self._elementi.get(tipo)
+        if mescolati is None:
+            provider, attributo = ELEMENTI_POOL[tipo]
+            elementi = np.array(sorted(set(getattr(self._faker(tipo).provider(provider), attributo))), dtype=object)
+            rng = np.random.default_rng(None if self.seed is None else self._sequenza(tipo))
+            mescolati = self._elementi[tipo] = elementi[rng.permutation(len(elementi))]
+        return np.resize(mescolati, n)
+
+    def pool(self, tipo: str, n: int) -> np.ndarray:
+        richiesti = max(1, min(n, self.dimensione))
+        esistente = self._pool.get(tipo)
+        if esistente is not None and len(esistente) >= richiesti:
+            return esistente[:richiesti]
+
+        if tipo in ELEMENTI_POOL:
+            pool = self._da_elementi(tipo, richiesti)
+            self._pool[tipo] = pool
+            return pool
+
+        metodo = getattr(self._faker(tipo), METODI_POOL[tipo])
+        gia_presenti = 0 if esistente is None else len(esistente)
+        nuovi = np.array([metodo() for _ in range(richiesti - gia_presenti)], dtype=object)
+        pool = nuovi if esistente is None else np.concatenate([esistente, nuovi])
+        self._pool[tipo] = pool
+        return pool
+
+    def campiona(self, tipo: str, n: int, rng: np.random.Generator) -> np.ndarray:
+        pool = self.pool(tipo, n)
+        return pool[rng.integers(0, len(pool), size=n)]
+
+    def normalizzati(self, tipo: str, n: int) -> np.ndarray:
+        """pool(tipo, n) passato per normalizza_per_username, calcolato una volta."""
+        pool = self.pool(tipo, n)
+        cache = self._normalizzati.get(tipo)
+        if cache is None or len(cache) < len(pool):
+            gia_presenti = 0 if cache is None else len(cache)
+            nuovi = np.array([normalizza_per_username(v) for v in pool[gia_presenti:]], dtype=object)
+            cache = nuovi if cache is None else np.concatenate([cache, nuovi])
+            self._normalizzati[tipo] = cache
+        return cache[:len(pool)]
+
+    def prepara(self, tipi: Iterable[str], n: int) -> Dict[str, np.ndarray]:
+        """Genera subito i pool dei tipi indicati, per al più n valori ciascuno."""
+        return {tipo: self.pool(tipo, n) for tipo in sorted(set(tipi))}
+
+
+pool_faker = PoolFaker(faker, settings.FAKER_POOL_SIZE)
+
+
+
+# GENERAZIONE VETTORIALE DI VALORI
+
+# stringhe "0".."255" e "0000".."9999" per comporre IP e numeri di telefono
+_OTTETTI = np.array([str(i) for i in range(256)], dtype=object)
+_QUATTRO_CIFRE = np.array([f"{i:04d}" for i in range(10_000)], dtype=object)
+
+# reti private o riservate escluse dagli IP generati (come faker.ipv4)
+_RETI_ESCLUSE = [
+    (0, 0, 8), (10, 0, 8), (100, 64, 10), (127, 0, 8), (169, 254, 16),
+    (172, 16, 12), (192, 168, 16), (198, 18, 15)
+]
+
+SECONDI_CINQUE_ANNI = 5 * 365 * 24 * 3600
+
+
+def valori_timestamp(n: int, rng: np.random.Generator, adesso: Optional[int] = None) -> np.ndarray:
+    """Timestamp unix uniformi nei 5 anni prima di adesso (default: ora)."""
+    adesso = int(time.time()) if adesso is None else adesso
+    return rng.integers(adesso - SECONDI_CINQUE_ANNI, adesso, size=n, endpoint=True, dtype=np.int64)
+
+
+def valori_ip(n: int, rng: np.random.Generator) -> np.ndarray:
+    """IPv4 pubblici (classi A-C, senza reti private o riservate)."""
+    ottetti = rng.integers(0, 256, size=(n, 4))
+    ottetti[:, 0] = rng.integers(1, 224, size=n)
+    while True:
+        esclusi = np.zeros(n, dtype=bool)
+        for primo, secondo, prefisso in _RETI_ESCLUSE:
+            maschera = 0xFF & (0xFF << max(0, 16 - prefisso)) if prefisso > 8 else 0
+            esclusi |= (ottetti[:, 0] == primo) & ((ottetti[:, 1] & maschera) == secondo)
+        if not esclusi.any():
+            break
+        ottetti[esclusi, 0] = rng.integers(1, 224, size=int(esclusi.sum()))
+
+    o = _OTTETTI
+    return o[ottetti[:, 0]] + "." + o[ottetti[:, 1]] + "." + o[ottetti[:, 2]] + "." + o[ottetti[:, 3]]
+
+
+def valori_telefono(n: int, rng: np.random.Generator, pool: PoolFaker) -> np.ndarray:
+    """Numeri con formato e prefisso da Faker e ultime 4 cifre casuali."""
+    prefissi = np.array([t[:-4] for t in pool.pool("telefono", n)], dtype=object)
+    return prefissi[rng.integers(0, len(prefissi), size=n)] + _QUATTRO_CIFRE[rng.integers(0, 10_000, size=n)]
+
+
+def valori_password(n: int, rng: np.random.Generator) -> np.ndarray:
+    """Hash fittizi nel formato "$2y$" + 61 cifre esadecimali, come faker.sha256()[3:]."""
+    esadecimali = rng.bytes((61 * n + 1) // 2).hex()[:61 * n]
+    return "$2y$" + np.frombuffer(esadecimali.encode("ascii"), dtype="S61").astype("U61").astype(object)
+
+
+def valori_faker(
+    n: int,
+    tipo: str = "stringa",
+    rng: Optional[np.random.Generator] = None,
+    pool: Optional[PoolFaker] = None,
+    adesso: Optional[int] = None
+) -> np.ndarray:
+    """
+    Genera n valori del tipo specificato in blocco.
+
+    Tipi numerici (timestamp, intero, booleano), ip e password sono estratti
+    direttamente con numpy; i tipi testuali vengono campionati da un pool di
+    valori Faker o ricombinati a partire da esso (email, telefono).
+    """
+    rng = rng or np.random.default_rng()
+    pool = pool or pool_faker
+
+    if tipo == "timestamp":
+        return valori_timestamp(n, rng, adesso)
+    if tipo == "intero":
+        return rng.integers(0, 100, size=n, endpoint=True, dtype=np.int64)
+    if tipo == "booleano":
+        return rng.random(n) < 0.5
+    if tipo == "ip":
+        return valori_ip(n, rng)
+    if tipo == "password":
+        return valori_password(n, rng)
+    if tipo == "telefono":
+        return valori_telefono(n, rng, pool)
+    if tipo == "email":
+        return pool.campiona("username", n, rng) + "@" + pool.campiona("dominio_email", n, rng)
+    if tipo in METODI_POOL:
+        return pool.campiona(tipo, n, rng)
+
+    logger.warning(f"Tipo Faker '{tipo}' non riconosciuto, restituisco NA.")
+    return np.full(n, pd.NA, dtype=object)
+
+
+def valori_lista(n: int, valori: list, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Genera n valori scelti a caso da una lista."""
+    rng = rng or np.random.default_rng()
+    scelte = np.array(valori, dtype=object if any(isinstance(v, str) for v in valori) else None)
+    return scelte[rng.integers(0, len(scelte), size=n)]
+
+
+def valori_float_range(
+    n: int,
+    minimo: float,
+    massimo: float,
+    decimali: int = 1,
+    rng: Optional[np.random.Generator] = None
+) -> np.ndarray:
+    """Genera n float casuali tra minimo e massimo, arrotondati a decimali cifre."""
+    rng = rng or np.random.default_rng()
+    return np.round(rng.uniform(minimo, massimo, size=n), decimali)
+
+
+
 # FUNZIONI BASE
 
 def riempi_colonna_faker(df: pd.DataFrame, colonna: str, tipo: str = "stringa") -> pd.DataFrame:
     """
     Riempie una colonna con valori generati da Faker in base al tipo specificato.
     """
-    generatore = faker_lookup(tipo)
-    df[colonna] = [generatore() for _ in range(len(df))]
+    df[colonna] = valori_faker(len(df), tipo)
     return df
 
 def riempi_colonna_null(df: pd.DataFrame, colonna: str) -> pd.DataFrame:
@@ -76,7 +319,7 @@ def riempi_colonna_lista(df: pd.DataFrame, colonna: str, valori: list) -> pd.Dat
     """
     Riempie la colonna con valori casuali scelti presi da una lista
     """
-    df[colonna] = [random.choice(valori) for _ in range(len(df))]
+    df[colonna] = valori_lista(len(df), valori)
     return df
 
 def riempi_colonna_float_range(
@@ -99,85 +342,438 @@ def riempi_colonna_float_range(
     Returns:
         DataFrame aggiornato
     """
-    df[colonna] = [round(random.uniform(minimo, massimo), decimali) for _ in range(len(df))]
+    df[colonna] = valori_float_range(len(df), minimo, massimo, decimali)
     return df
 
 # PER RIEMPIRE LE COLONNE RELATIVE AGLI UTENTI
-def riempi_utenti_coerenti(df: pd.DataFrame) -> pd.DataFrame:
+
+DOMINIO_EMAIL_UTENTI = "example.com"
+
+# colonne scritte da completa_identita (nome, username, email, password e timestamp)
+COLONNE_IDENTITA = (
+    "firstname", "lastname", "username", "email", "password",
+    "timecreated", "timemodified", "firstaccess", "lastaccess", "lastlogin", "currentlogin"
+)
+
+
+def normalizza_per_username(valore: str) -> str:
+    """
+    Minuscolo, senza accenti né caratteri diversi da lettere e cifre
+    ("Niccolò" -> "niccolo", "D'Amico" -> "damico").
+    """
+    decomposto = unicodedata.normalize("NFKD", str(valore))
+    ascii_ = "".join(c for c in decomposto if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]", "", ascii_.lower()) or "utente"
+
+
+class RegistroUnivoci:
     """
-    Riempie le colonne firstname, lastname, username, email con dati coerenti tra loro.
+    Valori già assegnati da alloca_univoci in blocchi precedenti (es. gli
+    username dei chunk già scritti), conservati come hash a 64 bit ordinati,
+    insieme al numero di occorrenze di ciascuna base: 8 byte per valore e
+    16 per base distinta invece delle stringhe. Con i conteggi i suffissi
+    continuano tra un blocco e l'altro come in un'unica allocazione; una
+    collisione di hash fa solo scegliere un suffisso in più, mai un duplicato.
     """
-    utenti = []
 
-    for _ in range(len(df)):
-        first = faker.first_name()
-        last = faker.last_name()
-        username = f"{first.lower()}.{last.lower()}"
-        email = f"{username}@example.com"
+    def __init__(self):
+        self._hash = np.empty(0, dtype=np.uint64)
+        self._basi = np.empty(0, dtype=np.uint64)
+        self._conteggi = np.empty(0, dtype=np.int64)
 
-        utenti.append({
-            "firstname": first,
-            "lastname": last,
-            "username": username,
-            "email": email
-        })
+    def __len__(self) -> int:
+        return len(self._hash)
 
-    df_utenti = pd.DataFrame(utenti)
-    for col in df_utenti.columns:
-        df[col] = df_utenti[col]
+    @staticmethod
+    def _calcola_hash(valori) -> np.ndarray:
+        return pd.util.hash_array(np.asarray(valori, dtype=object))
 
-    return df
+    @staticmethod
+    def _cerca(ordinati: np.ndarray, h: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if not len(ordinati):
+            return np.zeros(len(h), dtype=np.int64), np.zeros(len(h), dtype=bool)
+        posizioni = np.minimum(np.searchsorted(ordinati, h), len(ordinati) - 1)
+        return posizioni, ordinati[posizioni] == h
 
+    def contiene(self, valori) -> np.ndarray:
+        return self._cerca(self._hash, self._calcola_hash(valori))[1]
 
+    def __contains__(self, valore) -> bool:
+        return bool(self.contiene([valore])[0])
 
-# RIEMPIMENTO DA SCHEMA
+    def occorrenze(self, basi) -> np.ndarray:
+        """Quante volte ciascuna base è già stata allocata."""
+        if not len(self._basi):
+            return np.zeros(len(basi), dtype=np.int64)
+        posizioni, trovate = self._cerca(self._basi, self._calcola_hash(basi))
+        return np.where(trovate, self._conteggi[posizioni], 0)
+
+    def aggiungi(self, valori, basi):
+        # ordinamento stabile su interi: radix sort, lineare nel numero di valori
+        self._hash = np.sort(np.concatenate([self._hash, self._calcola_hash(valori)]), kind="stable")
+        tutte = np.concatenate([self._basi, self._calcola_hash(basi)])
+        pesi = np.concatenate([self._conteggi, np.ones(len(basi), dtype=np.int64)])
+        self._basi, inverse = np.unique(tutte, return_inverse=True)
+        self._conteggi = np.bincount(inverse, weights=pesi, minlength=len(self._basi)).astype(np.int64)
 
-# Mappa funzioni disponibili
-FUNZIONI_RIEMPIMENTO: Dict[str, Callable[..., pd.DataFrame]] = {
-    "riempi_colonna_faker": riempi_colonna_faker,
-    "riempi_colonna_null": riempi_colonna_null,
-    "riempi_colonna_default": riempi_colonna_default,
-    "riempi_colonna_lista": riempi_colonna_lista,
-    "riempi_colonna_float_range": riempi_colonna_float_range,
-    "riempi_utenti_coerenti": riempi_utenti_coerenti,
-}
 
-def riempi_colonne_da_schema(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+def alloca_univoci(basi: np.ndarray, esistenti=None) -> np.ndarray:
     """
-    Riempie più colonne in un DataFrame usando uno schema di configurazione.
+    Rende univoci i valori aggiungendo un suffisso numerico alle ripetizioni:
+    la prima occorrenza resta com'è, le successive diventano base1, base2, ...
+
+    I suffissi si calcolano in blocco contando le occorrenze per base; le
+    poche collisioni residue (con valori esistenti o con basi che finiscono
+    già in cifre) vengono risolte con un insieme dei valori già assegnati.
+    esistenti può essere un iterabile di valori o un RegistroUnivoci, che in
+    quel caso viene aggiornato con i valori assegnati.
+    """
+    serie = pd.Series(basi, dtype=object)
+    occorrenza = serie.groupby(serie, sort=False).cumcount().to_numpy()
+    registro = esistenti if isinstance(esistenti, RegistroUnivoci) else None
+    if registro is not None:
+        occorrenza = occorrenza + registro.occorrenze(basi)
+    suffissi = np.where(occorrenza > 0, occorrenza.astype(str).astype(object), "")
+    risultato = (serie.to_numpy() + suffissi).astype(object)
+
+    esistenti = set() if registro is not None else set(esistenti or ())
+    in_conflitto = pd.Series(risultato).duplicated(keep="first").to_numpy()
+    if registro is not None and len(registro):
+        in_conflitto = in_conflitto | registro.contiene(risultato)
+    elif esistenti:
+        in_conflitto = in_conflitto | pd.Series(risultato).isin(esistenti).to_numpy()
+    if not in_conflitto.any():
+        if registro is not None:
+            registro.aggiungi(risultato, basi)
+        return risultato
+
+    assegnati = esistenti | set(risultato[~in_conflitto].tolist())
+    prossimo: Dict[str, int] = {}
+    for i in np.flatnonzero(in_conflitto):
+        base = basi[i]
+        k = prossimo.get(base, max(1, occorrenza[i]))
+        while f"{base}{k}" in assegnati or (registro is not None and f"{base}{k}" in registro):
+            k += 1
+        risultato[i] = f"{base}{k}"
+        assegnati.add(risultato[i])
+        prossimo[base] = k + 1
+    logger.info(f"Risolte {int(in_conflitto.sum())} collisioni di username")
+    if registro is not None:
+        registro.aggiungi(risultato, basi)
+    return risultato
+
+
+def timestamp_coerenti(
+    n: int,
+    rng: np.random.Generator,
+    adesso: Optional[int] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Timestamp di un utente ordinati in modo plausibile:
+    timecreated <= firstaccess <= lastlogin <= currentlogin <= lastaccess <= adesso,
+    con timemodified tra timecreated e adesso (default: ora).
+    """
+    adesso = int(time.time()) if adesso is None else adesso
+
+    def tra(da: np.ndarray, a) -> np.ndarray:
+        return da + (rng.random(n) * (a - da)).astype(np.int64)
+
+    timecreated = rng.integers(adesso - SECONDI_CINQUE_ANNI, adesso, size=n, endpoint=True, dtype=np.int64)
+    firstaccess = tra(timecreated, adesso)
+    lastaccess = tra(firstaccess, adesso)
+    lastlogin = tra(firstaccess, lastaccess)
+    currentlogin = tra(lastlogin, lastaccess)
+    return {
+        "timecreated": timecreated,
+        "timemodified": tra(timecreated, adesso),
+        "firstaccess": firstaccess,
+        "lastaccess": lastaccess,
+        "lastlogin": lastlogin,
+        "currentlogin": currentlogin
+    }
+
+
+def genera_identita(
+    n: int,
+    rng: np.random.Generator,
+    pool: Optional[PoolFaker] = None,
+    adesso: Optional[int] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Nome, cognome, base dello username (nome.cognome normalizzati, non
+    ancora univoca), password e timestamp ordinati per n utenti.
+    """
+    pool = pool or pool_faker
+
+    # normalizzazione calcolata sui pool (piccoli) e poi indicizzata
+    nomi = pool.pool("nome", n)
+    cognomi = pool.pool("cognome", n)
+    i_nome = rng.integers(0, len(nomi), size=n)
+    i_cognome = rng.integers(0, len(cognomi), size=n)
+    nomi_norm = pool.normalizzati("nome", n)
+    cognomi_norm = pool.normalizzati("cognome", n)
+
+    return {
+        "firstname": nomi[i_nome],
+        "lastname": cognomi[i_cognome],
+        "base_username": nomi_norm[i_nome] + "." + cognomi_norm[i_cognome],
+        "password": valori_password(n, rng),
+        **timestamp_coerenti(n, rng, adesso)
+    }
+
+
+def completa_identita(
+    identita: Dict[str, np.ndarray],
+    usernames_esistenti=None
+) -> pd.DataFrame:
+    """
+    Rende univoci gli username su tutte le righe e ne deriva le email.
+    Va eseguita sull'insieme completo degli utenti, oppure a blocchi
+    passando un RegistroUnivoci con gli username dei blocchi precedenti.
+    """
+    colonne = dict(identita)
+    username = alloca_univoci(colonne.pop("base_username"), usernames_esistenti)
+    utenti = {
+        "firstname": colonne.pop("firstname"),
+        "lastname": colonne.pop("lastname"),
+        "username": username,
+        "email": username + f"@{DOMINIO_EMAIL_UTENTI}",
+        **colonne
+    }
+    return pd.DataFrame(utenti, index=pd.RangeIndex(len(username)))
+
+
+def genera_utenti_coerenti(
+    n: int,
+    rng: Optional[np.random.Generator] = None,
+    pool: Optional[PoolFaker] = None,
+    usernames_esistenti: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
+    """
+    Genera in blocco n identità coerenti: firstname, lastname, username ed
+    email derivati dal nome (univoci), password e timestamp ordinati.
 
     Args:
-        df: DataFrame da modificare
-        schema: dict con {colonna: {"func": nome_funzione, "args": {...}}}
+        n: numero di utenti
+        rng: generatore numpy (default: uno nuovo)
+        pool: pool Faker da cui campionare nomi e cognomi
+        usernames_esistenti: username già occupati da evitare
 
     Returns:
-        DataFrame aggiornato
+        DataFrame con le colonne generate
     """
-    for col, config in schema.items():
-        func_name = config["func"]
-        args = config.get("args", {})
-        func = FUNZIONI_RIEMPIMENTO.get(func_name)
-        if func:
-            df = func(df, col, **args)
-        else:
-            logger.error(f"Funzione '{func_name}' non trovata per la colonna '{col}'")
-    return df
-    
+    rng = rng or np.random.default_rng()
+    return completa_identita(genera_identita(n, rng, pool), usernames_esistenti)
 
 
+def riempi_utenti_coerenti(
+    df: pd.DataFrame,
+    rng: Optional[np.random.Generator] = None,
+    pool: Optional[PoolFaker] = None
+) -> pd.DataFrame:
+    """
+    Riempie le colonne firstname, lastname, username, email, password e i
+    timestamp di accesso con dati coerenti tra loro; username ed email sono univoci.
+    """
+    utenti = genera_utenti_coerenti(len(df), rng, pool)
+    utenti.index = df.index
+    return sostituisci_colonne(df, [utenti])
 
 
+def sostituisci_colonne(
+    df: pd.DataFrame,
+    blocchi: list[pd.DataFrame],
+    ordine_nuove: Optional[list[str]] = None
+) -> pd.DataFrame:
+    """
+    Sostituisce (o aggiunge in coda) le colonne contenute nei blocchi con una
+    sola concatenazione, mantenendo l'ordine delle colonne e df.attrs.
+    Le colonne aggiunte seguono ordine_nuove (es. l'ordine dello schema),
+    altrimenti l'ordine dei blocchi.
+    """
+    nuove = [c for blocco in blocchi for c in blocco.columns]
+    sostituite = set(nuove)
+    parti = [df.drop(columns=[c for c in df.columns if c in sostituite])] + blocchi
 
+    if ordine_nuove is not None:
+        previste = set(ordine_nuove)
+        nuove = [c for c in ordine_nuove if c in sostituite] + [c for c in nuove if c not in previste]
+    ordine = list(df.columns) + [c for c in nuove if c not in df.columns]
+    risultato = pd.concat(parti, axis=1)[ordine]
+    risultato.attrs = dict(df.attrs)
+    return risultato
 
 
 
+# RIEMPIMENTO DA SCHEMA
 
+# Mappa funzioni disponibili
+FUNZIONI_RIEMPIMENTO: Dict[str, Callable[..., pd.DataFrame]] = {
+    "riempi_colonna_faker": riempi_colonna_faker,
+    "riempi_colonna_null": riempi_colonna_null,
+    "riempi_colonna_default": riempi_colonna_default,
+    "riempi_colonna_lista": riempi_colonna_lista,
+    "riempi_colonna_float_range": riempi_colonna_float_range,
+    "riempi_utenti_coerenti": riempi_utenti_coerenti,
+}
+
+# Funzioni dello schema che producono valori casuali colonna per colonna
+GENERATORI_VALORI: Dict[str, Callable[..., Any]] = {
+    "riempi_colonna_faker": valori_faker,
+    "riempi_colonna_lista": valori_lista,
+    "riempi_colonna_float_range": valori_float_range,
+}
 
 
+# dtype che pandas assegna a una colonna di stringhe (object o str a seconda della versione)
+DTYPE_STRINGA = pd.Series([""]).dtype
 
 
+def _dtype_costante(valore) -> Any:
+    if valore is None or valore is pd.NA:
+        return object
+    if isinstance(valore, bool):
+        return np.bool_
+    if isinstance(valore, int):
+        return np.int64
+    if isinstance(valore, float):
+        return np.float64
+    if isinstance(valore, str):
+        return DTYPE_STRINGA
+    return object
 
 
+class PianoSchema:
+    """
+    Schema Faker compilato in un piano di esecuzione:
+    - costanti: colonne a valore fisso (default e NA), materializzate insieme
+      in un blocco 2D per dtype
+    - generatori: colonne casuali, generate come array e inserite in un'unica
+      costruzione di DataFrame
+    - altre: funzioni che lavorano sul DataFrame intero (es. riempi_utenti_coerenti),
+      applicate per ultime
+    """
 
+    def __init__(self, schema: dict):
+        self.colonne = list(schema)
+        self.costanti: Dict[str, Any] = {}
+        self.generatori: list[tuple[str, Callable[..., Any], dict]] = []
+        self.altre: list[tuple[str, Callable[..., pd.DataFrame], dict]] = []
+
+        for col, config in schema.items():
+            func_name = config["func"]
+            args = config.get("args", {})
+            if func_name == "riempi_colonna_default":
+                self.costanti[col] = args.get("valore", 0)
+            elif func_name == "riempi_colonna_null":
+                self.costanti[col] = pd.NA
+            elif func_name in GENERATORI_VALORI:
+                self.generatori.append((col, GENERATORI_VALORI[func_name], args))
+            elif func_name in FUNZIONI_RIEMPIMENTO:
+                self.altre.append((col, FUNZIONI_RIEMPIMENTO[func_name], args))
+            else:
+                logger.error(f"Funzione '{func_name}' non trovata per la colonna '{col}'")
+
+    def blocchi_costanti(self, index: pd.Index) -> list[pd.DataFrame]:
+        """Un DataFrame a blocco unico per ciascun dtype delle costanti."""
+        gruppi: Dict[Any, list[str]] = {}
+        for col, valore in self.costanti.items():
+            gruppi.setdefault(_dtype_costante(valore), []).append(col)
+
+        blocchi = []
+        for dtype, colonne in gruppi.items():
+            estensione = isinstance(dtype, pd.api.extensions.ExtensionDtype)
+            dtype_numpy = object if estensione else dtype
+            dati = np.empty((len(index), len(colonne)), dtype=dtype_numpy)
+            dati[:] = np.array([self.costanti[c] for c in colonne], dtype=dtype_numpy)
+            blocco = pd.DataFrame(dati, index=index, columns=colonne, dtype=dtype_numpy, copy=False)
+            if estensione:
+                blocco = blocco.astype(dtype)
+            blocchi.append(blocco)
+        return blocchi
+
+    def tipi_pool(self) -> set[str]:
+        """Pool Faker da cui campionano le colonne casuali dello schema."""
+        tipi = set()
+        for _col, funzione, args in self.generatori:
+            tipo = args.get("tipo", "stringa")
+            if funzione is valori_faker:
+                tipi.update(POOL_PER_TIPO.get(tipo, (tipo,) if tipo in METODI_POOL else ()))
+        return tipi
+
+    def genera(
+        self,
+        n: int,
+        rng: np.random.Generator,
+        pool: Optional[PoolFaker] = None,
+        adesso: Optional[int] = None
+    ) -> Dict[str, np.ndarray]:
+        """Valori delle sole colonne casuali, come array."""
+        generati = {}
+        for col, funzione, args in self.generatori:
+            inizio = time.perf_counter()
+            if funzione is valori_faker:
+                generati[col] = funzione(n, **args, rng=rng, pool=pool, adesso=adesso)
+            else:
+                generati[col] = funzione(n, **args, rng=rng)
+            durata = time.perf_counter() - inizio
+            if n and durata > 0:
+                logger.debug(f"Colonna '{col}': {n / durata / 1e6:.2f} M valori/s")
+        return generati
+
+    def applica(
+        self,
+        df: pd.DataFrame,
+        rng: Optional[np.random.Generator] = None,
+        generati: Optional[Dict[str, np.ndarray]] = None
+    ) -> pd.DataFrame:
+        """
+        Riempie le colonne dello schema. generati permette di passare valori
+        casuali già calcolati altrove (es. a shard in processi separati).
+        """
+        if generati is None:
+            generati = self.genera(len(df), rng or np.random.default_rng())
+
+        blocchi = self.blocchi_costanti(df.index)
+        if generati:
+            blocchi.append(pd.DataFrame(generati, index=df.index))
+        # colonne nuove nell'ordine dello schema, non in quello dei blocchi per dtype
+        risultato = sostituisci_colonne(df, blocchi, self.colonne)
+
+        for col, funzione, args in self.altre:
+            risultato = funzione(risultato, col, **args)
+        return risultato
+
+
+_piani: Dict[int, tuple[dict, PianoSchema]] = {}
+
+
+def compila_schema(schema: dict) -> PianoSchema:
+    """
+    Compila lo schema una sola volta; gli schemi sono costanti di modulo,
+    quindi il piano viene riusato a ogni chiamata.
+    """
+    voce = _piani.get(id(schema))
+    if voce is None or voce[0] is not schema:
+        voce = (schema, PianoSchema(schema))
+        _piani[id(schema)] = voce
+    return voce[1]
 
 
+def riempi_colonne_da_schema(
+    df: pd.DataFrame,
+    schema: dict,
+    rng: Optional[np.random.Generator] = None
+) -> pd.DataFrame:
+    """
+    Riempie più colonne in un DataFrame usando uno schema di configurazione.
+
+    Args:
+        df: DataFrame da modificare
+        schema: dict con {colonna: {"func": nome_funzione, "args": {...}}}
+        rng: generatore numpy per le colonne casuali (default: uno nuovo)
+
+    Returns:
+        DataFrame aggiornato
+    """
+    return compila_schema(schema).applica(df, rng)
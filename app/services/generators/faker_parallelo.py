@@ -0,0 +1,370 @@
+import logging
+import math
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services.generators.faker_generator import (
+    COLONNE_IDENTITA,
+    PoolFaker,
+    RegistroUnivoci,
+    compila_schema,
+    completa_identita,
+    faker,
+    genera_identita,
+    sostituisci_colonne
+)
+
+logger = logging.getLogger(__name__)
+
+# prefisso delle colonne di identità negli shard della tabella utenti
+PREFISSO_IDENTITA = "identita:"
+
+
+
+# SEED E POOL PER SHARD
+
+def rng_shard(seed: int, nome_tabella: str, shard: int) -> np.random.Generator:
+    """
+    Generatore di uno shard, derivato da (seed globale, tabella, indice shard):
+    non dipende da quale processo esegue lo shard né da quanti ce ne sono.
+    """
+    tabella = zlib.crc32(nome_tabella.encode("utf-8"))
+    return np.random.default_rng(np.random.SeedSequence([seed, tabella, shard]))
+
+
+# riferimento dei timestamp quando il seed è fissato e settings.FAKER_ADESSO no (1/1/2025 UTC)
+ADESSO_CON_SEED = 1_735_689_600
+
+# pool Faker del processo: nei worker arriva già pronto dal processo principale
+_pool_processo: Optional[PoolFaker] = None
+
+
+def _inizializza_worker(seed: int, pool_iniziali: Dict[str, np.ndarray]):
+    global _pool_processo
+    _pool_processo = PoolFaker(faker, settings.FAKER_POOL_SIZE, seed=seed, pool_iniziali=pool_iniziali)
+
+
+
+# TRASPORTO DEI RISULTATI (ARROW IN MEMORIA CONDIVISA)
+
+def _esporta(colonne: Dict[str, np.ndarray]):
+    """
+    Scrive le colonne come stream Arrow IPC in un segmento di memoria
+    condivisa e restituisce (nome segmento, byte): al processo principale
+    arriva solo il riferimento. Senza pyarrow restituisce le colonne stesse.
+    """
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return colonne
+
+    tabella = pa.table({col: pa.array(valori, from_pandas=True) for col, valori in colonne.items()})
+    misura = pa.MockOutputStream()
+    with pa.ipc.new_stream(misura, tabella.schema) as writer:
+        writer.write_table(tabella)
+    dimensione = misura.size()
+
+    segmento = shared_memory.SharedMemory(create=True, size=max(1, dimensione))
+    try:
+        buffer = pa.py_buffer(segmento.buf)
+        destinazione = pa.FixedSizeBufferWriter(buffer)
+        writer = pa.ipc.new_stream(destinazione, tabella.schema)
+        writer.write_table(tabella)
+        writer.close()
+        destinazione.close()
+        # il segmento si può chiudere solo senza viste Arrow ancora attive
+        del writer, destinazione, buffer
+    except BaseException:
+        segmento.close()
+        segmento.unlink()
+        raise
+    segmento.close()
+    return segmento.name, dimensione
+
+
+def _importa(risultato) -> Dict[str, np.ndarray]:
+    """Legge le colonne di uno shard e libera il segmento di memoria condivisa."""
+    if isinstance(risultato, dict):
+        return risultato
+
+    import pyarrow as pa
+
+    nome, dimensione = risultato
+    segmento = shared_memory.SharedMemory(name=nome)
+    try:
+        vista = segmento.buf[:dimensione]
+        buffer = pa.py_buffer(vista)
+        reader = pa.ipc.open_stream(buffer)
+        tabella = reader.read_all()
+        # copia: gli array non devono puntare al segmento che sta per essere liberato
+        colonne = {
+            col: np.array(tabella.column(col).to_numpy(zero_copy_only=False), copy=True)
+            for col in tabella.column_names
+        }
+        del tabella, reader, buffer
+        vista.release()
+    finally:
+        segmento.close()
+        segmento.unlink()
+    return colonne
+
+
+
+# ESECUZIONE DI UNO SHARD
+
+def genera_shard(
+    nome_tabella: str,
+    schema: dict,
+    shard: int,
+    n: int,
+    seed: int,
+    adesso: int,
+    utenti: bool = False,
+    pool: Optional[PoolFaker] = None
+) -> Dict[str, np.ndarray]:
+    """
+    Colonne casuali di uno shard di n righe. Con utenti=True aggiunge le
+    identità (nome, cognome, base dello username, password, timestamp): gli
+    username vengono resi univoci dopo, sull'intera tabella.
+    """
+    rng = rng_shard(seed, nome_tabella, shard)
+    pool = pool or _pool_processo
+    colonne = compila_schema(schema).genera(n, rng, pool, adesso)
+    if utenti:
+        for col, valori in genera_identita(n, rng, pool, adesso).items():
+            colonne[PREFISSO_IDENTITA + col] = valori
+    return colonne
+
+
+def _esegui_shard(*args, **kwargs):
+    return _esporta(genera_shard(*args, **kwargs))
+
+
+
+# STADIO FAKER A SHARD
+
+class StadioFaker:
+    """
+    Esecuzione a shard dello stadio Faker: pool e processi vengono preparati
+    una volta e riusati per tutte le chiamate a riempi (es. un chunk per volta).
+
+    Ogni shard ha un generatore derivato da (seed, tabella, indice shard) e le
+    dimensioni degli shard dipendono solo da righe_shard, quindi con lo stesso
+    seed e lo stesso adesso il risultato è identico bit per bit per qualsiasi
+    numero di processi, anche in run diversi; con un seed fissato anche adesso
+    lo è (settings.FAKER_ADESSO o ADESSO_CON_SEED). I worker restituiscono solo le colonne generate, come
+    buffer Arrow in memoria condivisa; costanti e colonne esistenti restano
+    nel processo principale.
+    """
+
+    def __init__(
+        self,
+        schemi: Dict[str, dict],
+        tabella_utenti: Optional[str] = None,
+        seed: Optional[int] = None,
+        processi: Optional[int] = None,
+        righe_shard: Optional[int] = None,
+        adesso: Optional[int] = None,
+        righe_max: Optional[int] = None
+    ):
+        if seed is None:
+            seed = settings.FAKER_SEED
+        if adesso is None:
+            adesso = settings.FAKER_ADESSO
+        if adesso is None and seed is not None:
+            adesso = ADESSO_CON_SEED
+        if seed is None:
+            seed = int(np.random.SeedSequence().generate_state(1)[0])
+            logger.info(f"Seed Faker non impostato, uso {seed}")
+        self.schemi = schemi
+        self.tabella_utenti = tabella_utenti
+        self.seed = seed
+        self.processi = processi or settings.FAKER_PROCESSI or os.cpu_count() or 1
+        self.righe_shard = max(1, righe_shard or settings.FAKER_SHARD_RIGHE)
+        self.adesso = int(time.time()) if adesso is None else adesso
+
+        # pool generati una volta sola: gli stessi valori in ogni processo
+        tipi = set()
+        for nome, schema in schemi.items():
+            tipi |= compila_schema(schema).tipi_pool()
+            if nome == tabella_utenti:
+                tipi |= {"nome", "cognome"}
+        righe_max = self.righe_shard if righe_max is None else min(righe_max, self.righe_shard)
+        self.pool = PoolFaker(faker, settings.FAKER_POOL_SIZE, seed=seed)
+        self.pool_iniziali = self.pool.prepara(tipi, righe_max)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._prossimo_shard: Dict[str, int] = {}
+
+    def _pool_processi(self) -> ProcessPoolExecutor:
+        # riempi può essere chiamato da più thread (uno stadio per tabella)
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processi,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_inizializza_worker,
+                    initargs=(self.seed, self.pool_iniziali)
+                )
+            return self._executor
+
+    def chiudi(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def colonne_generate(self, nome_tabella: str) -> list[str]:
+        """Colonne scritte da riempi per la tabella indicata."""
+        colonne = list(self.schemi[nome_tabella])
+        if nome_tabella == self.tabella_utenti:
+            colonne += [c for c in COLONNE_IDENTITA if c not in colonne]
+        return colonne
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.chiudi()
+
+    def riempi(
+        self,
+        tabelle: Dict[str, pd.DataFrame],
+        registro_username: Optional[RegistroUnivoci] = None
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        Riempie le colonne Faker delle tabelle indicate. Chiamate successive
+        sulla stessa tabella (un chunk dopo l'altro) continuano la numerazione
+        degli shard: con chunk multipli di righe_shard gli shard coincidono
+        con quelli della tabella generata per intero.
+
+        Args:
+            tabelle: {nome: DataFrame}, nomi tra quelli degli schemi
+            registro_username: username dei chunk precedenti, aggiornato con
+                quelli nuovi (solo per la tabella utenti)
+
+        Returns:
+            {nome: DataFrame riempito}
+        """
+        # shard di tutte le tabelle in un'unica coda, così i processi restano occupati
+        lavori = []
+        for nome, df in tabelle.items():
+            n_shard = math.ceil(len(df) / self.righe_shard)
+            with self._lock:
+                primo_shard = self._prossimo_shard.get(nome, 0)
+                self._prossimo_shard[nome] = primo_shard + n_shard
+            for i in range(n_shard):
+                n = min(self.righe_shard, len(df) - i * self.righe_shard)
+                lavori.append((
+                    nome, self.schemi[nome], primo_shard + i, n,
+                    self.seed, self.adesso, nome == self.tabella_utenti
+                ))
+
+        inizio = time.perf_counter()
+        processi = min(self.processi, len(lavori))
+        if processi <= 1:
+            parti = [genera_shard(*lavoro, pool=self.pool) for lavoro in lavori]
+        else:
+            futuri = []
+            try:
+                executor = self._pool_processi()
+                futuri = [executor.submit(_esegui_shard, *lavoro) for lavoro in lavori]
+                parti = [_importa(futuro.result()) for futuro in futuri]
+            except BaseException:
+                for futuro in futuri:
+                    futuro.cancel()
+                wait(futuri)
+                _libera_segmenti(futuri)
+                raise
+
+        per_tabella: Dict[str, list[Dict[str, np.ndarray]]] = {nome: [] for nome in tabelle}
+        for lavoro, colonne in zip(lavori, parti):
+            per_tabella[lavoro[0]].append(colonne)
+
+        risultato = {}
+        for nome, df in tabelle.items():
+            registro = registro_username if nome == self.tabella_utenti else None
+            risultato[nome] = _assembla(df, self.schemi[nome], per_tabella[nome], registro)
+
+        durata = time.perf_counter() - inizio
+        righe = sum(len(df) for df in tabelle.values())
+        logger.info(
+            f"Faker: {righe} righe in {len(lavori)} shard con {max(processi, 1)} processi, "
+            f"{durata:.2f}s (seed {self.seed})"
+        )
+        return risultato
+
+
+def riempi_tabelle_faker(
+    tabelle: Dict[str, tuple[pd.DataFrame, dict]],
+    tabella_utenti: Optional[str] = None,
+    seed: Optional[int] = None,
+    processi: Optional[int] = None,
+    righe_shard: Optional[int] = None,
+    adesso: Optional[int] = None
+) -> Dict[str, pd.DataFrame]:
+    """
+    Riempie le colonne Faker di più tabelle dividendo le righe in shard
+    eseguiti in un ProcessPoolExecutor (vedi StadioFaker).
+
+    Args:
+        tabelle: {nome: (DataFrame, schema Faker)}
+        tabella_utenti: nome della tabella da completare con identità coerenti
+        seed: seed globale (default: settings.FAKER_SEED, altrimenti casuale)
+        processi: numero di processi (default: settings.FAKER_PROCESSI o CPU)
+        righe_shard: righe per shard (default: settings.FAKER_SHARD_RIGHE)
+        adesso: riferimento dei timestamp (default: settings.FAKER_ADESSO, ADESSO_CON_SEED
+            con un seed fissato, altrimenti ora)
+
+    Returns:
+        {nome: DataFrame riempito}
+    """
+    schemi = {nome: schema for nome, (_df, schema) in tabelle.items()}
+    righe_max = max((len(df) for df, _ in tabelle.values()), default=0)
+    with StadioFaker(schemi, tabella_utenti, seed, processi, righe_shard, adesso, righe_max) as stadio:
+        return stadio.riempi({nome: df for nome, (df, _schema) in tabelle.items()})
+
+
+def _libera_segmenti(futuri):
+    """Dopo un errore: libera i segmenti degli shard completati e non ancora letti."""
+    for futuro in futuri:
+        if futuro.done() and not futuro.cancelled() and futuro.exception() is None:
+            try:
+                _importa(futuro.result())
+            except FileNotFoundError:
+                pass
+
+
+def _assembla(
+    df: pd.DataFrame,
+    schema: dict,
+    parti: list[Dict[str, np.ndarray]],
+    registro_username: Optional[RegistroUnivoci] = None
+) -> pd.DataFrame:
+    """Concatena gli shard nell'ordine delle righe e costruisce la tabella."""
+    piano = compila_schema(schema)
+    colonne = {}
+    if parti:
+        colonne = {col: np.concatenate([parte[col] for parte in parti]) for col in parti[0]}
+
+    identita = {
+        col[len(PREFISSO_IDENTITA):]: colonne.pop(col)
+        for col in list(colonne) if col.startswith(PREFISSO_IDENTITA)
+    }
+
+    df = piano.applica(df, generati=colonne)
+    if identita and len(df):
+        blocco = completa_identita(identita, registro_username)
+        blocco.index = df.index
+        df = sostituisci_colonne(df, [blocco])
+    return df
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Coroutine, Optional, Sequence, TypeVar
+
+from google.api_core import exceptions as api_exceptions
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def is_rate_limit(errore: BaseException) -> bool:
+    """True se l'errore indica un superamento di quota (HTTP 429)."""
+    return isinstance(errore, (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests))
+
+
+
+# LIMITATORE AIMD
+
+class LimitatoreAIMD:
+    """
+    Limita il numero di chiamate Gemini in volo e lo adatta con
+    additive-increase / multiplicative-decrease:
+    - ogni chiamata riuscita aumenta il limite di 1/limite (circa +1 per "finestra")
+    - un 429 / ResourceExhausted lo moltiplica per fattore_decremento
+
+    Un solo decremento per finestra: i 429 di chiamate partite prima
+    dell'ultimo decremento non lo riducono ulteriormente.
+
+    Utilizzabile da più thread e più event loop insieme (stadi in parallelo,
+    job concorrenti): il conteggio è protetto da un lock di threading e chi
+    attende uno slot viene svegliato sul proprio loop. Di norma si usa
+    l'istanza di processo restituita da get_limitatore, così la quota Vertex
+    è condivisa da tutte le chiamate.
+    """
+
+    def __init__(
+        self,
+        iniziale: Optional[int] = None,
+        minimo: int = 1,
+        massimo: Optional[int] = None,
+        fattore_decremento: float = 0.5
+    ):
+        self.minimo = minimo
+        self.massimo = massimo or settings.GEMINI_CONCORRENZA_MAX
+        self.limite = float(min(iniziale or settings.GEMINI_CONCORRENZA_INIZIALE, self.massimo))
+        self.fattore_decremento = fattore_decremento
+        self.in_volo = 0
+        self.successi = 0
+        self.rate_limit = 0
+        self._ultimo_decremento = 0.0
+        self._lock = threading.Lock()
+        # (loop, future) di chi attende uno slot, in ordine di arrivo
+        self._in_attesa: "deque[tuple[asyncio.AbstractEventLoop, asyncio.Future]]" = deque()
+
+    def registra_successo(self):
+        with self._lock:
+            self.successi += 1
+            self.limite = min(self.massimo, self.limite + 1 / self.limite)
+            self._sveglia()
+
+    def registra_rate_limit(self, avviata: float):
+        with self._lock:
+            self.rate_limit += 1
+            if avviata < self._ultimo_decremento:
+                return
+            self.limite = max(self.minimo, self.limite * self.fattore_decremento)
+            self._ultimo_decremento = time.monotonic()
+        logger.warning(f"Rate limit Gemini: concorrenza ridotta a {int(self.limite)}")
+
+    def _sveglia(self):
+        """Sveglia tanti in attesa quanti sono gli slot liberi (da chiamare con il lock)."""
+        liberi = int(self.limite) - self.in_volo
+        while liberi > 0 and self._in_attesa:
+            loop, attesa = self._in_attesa.popleft()
+            try:
+                loop.call_soon_threadsafe(_completa, attesa)
+            except RuntimeError:
+                # loop già chiuso: chi attendeva non c'è più
+                continue
+            liberi -= 1
+
+    async def _acquisisci(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self.in_volo < int(self.limite):
+                    self.in_volo += 1
+                    return
+                attesa = loop.create_future()
+                self._in_attesa.append((loop, attesa))
+            try:
+                await attesa
+            except asyncio.CancelledError:
+                with self._lock:
+                    try:
+                        self._in_attesa.remove((loop, attesa))
+                    except ValueError:
+                        # era già stato svegliato: lo slot passa al prossimo
+                        self._sveglia()
+                raise
+
+    def _rilascia(self):
+        with self._lock:
+            self.in_volo -= 1
+            self._sveglia()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Attende un posto libero e lo occupa per la durata del blocco.
+        Restituisce l'istante di avvio, da passare a registra_rate_limit.
+        """
+        await self._acquisisci()
+        try:
+            yield time.monotonic()
+        finally:
+            self._rilascia()
+
+
+def _completa(attesa: asyncio.Future):
+    if not attesa.done():
+        attesa.set_result(None)
+
+
+_limitatore: Optional[LimitatoreAIMD] = None
+_limitatore_lock = threading.Lock()
+
+
+def get_limitatore() -> LimitatoreAIMD:
+    """Limitatore AIMD condiviso da tutte le chiamate Gemini del processo, creato al primo uso."""
+    global _limitatore
+    with _limitatore_lock:
+        if _limitatore is None:
+            _limitatore = LimitatoreAIMD()
+        return _limitatore
+
+
+# CHIAMATE CON RETRY
+
+async def chiama_con_aimd(
+    chiamata: Callable[[], Awaitable[T]],
+    limitatore: LimitatoreAIMD,
+    max_retries: int = 3,
+    delay: float = 5,
+    max_rate_limit: int = 10
+) -> T:
+    """
+    Esegue una chiamata asincrona dentro uno slot del limitatore.
+
+    I 429 riducono la concorrenza e vengono ritentati con backoff esponenziale
+    (fino a max_rate_limit volte); gli altri errori vengono ritentati fino a
+    max_retries volte con attesa fissa.
+    """
+    errori = 0
+    rate_limit = 0
+    while True:
+        async with limitatore.slot() as avviata:
+            try:
+                risultato = await chiamata()
+                limitatore.registra_successo()
+                return risultato
+            except Exception as e:
+                ultimo_errore = e
+                if is_rate_limit(e):
+                    limitatore.registra_rate_limit(avviata)
+                    rate_limit += 1
+                else:
+                    errori += 1
+                    logger.warning(f"Errore Gemini (tentativo {errori}): {e}")
+
+        if errori >= max_retries or rate_limit >= max_rate_limit:
+            raise ultimo_errore
+
+        if is_rate_limit(ultimo_errore):
+            attesa = min(60, delay * 2 ** (rate_limit - 1)) * random.uniform(0.5, 1.5)
+        else:
+            attesa = delay
+        await asyncio.sleep(attesa)
+
+
+
+# ESECUZIONE CONCORRENTE IN ORDINE
+
+async def esegui_batch_concorrenti(
+    elementi: Sequence[T],
+    funzione: Callable[[T], Awaitable[R]]
+) -> list[R]:
+    """
+    Lancia funzione(elemento) per tutti gli elementi e restituisce i risultati
+    nell'ordine originale. La concorrenza effettiva è decisa dal limitatore
+    usato dentro funzione. Alla prima eccezione i task rimanenti vengono
+    cancellati e l'eccezione viene propagata.
+    """
+    tasks = [asyncio.ensure_future(funzione(e)) for e in elementi]
+    if not tasks:
+        return []
+
+    completati, pendenti = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+    if pendenti:
+        for task in pendenti:
+            task.cancel()
+        await asyncio.gather(*pendenti, return_exceptions=True)
+    for task in completati:
+        if task.exception() is not None:
+            raise task.exception()
+    return [task.result() for task in tasks]
+
+
+def esegui_async(coroutine: Coroutine[None, None, T]) -> T:
+    """
+    Esegue una coroutine da codice sincrono. Se il thread corrente ha già un
+    event loop attivo, la coroutine gira su un thread dedicato.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    risultato: dict = {}
+
+    def _runner():
+        try:
+            risultato["valore"] = asyncio.run(coroutine)
+        except BaseException as e:
+            risultato["errore"] = e
+
+    thread = threading.Thread(target=_runner, name="gemini-async")
+    thread.start()
+    thread.join()
+    if "errore" in risultato:
+        raise risultato["errore"]
+    return risultato["valore"]
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from app.core.config import settings
+from app.services.generators.gemini_async import LimitatoreAIMD
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+# stima grossolana per testo italiano/inglese: circa 4 caratteri per token
+CARATTERI_PER_TOKEN = 4
+
+
+def stima_token(testo: str) -> int:
+    return len(testo) // CARATTERI_PER_TOKEN + 1
+
+
+
+# DIMENSIONE DEI BATCH PER BUDGET DI TOKEN
+
+class DimensionatoreBatch:
+    """
+    Decide quante richieste mettere in una chiamata in base ai token stimati
+    invece di un numero fisso di righe: un batch si chiude quando i prompt
+    superano il budget di ingresso o le risposte attese quello di uscita
+    (settings.GEMINI_BUDGET_TOKEN_INGRESSO / _USCITA).
+
+    Le stime si adattano durante la generazione:
+    - i token di uscita per riga seguono la media mobile delle risposte ricevute
+    - risposte troncate, incomplete o più lente di settings.GEMINI_LATENZA_OBIETTIVO
+      riducono la quota del budget usata (x0.7); le risposte complete la
+      riportano gradualmente verso il budget pieno (+0.1)
+
+    I batch vanno chiusi uno alla volta con prossimo_batch, subito prima di
+    inviarli, così ogni batch usa le stime aggiornate dalle risposte precedenti.
+    Thread-safe: lo stesso dimensionatore serve tutte le chiamate di un tipo
+    di prompt (vedi dimensionatore_condiviso).
+    """
+
+    def __init__(
+        self,
+        token_uscita_riga: float = 50,
+        righe_max: Optional[int] = None,
+        preambolo: str = ""
+    ):
+        self.budget_ingresso = settings.GEMINI_BUDGET_TOKEN_INGRESSO
+        self.budget_uscita = settings.GEMINI_BUDGET_TOKEN_USCITA
+        self.righe_max = righe_max or settings.GEMINI_BATCH_RIGHE_MAX
+        self.token_preambolo = stima_token(preambolo)
+        self.token_uscita_riga = float(token_uscita_riga)
+        self.token_ingresso_riga = 50.0
+        self.quota = 1.0
+        self.chiamate = 0
+        self.ridotte = 0
+        self._lock = threading.Lock()
+
+    def _limiti(self) -> tuple[float, float]:
+        return (
+            self.quota * max(1, self.budget_ingresso - self.token_preambolo),
+            self.quota * self.budget_uscita
+        )
+
+    def dimensione(self, token_ingresso_riga: Optional[float] = None) -> int:
+        """Righe per batch con le stime correnti (token_ingresso_riga=0 per le varianti di un solo prompt)."""
+        if token_ingresso_riga is None:
+            token_ingresso_riga = self.token_ingresso_riga
+        limite_ingresso, limite_uscita = self._limiti()
+        righe = min(limite_ingresso / max(1.0, token_ingresso_riga), limite_uscita / max(1.0, self.token_uscita_riga))
+        return max(1, min(self.righe_max, int(righe)))
+
+    def stima_prompt(self, prompts: list[str]) -> list[int]:
+        """Token stimati di ciascun prompt; aggiorna la media di ingresso usata da dimensione()."""
+        token = [stima_token(p) for p in prompts]
+        if token:
+            with self._lock:
+                self.token_ingresso_riga = 0.7 * self.token_ingresso_riga + 0.3 * (sum(token) / len(token))
+        return token
+
+    def prossimo_batch(self, token: list[int], inizio: int) -> int:
+        """
+        Fine (esclusa) del batch che parte da inizio, riempito con le stime
+        correnti fino al budget di ingresso, al budget di uscita o a righe_max.
+        """
+        limite_ingresso, limite_uscita = self._limiti()
+        righe_uscita = max(1, int(limite_uscita / max(1.0, self.token_uscita_riga)))
+        righe_max = min(self.righe_max, righe_uscita)
+
+        fine, somma = inizio, 0
+        while fine < len(token) and fine - inizio < righe_max:
+            if fine > inizio and somma + token[fine] > limite_ingresso:
+                break
+            somma += token[fine]
+            fine += 1
+        return fine
+
+    def registra(self, richieste: int, ricevute: int, caratteri: int, durata: float, troncata: bool = False):
+        """Esito di una chiamata: aggiorna la stima di uscita e la quota del budget."""
+        with self._lock:
+            self.chiamate += 1
+            if ricevute:
+                osservati = caratteri / CARATTERI_PER_TOKEN / ricevute
+                self.token_uscita_riga = 0.7 * self.token_uscita_riga + 0.3 * osservati
+            lenta = durata > settings.GEMINI_LATENZA_OBIETTIVO
+            incompleta = ricevute < 0.9 * richieste
+            if troncata or lenta or incompleta:
+                self.quota = max(0.05, self.quota * 0.7)
+                self.ridotte += 1
+            else:
+                self.quota = min(1.0, self.quota + 0.1)
+                return
+        motivo = "troncata" if troncata else "lenta" if lenta else f"incompleta ({ricevute}/{richieste})"
+        logger.warning(f"Risposta Gemini {motivo}: batch ridotti al {self.quota:.0%} del budget ({self.dimensione()} righe)")
+
+    def registra_timeout(self):
+        with self._lock:
+            self.chiamate += 1
+            self.ridotte += 1
+            self.quota = max(0.05, self.quota * 0.7)
+        logger.warning(f"Timeout Gemini: batch ridotti al {self.quota:.0%} del budget")
+
+
+
+# DIMENSIONATORI CONDIVISI
+
+_dimensionatori: dict[tuple[str, Optional[int]], DimensionatoreBatch] = {}
+_dimensionatori_lock = threading.Lock()
+
+
+def dimensionatore_condiviso(
+    tipo: str,
+    token_uscita_riga: float = 50,
+    righe_max: Optional[int] = None,
+    preambolo: str = ""
+) -> DimensionatoreBatch:
+    """
+    Dimensionatore unico per un tipo di prompt (es. il template di una colonna),
+    creato alla prima richiesta: le stime imparate da una chiamata valgono
+    anche per le successive. token_uscita_riga e preambolo contano solo alla creazione.
+    """
+    chiave = (tipo, righe_max)
+    with _dimensionatori_lock:
+        dimensionatore = _dimensionatori.get(chiave)
+        if dimensionatore is None:
+            dimensionatore = _dimensionatori[chiave] = DimensionatoreBatch(token_uscita_riga, righe_max, preambolo)
+        return dimensionatore
+
+
+
+# ESECUZIONE DEI BATCH
+
+async def esegui_batch_adattivi(
+    prompts: list[str],
+    dimensionatore: DimensionatoreBatch,
+    limitatore: LimitatoreAIMD,
+    funzione: Callable[[tuple[int, int]], Awaitable[list[R]]]
+) -> list[R]:
+    """
+    Divide i prompt in batch consecutivi e lancia funzione((inizio, fine)) per
+    ciascuno, un risultato per prompt. Ogni batch viene chiuso solo quando c'è
+    posto nel limite di concorrenza, con le stime aggiornate dalle risposte già
+    arrivate. Restituisce i risultati nell'ordine dei prompt; alla prima
+    eccezione i batch in corso vengono cancellati e l'eccezione propagata.
+    """
+    token = dimensionatore.stima_prompt(prompts)
+    tasks: list[asyncio.Task] = []
+    in_volo: set[asyncio.Task] = set()
+    inizio = 0
+
+    try:
+        while inizio < len(prompts) or in_volo:
+            if inizio < len(prompts) and len(in_volo) < max(1, int(limitatore.limite)):
+                fine = dimensionatore.prossimo_batch(token, inizio)
+                task = asyncio.ensure_future(funzione((inizio, fine)))
+                tasks.append(task)
+                in_volo.add(task)
+                inizio = fine
+                continue
+            completati, in_volo = await asyncio.wait(in_volo, return_when=asyncio.FIRST_COMPLETED)
+            for task in completati:
+                task.result()
+    finally:
+        for task in in_volo:
+            task.cancel()
+        if in_volo:
+            await asyncio.gather(*in_volo, return_exceptions=True)
+
+    return [r for task in tasks for r in task.result()]
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from app.core.config import settings
+from app.services.generators.gemini_client import get_backend
+
+logger = logging.getLogger(__name__)
+
+
+
+# CACHE PERSISTENTE DELLE RISPOSTE GEMINI
+
+class CacheGemini:
+    """
+    Cache su disco (SQLite) delle risposte Gemini, indirizzata per contenuto.
+
+    La chiave è l'hash di (modello, generation_config, preambolo, prompt, variante).
+    La variante è l'indice di occorrenza del prompt nella richiesta: se lo stesso
+    prompt compare k volte si usano k voci distinte, così la cache non appiattisce
+    la varietà delle risposte (es. k nomi di corso diversi per la stessa categoria).
+
+    Quando la dimensione dei valori supera max_bytes vengono eliminate le voci
+    lette meno di recente.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS risposte ("
+            "chiave TEXT PRIMARY KEY, valore TEXT NOT NULL, "
+            "dimensione INTEGER NOT NULL, ultimo_accesso REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accesso ON risposte (ultimo_accesso)")
+        self._conn.commit()
+
+    @staticmethod
+    def chiave(model_name: str, generation_config: dict, preambolo: str, prompt: str, variante: int = 0) -> str:
+        contenuto = json.dumps(
+            [model_name, generation_config, preambolo, prompt, variante],
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(contenuto.encode("utf-8")).hexdigest()
+
+    def get_many(self, chiavi: list[str]) -> dict[str, Any]:
+        """Valori presenti in cache per le chiavi richieste; aggiorna hit/miss."""
+        trovati: dict[str, Any] = {}
+        uniche = list(dict.fromkeys(chiavi))
+        with self._lock:
+            for start in range(0, len(uniche), 500):
+                blocco = uniche[start:start + 500]
+                segnaposto = ",".join("?" * len(blocco))
+                righe = self._conn.execute(
+                    f"SELECT chiave, valore FROM risposte WHERE chiave IN ({segnaposto})", blocco
+                ).fetchall()
+                trovati.update({k: json.loads(v) for k, v in righe})
+
+            if trovati:
+                adesso = time.time()
+                self._conn.executemany(
+                    "UPDATE risposte SET ultimo_accesso = ? WHERE chiave = ?",
+                    [(adesso, k) for k in trovati]
+                )
+                self._conn.commit()
+
+            self.hits += sum(1 for k in chiavi if k in trovati)
+            self.misses += sum(1 for k in chiavi if k not in trovati)
+        return trovati
+
+    def set_many(self, valori: dict[str, Any]):
+        if not valori:
+            return
+        adesso = time.time()
+        righe = []
+        for chiave, valore in valori.items():
+            testo = json.dumps(valore, ensure_ascii=False)
+            righe.append((chiave, testo, len(testo.encode("utf-8")), adesso))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO risposte (chiave, valore, dimensione, ultimo_accesso) VALUES (?, ?, ?, ?)",
+                righe
+            )
+            self._conn.commit()
+            self._applica_limite()
+
+    def _applica_limite(self):
+        (totale,) = self._conn.execute("SELECT COALESCE(SUM(dimensione), 0) FROM risposte").fetchone()
+        if totale <= self.max_bytes:
+            return
+
+        da_liberare = totale - self.max_bytes
+        liberati = 0
+        chiavi = []
+        for chiave, dimensione in self._conn.execute(
+            "SELECT chiave, dimensione FROM risposte ORDER BY ultimo_accesso ASC"
+        ):
+            chiavi.append((chiave,))
+            liberati += dimensione
+            if liberati >= da_liberare:
+                break
+        self._conn.executemany("DELETE FROM risposte WHERE chiave = ?", chiavi)
+        self._conn.commit()
+        logger.info(f"Cache Gemini: eliminate {len(chiavi)} voci ({liberati} byte)")
+
+    def svuota(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM risposte")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def statistiche(self) -> dict:
+        with self._lock:
+            voci, totale = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(dimensione), 0) FROM risposte"
+            ).fetchone()
+        richieste = self.hits + self.misses
+        return {
+            "voci": voci,
+            "bytes": totale,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / richieste if richieste else 0.0
+        }
+
+
+_cache: Optional[CacheGemini] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache_gemini() -> Optional[CacheGemini]:
+    """Cache condivisa, creata al primo uso. None se disabilitata da configurazione."""
+    global _cache
+    if not settings.GEMINI_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheGemini(settings.GEMINI_CACHE_PATH, settings.GEMINI_CACHE_MAX_BYTES)
+        return _cache
+
+
+
+# CONSULTAZIONE PER SINGOLO ELEMENTO
+
+async def con_cache(
+    prompts: list[str],
+    model_name: str,
+    generation_config: dict,
+    preambolo: str,
+    calcola_mancanti: Callable[[list[str]], Awaitable[list]],
+    valido: Callable[[Any], bool],
+    usa_cache: bool = True,
+    occorrenze: Optional[dict[str, int]] = None,
+    al_valore: Optional[Callable[[int, Any], None]] = None
+) -> list:
+    """
+    Risolve ogni prompt dalla cache e invia a calcola_mancanti solo quelli
+    mancanti. Le risposte valide vengono salvate in cache.
+
+    Args:
+        prompts: prompt da risolvere
+        model_name, generation_config, preambolo: parte della chiave di cache
+        calcola_mancanti: coroutine che riceve i prompt mancanti e restituisce
+            una risposta per ciascuno, nello stesso ordine
+        valido: predicato sulle risposte da salvare (i valori di fallback no)
+        usa_cache: False per ignorare la cache e chiedere sempre risposte nuove
+        occorrenze: contatore {prompt: varianti già usate}, aggiornato; da
+            condividere tra le chiamate che riempiono a pezzi la stessa colonna,
+            così un prompt ripetuto in pezzi diversi non riceve la stessa variante
+        al_valore: chiamata con (indice, risposta) appena una risposta è
+            disponibile, subito per quelle in cache; se indicata, calcola_mancanti
+            riceve anche la callback per i prompt mancanti (indici relativi a loro)
+
+    Returns:
+        Una risposta per prompt, nell'ordine originale
+    """
+    def calcola(indici: list[int]) -> Awaitable[list]:
+        sottoinsieme = [prompts[i] for i in indici]
+        if al_valore is None:
+            return calcola_mancanti(sottoinsieme)
+        return calcola_mancanti(sottoinsieme, lambda j, risposta: al_valore(indici[j], risposta))
+
+    cache = get_cache_gemini() if usa_cache else None
+    if cache is None or not prompts:
+        return await calcola(list(range(len(prompts))))
+
+    occorrenze = {} if occorrenze is None else occorrenze
+    # il backend locale non deve leggere né sporcare le risposte di Vertex
+    modello = get_backend().chiave_modello(model_name)
+    chiavi = []
+    for prompt in prompts:
+        variante = occorrenze.get(prompt, 0)
+        occorrenze[prompt] = variante + 1
+        chiavi.append(CacheGemini.chiave(modello, generation_config, preambolo, prompt, variante))
+
+    trovati = cache.get_many(chiavi)
+    mancanti = [i for i, k in enumerate(chiavi) if k not in trovati]
+    logger.info(f"Cache Gemini: {len(prompts) - len(mancanti)} hit, {len(mancanti)} miss")
+
+    risposte = [trovati.get(k) for k in chiavi]
+    if al_valore is not None:
+        for i, k in enumerate(chiavi):
+            if k in trovati:
+                al_valore(i, trovati[k])
+    if mancanti:
+        nuove = await calcola(mancanti)
+        for i, risposta in zip(mancanti, nuove):
+            risposte[i] = risposta
+        cache.set_many({chiavi[i]: r for i, r in zip(mancanti, nuove) if valido(r)})
+
+    return risposte
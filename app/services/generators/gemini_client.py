@@ -1,13 +1,266 @@
-import vertexai
-from google.auth import exceptions as google_auth_exceptions
-from google.oauth2 import service_account
+import asyncio
+import hashlib
+import json
 import logging
+import random
+import re
+import threading
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Optional, Protocol
+
+from google.api_core import exceptions as api_exceptions
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def init_vertex_ai(project_id: str, location: str, service_account_path: Optional[str] = None):
+    """Inizializza Vertex AI; senza service_account_path usa le credenziali di default dell'ambiente."""
+    import vertexai
+    from google.auth import exceptions as google_auth_exceptions
+    from google.oauth2 import service_account
 
-def init_vertex_ai(project_id: str, location: str, service_account_path: str):
     try:
-        credentials = service_account.Credentials.from_service_account_file(service_account_path)
+        credentials = None
+        if service_account_path:
+            credentials = service_account.Credentials.from_service_account_file(service_account_path)
         vertexai.init(project=project_id, location=location, credentials=credentials)
         logging.info("Vertex AI inizializzato correttamente")
     except google_auth_exceptions.GoogleAuthError as e:
         logging.error(f"Errore di autenticazione: {e}")
-        raise
\ No newline at end of file
+        raise
+
+
+
+# PROTOCOLLO DEI BACKEND
+
+class ModelloLLM(Protocol):
+    """
+    Modello con l'interfaccia usata dai generatori (quella di GenerativeModel):
+    generate_content_async(prompt) restituisce una risposta con .text;
+    con stream=True un iterabile asincrono di parti con .text. Risposte e
+    parti possono esporre candidates[0].finish_reason.name ("MAX_TOKENS" se troncate).
+    """
+
+    async def generate_content_async(self, contents: str, stream: bool = False) -> Any: ...
+
+
+class BackendLLM(Protocol):
+    nome: str
+
+    def inizializza(self) -> None:
+        """Prepara il backend (credenziali, progetto); solleva un'eccezione se non è utilizzabile."""
+
+    def modello(self, model_name: str, generation_config: dict) -> ModelloLLM: ...
+
+    def chiave_modello(self, model_name: str) -> str:
+        """Nome del modello nelle chiavi della cache: backend diversi non condividono risposte."""
+
+
+
+# VERTEX AI
+
+class BackendVertex:
+    """Gemini su Vertex AI, con progetto, regione e credenziali da settings."""
+
+    nome = "vertex"
+
+    def inizializza(self) -> None:
+        init_vertex_ai(settings.GEMINI_PROGETTO, settings.GEMINI_LOCATION, settings.GEMINI_CREDENZIALI)
+
+    def modello(self, model_name: str, generation_config: dict) -> ModelloLLM:
+        from vertexai.generative_models import GenerativeModel
+        return GenerativeModel(model_name, generation_config=generation_config)
+
+    def chiave_modello(self, model_name: str) -> str:
+        return model_name
+
+
+
+# BACKEND LOCALE (STUB DETERMINISTICO)
+
+# inizio delle richieste nei preamboli di gemini_generator e tag_gemini
+_INIZIO_RICHIESTE = re.compile(r"(?:Ecco le richieste|Ora genera i tag per queste risorse|Richiesta):[ \t]*\n")
+_RICHIESTA = re.compile(r"(\d+)\.\s?(.*)")
+_VARIANTI = re.compile(r"numerat[ie] da 1 a (\d+)")
+_CAMPI_JSON = re.compile(r'"(\w+)": <valore>')
+_TAG_DISPONIBILI = re.compile(r"Tag disponibili[^:]*:\s*(.+?)\.\s")
+
+
+class BackendLocale:
+    """
+    Backend senza rete per esecuzioni offline e benchmark. Rispetta i formati
+    di risposta dei preamboli: righe numerate (anche per k varianti), array
+    JSON di oggetti con "n" e i campi richiesti, liste di tag.
+
+    Le risposte dipendono solo da seme e prompt, quindi sono riproducibili.
+    Gli errori iniettati seguono una sequenza a parte, così i retry dello
+    stesso prompt possono riuscire.
+
+    Args:
+        latenza: secondi prima del primo token
+        latenza_token: secondi per token di uscita (stimato a 4 caratteri)
+        errori: probabilità di un errore 503 per chiamata
+        rate_limit: probabilità di un 429 per chiamata
+        troncamenti: probabilità di una risposta troncata (finish_reason MAX_TOKENS)
+        seme: seme delle risposte e degli errori
+    """
+
+    nome = "locale"
+
+    def __init__(
+        self,
+        latenza: Optional[float] = None,
+        latenza_token: Optional[float] = None,
+        errori: Optional[float] = None,
+        rate_limit: Optional[float] = None,
+        troncamenti: Optional[float] = None,
+        seme: Optional[int] = None
+    ):
+        self.latenza = settings.GEMINI_LOCALE_LATENZA if latenza is None else latenza
+        self.latenza_token = settings.GEMINI_LOCALE_LATENZA_TOKEN if latenza_token is None else latenza_token
+        self.errori = settings.GEMINI_LOCALE_ERRORI if errori is None else errori
+        self.rate_limit = settings.GEMINI_LOCALE_RATE_LIMIT if rate_limit is None else rate_limit
+        self.troncamenti = settings.GEMINI_LOCALE_TRONCAMENTI if troncamenti is None else troncamenti
+        self.seme = settings.GEMINI_LOCALE_SEED if seme is None else seme
+        self.chiamate = 0
+        self.errori_iniettati = 0
+        self._casuale = random.Random(self.seme)
+        self._lock = threading.Lock()
+
+    def inizializza(self) -> None:
+        logger.info(f"Backend LLM locale: latenza {self.latenza}s + {self.latenza_token}s/token, "
+                    f"errori {self.errori:.0%}, rate limit {self.rate_limit:.0%}, troncamenti {self.troncamenti:.0%}")
+
+    def modello(self, model_name: str, generation_config: dict) -> ModelloLLM:
+        return _ModelloLocale(self)
+
+    def chiave_modello(self, model_name: str) -> str:
+        return f"locale:{model_name}"
+
+    def _esito(self) -> tuple[Optional[Exception], Optional[float]]:
+        """Errore da iniettare nella prossima chiamata e frazione di testo da tenere se troncata."""
+        with self._lock:
+            self.chiamate += 1
+            errore, troncamento, taglio = (self._casuale.random() for _ in range(3))
+            if errore < self.rate_limit + self.errori:
+                self.errori_iniettati += 1
+                if errore < self.rate_limit:
+                    return api_exceptions.ResourceExhausted("Quota simulata dal backend locale"), None
+                return api_exceptions.ServiceUnavailable("Errore simulato dal backend locale"), None
+        return None, (0.3 + 0.6 * taglio if troncamento < self.troncamenti else None)
+
+    def risposta(self, prompt: str) -> str:
+        """Testo completo della risposta al prompt, senza latenza né errori."""
+        rng = random.Random(hashlib.sha256(f"{self.seme}:{prompt}".encode("utf-8")).digest())
+        inizi = list(_INIZIO_RICHIESTE.finditer(prompt))
+        corpo = prompt[inizi[-1].end():] if inizi else prompt
+
+        varianti = _VARIANTI.search(prompt)
+        if varianti:
+            richieste = [corpo.strip()] * int(varianti.group(1))
+        else:
+            richieste = _richieste_numerate(corpo)
+
+        campi = [c for c in dict.fromkeys(_CAMPI_JSON.findall(prompt)) if c != "n"]
+        if campi:
+            oggetti = [
+                {"n": i, **{campo: _valore(richiesta, rng, campo) for campo in campi}}
+                for i, richiesta in enumerate(richieste, start=1)
+            ]
+            return json.dumps(oggetti, ensure_ascii=False)
+        if "lista di liste" in prompt:
+            return json.dumps([_tag(rng) for _ in richieste], ensure_ascii=False)
+        return "\n".join(f"{i}. {_valore(richiesta, rng)}" for i, richiesta in enumerate(richieste, start=1))
+
+
+class _ModelloLocale:
+
+    def __init__(self, backend: BackendLocale):
+        self.backend = backend
+
+    async def generate_content_async(self, contents: str, stream: bool = False) -> Any:
+        backend = self.backend
+        errore, taglio = backend._esito()
+        await asyncio.sleep(backend.latenza)
+        if errore is not None:
+            raise errore
+
+        testo = backend.risposta(contents)
+        fine = "STOP"
+        if taglio is not None:
+            testo = testo[:int(len(testo) * taglio)]
+            fine = "MAX_TOKENS"
+
+        if stream:
+            return self._parti(testo, fine)
+        await asyncio.sleep(backend.latenza_token * len(testo) / 4)
+        return _parte(testo, fine)
+
+    async def _parti(self, testo: str, fine: str) -> AsyncIterator[Any]:
+        passo = 64
+        for inizio in range(0, len(testo), passo):
+            pezzo = testo[inizio:inizio + passo]
+            await asyncio.sleep(self.backend.latenza_token * len(pezzo) / 4)
+            ultima = inizio + passo >= len(testo)
+            yield _parte(pezzo, fine if ultima else None)
+
+
+def _parte(testo: str, fine: Optional[str]) -> SimpleNamespace:
+    motivo = SimpleNamespace(name=fine) if fine else None
+    return SimpleNamespace(text=testo, candidates=[SimpleNamespace(finish_reason=motivo)])
+
+
+def _richieste_numerate(corpo: str) -> list[str]:
+    """Blocchi "N. testo" numerati in sequenza da 1; il testo può andare a capo."""
+    richieste: list[str] = []
+    for riga in corpo.splitlines():
+        trovata = _RICHIESTA.match(riga)
+        if trovata and int(trovata.group(1)) == len(richieste) + 1:
+            richieste.append(trovata.group(2))
+        elif richieste:
+            richieste[-1] += "\n" + riga
+    return richieste
+
+
+def _valore(richiesta: str, rng: random.Random, campo: Optional[str] = None) -> Any:
+    numerico = campo.endswith("level") if campo else "solo con il numero" in richiesta
+    if numerico:
+        return rng.randint(1, 5) if campo else str(rng.randint(1, 5))
+    disponibili = _TAG_DISPONIBILI.search(richiesta)
+    if disponibili:
+        tag = [t.strip() for t in disponibili.group(1).split(",") if t.strip()]
+        return ", ".join(rng.sample(tag, min(len(tag), rng.randint(1, 3))))
+    return f"{(campo or 'valore').capitalize()} {rng.getrandbits(32):08x}"
+
+
+def _tag(rng: random.Random) -> list[str]:
+    return [f"tag {rng.getrandbits(16):04x}" for _ in range(rng.randint(1, 3))]
+
+
+
+# BACKEND IN USO
+
+_backend: Optional[BackendLLM] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> BackendLLM:
+    """Backend condiviso scelto da settings.GEMINI_BACKEND, creato al primo uso."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = BackendLocale() if settings.GEMINI_BACKEND == "locale" else BackendVertex()
+        return _backend
+
+
+def imposta_backend(backend: Optional[BackendLLM]):
+    """Sostituisce il backend condiviso (es. un BackendLocale per un benchmark); None torna a settings."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def crea_modello(model_name: str, generation_config: dict) -> ModelloLLM:
+    return get_backend().modello(model_name, generation_config)
@@ -0,0 +1,451 @@
+import asyncio
+import logging
+import string
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.services.generators.gemini_async import LimitatoreAIMD, esegui_async, esegui_batch_concorrenti, get_limitatore
+from app.services.generators.gemini_batch import dimensionatore_condiviso
+from app.services.generators.gemini_cache import con_cache
+from app.services.generators.gemini_generator import (
+    GENERATION_CONFIG_BATCH,
+    GENERATION_CONFIG_JSON,
+    MODEL_NAME,
+    PREAMBOLO_BATCH,
+    ContatoreFallimenti,
+    accetta_oggetto,
+    accetta_valore,
+    costruisci_preambolo_json,
+    genera_oggetti_async,
+    genera_valori_async
+)
+from app.services.utils.indici import indice
+
+logger = logging.getLogger(__name__)
+
+
+
+# PASSI DELLA GENERAZIONE A FLUSSO
+
+class PassoGemini:
+    """
+    Una colonna (o più colonne con risposta JSON) di una tabella, generata
+    riga per riga appena i valori usati dal prompt sono pronti.
+
+    I placeholder del prompt vengono letti, in ordine di priorità, da:
+    - riferimenti: {nome: (tabella, colonna, chiave)}, la colonna della riga
+      di tabella il cui id è nella colonna chiave (come colonna_da)
+    - colonne prodotte da passi precedenti sulla stessa tabella
+    - colonne_temp (calcolate una volta all'inizio) e colonne della tabella
+
+    Le dipendenze tra passi si ricavano da qui: un placeholder che legge una
+    colonna prodotta da un passo precedente (direttamente o tramite
+    riferimento) rende la riga pronta solo quando quel valore è arrivato.
+
+    I batch sono dimensionati per token (DimensionatoreBatch): batch_size è
+    solo il massimo di righe, token_uscita la stima iniziale per riga.
+    """
+
+    def __init__(
+        self,
+        tabella: str,
+        colonne: Dict[str, Optional[Callable[[list[str]], list]]],
+        prompt_template: str,
+        batch_size: Optional[int] = None,
+        colonne_temp: Optional[Dict[str, Callable[[pd.DataFrame], any]]] = None,
+        riferimenti: Optional[Dict[str, tuple[str, str, str]]] = None,
+        default_value: str = "N/A",
+        raggruppa_prompt: bool = True,
+        token_uscita: float = 50
+    ):
+        self.tabella = tabella
+        self.colonne = dict(colonne)
+        self.prompt_template = prompt_template
+        self.batch_size = batch_size
+        self.token_uscita = token_uscita
+        self.colonne_temp = colonne_temp or {}
+        self.riferimenti = riferimenti or {}
+        self.default_value = default_value
+        self.raggruppa_prompt = raggruppa_prompt
+
+    @property
+    def json(self) -> bool:
+        """Più colonne: una risposta JSON per riga (modalità fusa)."""
+        return len(self.colonne) > 1
+
+    @property
+    def preambolo(self) -> str:
+        return costruisci_preambolo_json(list(self.colonne)) if self.json else PREAMBOLO_BATCH
+
+    @property
+    def nome(self) -> str:
+        return f"{self.tabella}.{'+'.join(self.colonne)}"
+
+    def campi_prompt(self) -> list[str]:
+        return list(dict.fromkeys(
+            campo for _, campo, _, _ in string.Formatter().parse(self.prompt_template) if campo
+        ))
+
+
+class _StatoPasso:
+    """Righe in attesa, pronte e scritte di un passo durante l'esecuzione."""
+
+    def __init__(self, passo: PassoGemini, n: int):
+        self.passo = passo
+        self.n = n
+        self.mancanti = np.zeros(n, dtype=np.int64)   # dipendenze non ancora soddisfatte per riga
+        self.coda: list[int] = []
+        self.in_coda_da = 0.0
+        # prompt delle righe in coda, calcolati per raggrupparle (vedi FlussoGemini._ordina_coda)
+        self.prompt_di: Dict[int, str] = {}
+        self.da_ordinare = False
+        self.inviate = 0
+        self.scritte = 0
+        self.sorgenti: Dict[str, Callable[[np.ndarray], np.ndarray]] = {}
+        self.fonti: list["_StatoPasso"] = []
+        # (passo dipendente, None per la stessa riga o (ordine, inizi) per riga -> righe che la referenziano)
+        self.iscritti: list[tuple["_StatoPasso", Optional[tuple[np.ndarray, np.ndarray]]]] = []
+        self.evento = asyncio.Event()
+        self.fallimenti = ContatoreFallimenti(f"le colonne {list(passo.colonne)}")
+        self.dimensionatore = dimensionatore_condiviso(
+            passo.prompt_template, passo.token_uscita, passo.batch_size, passo.preambolo
+        )
+        self.occorrenze: Dict[str, int] = {}
+        self.inizio = time.perf_counter()
+        self.prima_riga: Optional[float] = None
+
+    @property
+    def completato(self) -> bool:
+        return self.scritte >= self.n
+
+    def fonti_complete(self) -> bool:
+        return all(fonte.completato for fonte in self.fonti)
+
+    def accoda(self, righe: np.ndarray):
+        if not len(righe):
+            return
+        if not self.coda:
+            self.in_coda_da = asyncio.get_running_loop().time()
+        self.coda.extend(righe.tolist())
+        self.da_ordinare = True
+        self.evento.set()
+
+
+
+# ESECUZIONE A FLUSSO
+
+class FlussoGemini:
+    """
+    Esegue i passi come una pipeline a livello di riga: ogni passo invia un
+    batch quando ha abbastanza righe pronte per il budget di token (o dopo attesa secondi, o quando
+    i passi da cui dipende hanno finito) e le righe completate passano subito
+    ai passi successivi. Tutte le richieste condividono un limitatore AIMD.
+
+    Le risposte arrivano in streaming: ogni riga viene scritta e sbloccata
+    appena il suo valore è completo, senza aspettare il resto del batch.
+    """
+
+    def __init__(
+        self,
+        tabelle: Dict[str, pd.DataFrame],
+        passi: list[PassoGemini],
+        usa_cache: bool = True,
+        attesa: Optional[float] = None,
+        al_progresso: Optional[Callable[[int, int], None]] = None
+    ):
+        self.tabelle = tabelle
+        self.passi = passi
+        self.usa_cache = usa_cache
+        self.attesa = settings.GEMINI_FLUSSO_ATTESA if attesa is None else attesa
+        self.al_progresso = al_progresso
+        self.valori: Dict[tuple[str, str], np.ndarray] = {}
+        self.righe_scritte = 0
+        self.righe_totali = 0
+
+    def _prepara(self) -> list[_StatoPasso]:
+        stati = []
+        produttori: Dict[tuple[str, str], _StatoPasso] = {}
+
+        for passo in self.passi:
+            df = self.tabelle[passo.tabella]
+            stato = _StatoPasso(passo, len(df))
+            temp = {nome: np.asarray(funzione(df), dtype=object) for nome, funzione in passo.colonne_temp.items()}
+
+            for campo in passo.campi_prompt():
+                if campo in passo.riferimenti:
+                    tabella_rif, colonna_rif, chiave = passo.riferimenti[campo]
+                    posizioni = indice(self.tabelle[tabella_rif]).posizioni(df[chiave].to_numpy())
+                    produttore = produttori.get((tabella_rif, colonna_rif))
+                    valori = self._valori(tabella_rif, colonna_rif, produttore)
+                    stato.sorgenti[campo] = _per_riferimento(valori, posizioni)
+                    if produttore is not None:
+                        self._collega(produttore, stato, posizioni)
+                elif (passo.tabella, campo) in produttori:
+                    produttore = produttori[(passo.tabella, campo)]
+                    stato.sorgenti[campo] = _per_riga(self.valori[(passo.tabella, campo)])
+                    self._collega(produttore, stato, None)
+                elif campo in temp:
+                    stato.sorgenti[campo] = _per_riga(temp[campo])
+                else:
+                    stato.sorgenti[campo] = _per_riga(df[campo].to_numpy())
+
+            for colonna in passo.colonne:
+                self.valori[(passo.tabella, colonna)] = np.full(len(df), None, dtype=object)
+                produttori[(passo.tabella, colonna)] = stato
+            stati.append(stato)
+        self.righe_totali = sum(stato.n for stato in stati)
+        return stati
+
+    def _valori(self, tabella: str, colonna: str, produttore: Optional[_StatoPasso]) -> np.ndarray:
+        if produttore is not None:
+            return self.valori[(tabella, colonna)]
+        return self.tabelle[tabella][colonna].to_numpy()
+
+    @staticmethod
+    def _collega(produttore: _StatoPasso, dipendente: _StatoPasso, posizioni: Optional[np.ndarray]):
+        if produttore not in dipendente.fonti:
+            dipendente.fonti.append(produttore)
+        if posizioni is None:
+            dipendente.mancanti += 1
+            produttore.iscritti.append((dipendente, None))
+            return
+        # righe senza riferimento: nessuna attesa, il valore resta None
+        validi = posizioni >= 0
+        dipendente.mancanti += validi
+        ordine = np.flatnonzero(validi)[np.argsort(posizioni[validi], kind="stable")]
+        inizi = np.concatenate([[0], np.cumsum(np.bincount(posizioni[validi], minlength=produttore.n))])
+        produttore.iscritti.append((dipendente, (ordine, inizi)))
+
+    def _prompts(self, stato: _StatoPasso, righe: np.ndarray) -> list[str]:
+        valori = {campo: sorgente(righe) for campo, sorgente in stato.sorgenti.items()}
+        template = stato.passo.prompt_template
+        return [template.format(**{campo: v[i] for campo, v in valori.items()}) for i in range(len(righe))]
+
+    def _ordina_coda(self, stato: _StatoPasso):
+        """
+        Mette vicine le righe in coda con lo stesso prompt (nell'ordine del primo
+        arrivo): finiscono nello stesso batch e diventano una sola richiesta di
+        k varianti, invece di ripetere il prompt in batch diversi.
+        """
+        if not stato.da_ordinare:
+            return
+        stato.da_ordinare = False
+        nuove = [r for r in stato.coda if r not in stato.prompt_di]
+        if nuove:
+            stato.prompt_di.update(zip(nuove, self._prompts(stato, np.array(nuove, dtype=np.int64))))
+        primo: Dict[str, int] = {}
+        for r in stato.coda:
+            primo.setdefault(stato.prompt_di[r], len(primo))
+        stato.coda.sort(key=lambda r: primo[stato.prompt_di[r]])
+
+    async def _elabora(self, stato: _StatoPasso, righe: np.ndarray, limitatore: LimitatoreAIMD):
+        passo = stato.passo
+        if passo.raggruppa_prompt:
+            prompts = [stato.prompt_di.pop(r) for r in righe.tolist()]
+        else:
+            prompts = self._prompts(stato, righe)
+        campi = list(passo.colonne)
+        arrivate = np.zeros(len(righe), dtype=bool)
+
+        def per_colonna(risposte: list) -> Dict[str, list]:
+            if passo.json:
+                return {
+                    campo: [passo.default_value if o is None else str(o[campo]).strip() for o in risposte]
+                    for campo in campi
+                }
+            return {campi[0]: risposte}
+
+        def al_valore(k: int, risposta):
+            # la riga è completa: passa subito ai passi successivi
+            arrivate[k] = True
+            self._scrivi(stato, righe[k:k + 1], per_colonna([risposta]))
+
+        if passo.json:
+            risposte = await con_cache(
+                prompts, MODEL_NAME, GENERATION_CONFIG_JSON, passo.preambolo,
+                lambda mancanti, al_valore_mancanti: genera_oggetti_async(
+                    mancanti, campi, stato.dimensionatore, limitatore, stato.fallimenti, al_valore_mancanti,
+                    accetta_oggetto(passo.colonne), passo.raggruppa_prompt
+                ),
+                valido=lambda o: o is not None, usa_cache=self.usa_cache, occorrenze=stato.occorrenze,
+                al_valore=al_valore
+            )
+        else:
+            risposte = await con_cache(
+                prompts, MODEL_NAME, GENERATION_CONFIG_BATCH, PREAMBOLO_BATCH,
+                lambda mancanti, al_valore_mancanti: genera_valori_async(
+                    mancanti, campi[0], stato.dimensionatore, limitatore, stato.fallimenti,
+                    passo.default_value, passo.raggruppa_prompt, al_valore_mancanti,
+                    accetta_valore(passo.colonne[campi[0]])
+                ),
+                valido=lambda r: r != passo.default_value, usa_cache=self.usa_cache, occorrenze=stato.occorrenze,
+                al_valore=al_valore
+            )
+
+        # righe non arrivate durante lo stream: valori di default
+        resto = np.flatnonzero(~arrivate)
+        if len(resto):
+            self._scrivi(stato, righe[resto], per_colonna([risposte[k] for k in resto.tolist()]))
+
+    def _scrivi(self, stato: _StatoPasso, righe: np.ndarray, per_colonna: Dict[str, list]):
+        """Valida e scrive i valori delle righe, poi sblocca le righe che ne dipendono."""
+        passo = stato.passo
+        # i passi successivi leggono già i valori validati
+        for colonna, valori in per_colonna.items():
+            validatore = passo.colonne[colonna]
+            if validatore:
+                try:
+                    valori = validatore(valori)
+                except Exception as e:
+                    logger.error(f"Errore nel validatore per la colonna '{colonna}': {e}")
+                    valori = [None] * len(righe)
+            self.valori[(passo.tabella, colonna)][righe] = _array_oggetti(valori)
+
+        stato.scritte += len(righe)
+        if stato.prima_riga is None:
+            stato.prima_riga = time.perf_counter() - stato.inizio
+        self.righe_scritte += len(righe)
+        if self.al_progresso:
+            self.al_progresso(self.righe_scritte, self.righe_totali)
+        self._notifica(stato, righe)
+
+    @staticmethod
+    def _notifica(stato: _StatoPasso, righe: np.ndarray):
+        for dipendente, mappa in stato.iscritti:
+            if mappa is None:
+                interessate = righe
+            else:
+                ordine, inizi = mappa
+                interessate = np.concatenate([ordine[inizi[r]:inizi[r + 1]] for r in righe.tolist()] or [ordine[:0]])
+            dipendente.mancanti[interessate] -= 1
+            dipendente.accoda(interessate[dipendente.mancanti[interessate] == 0])
+            if stato.completato:
+                # nessun'altra riga in arrivo da qui: chi aspettava un batch pieno può partire
+                dipendente.evento.set()
+
+    async def _esegui_passo(self, stato: _StatoPasso, limitatore: LimitatoreAIMD):
+        passo = stato.passo
+        loop = asyncio.get_running_loop()
+        stato.inizio = time.perf_counter()
+        stato.accoda(np.flatnonzero(stato.mancanti == 0))
+        tasks: set[asyncio.Task] = set()
+
+        try:
+            while stato.inviate < stato.n:
+                for task in [t for t in tasks if t.done()]:
+                    tasks.discard(task)
+                    task.result()
+
+                # righe per batch secondo il budget di token, aggiornate a ogni risposta
+                dimensione = stato.dimensionatore.dimensione()
+                if len(stato.coda) < dimensione and not stato.fonti_complete():
+                    stato.evento.clear()
+                    if not stato.coda:
+                        await stato.evento.wait()
+                        continue
+                    # un batch parziale parte dopo l'attesa, e solo se c'è uno slot libero:
+                    # con tutte le richieste occupate conviene continuare a riempirlo
+                    residuo = stato.in_coda_da + self.attesa - loop.time()
+                    if residuo <= 0 and limitatore.in_volo >= int(limitatore.limite):
+                        residuo = self.attesa
+                    if residuo > 0:
+                        try:
+                            await asyncio.wait_for(stato.evento.wait(), timeout=residuo)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                elif not stato.coda:
+                    # con le fonti complete tutte le righe rimaste dovrebbero essere pronte
+                    raise RuntimeError(f"Flusso Gemini '{passo.nome}': righe senza dipendenze risolte")
+
+                if passo.raggruppa_prompt:
+                    self._ordina_coda(stato)
+                righe = np.array(stato.coda[:dimensione], dtype=np.int64)
+                del stato.coda[:dimensione]
+                if stato.coda:
+                    stato.in_coda_da = loop.time()
+                stato.inviate += len(righe)
+                task = asyncio.ensure_future(self._elabora(stato, righe, limitatore))
+                # un batch fallito deve svegliare il passo anche se è in attesa di righe
+                task.add_done_callback(lambda _task: stato.evento.set())
+                tasks.add(task)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        logger.info(
+            f"Flusso Gemini '{passo.nome}': {stato.n} righe in {time.perf_counter() - stato.inizio:.2f}s, "
+            f"prime righe dopo {stato.prima_riga or 0.0:.2f}s, batch finali da {stato.dimensionatore.dimensione()} righe"
+        )
+
+    async def esegui_async(self) -> Dict[str, pd.DataFrame]:
+        stati = self._prepara()
+        limitatore = get_limitatore()
+        inizio = time.perf_counter()
+        await esegui_batch_concorrenti(stati, lambda stato: self._esegui_passo(stato, limitatore))
+        logger.info(
+            f"Flusso Gemini: {len(stati)} passi in {time.perf_counter() - inizio:.2f}s, "
+            f"concorrenza {int(limitatore.limite)}, rate limit {limitatore.rate_limit}"
+        )
+
+        risultato = {}
+        for nome in dict.fromkeys(passo.tabella for passo in self.passi):
+            df = self.tabelle[nome].copy(deep=False)
+            for (tabella, colonna), valori in self.valori.items():
+                if tabella == nome:
+                    df[colonna] = valori.tolist()
+            risultato[nome] = df
+        return risultato
+
+
+def _array_oggetti(valori: list) -> np.ndarray:
+    risultato = np.empty(len(valori), dtype=object)
+    risultato[:] = valori
+    return risultato
+
+
+def _per_riga(valori: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+    return lambda righe: valori[righe]
+
+
+def _per_riferimento(valori: np.ndarray, posizioni: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+    def leggi(righe: np.ndarray) -> np.ndarray:
+        pos = posizioni[righe]
+        risultato = np.full(len(righe), None, dtype=object)
+        trovate = pos >= 0
+        risultato[trovate] = valori[pos[trovate]]
+        return risultato
+    return leggi
+
+
+def riempi_tabelle_gemini_flusso(
+    tabelle: Dict[str, pd.DataFrame],
+    passi: list[PassoGemini],
+    usa_cache: bool = True,
+    attesa: Optional[float] = None,
+    al_progresso: Optional[Callable[[int, int], None]] = None
+) -> Dict[str, pd.DataFrame]:
+    """
+    Riempie con Gemini le colonne dei passi, facendo avanzare ogni riga al
+    passo successivo appena i suoi ingressi sono pronti invece di attendere
+    l'intera colonna (es. le risorse di un corso partono appena quel corso
+    ha nome e descrizione).
+
+    Args:
+        tabelle: {nome: DataFrame}, comprese quelle lette solo tramite riferimenti
+        passi: passi nell'ordine in cui andrebbero eseguiti in sequenza
+        usa_cache: se False ignora la cache persistente
+        attesa: secondi massimi di attesa per riempire un batch (default settings.GEMINI_FLUSSO_ATTESA)
+        al_progresso: chiamata con (righe scritte, righe totali) per ogni riga completata
+
+    Returns:
+        {nome: DataFrame aggiornato} per le tabelle con almeno un passo
+    """
+    return esegui_async(FlussoGemini(tabelle, passi, usa_cache, attesa, al_progresso).esegui_async())
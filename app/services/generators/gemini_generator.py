@@ -1,9 +1,16 @@
 import logging
-import time
 from typing import Callable, Optional
 import pandas as pd
-from vertexai.generative_models import GenerativeModel
-from google.api_core import exceptions as api_exceptions
+from app.services.generators.gemini_async import (
+    LimitatoreAIMD,
+    esegui_async,
+    esegui_batch_concorrenti,
+    get_limitatore
+)
+from app.services.generators.gemini_batch import DimensionatoreBatch, dimensionatore_condiviso, esegui_batch_adattivi
+from app.services.generators.gemini_cache import con_cache
+from app.services.generators.gemini_client import crea_modello
+from app.services.generators.gemini_streaming import ParserOggettiJson, ParserRigheNumerate, genera_righe
 
 logger = logging.getLogger(__name__)
 
@@ -11,62 +18,333 @@ logger = logging.getLogger(__name__)
 
 # CHIAMATA GEMINI IN BATCH
 
+MODEL_NAME = "gemini-2.5-flash"
+GENERATION_CONFIG_BATCH = {"temperature": 1.7}
+
+PREAMBOLO_BATCH = (
+    "Stai generando valori per una colonna di una tabella CSV. "
+    "Ogni blocco numerato rappresenta una richiesta. "
+    "Rispondi con un solo valore per ciascuna richiesta, numerato da 1 a N. "
+    "Tutti i valori devono essere diversi tra loro: evita ripetizioni, varia lo stile e il contenuto. "
+    "Non aggiungere spiegazioni, introduzioni, commenti, punto elenco, né testo extra. "
+    "Rispondi solo con i valori richiesti, uno per riga, nel formato:\n"
+    "1. <valore>\n2. <valore>\n ... \n\n"
+    "Ecco le richieste:\n\n"
+)
+
+
+def costruisci_prompt_batch(prompts: list[str]) -> str:
+    """Prompt concatenato: preambolo + richieste numerate da 1 a N."""
+    return PREAMBOLO_BATCH + "\n".join([f"{i+1}. {p}" for i, p in enumerate(prompts)])
+
+
+def estrai_risposte(raw_text: str, n: int, default_value: str = "N/A") -> list[str]:
+    """
+    Estrae i valori dalle righe numerate della risposta: ogni valore va alla
+    richiesta indicata dal suo numero, quelle senza risposta ricevono default_value.
+    """
+    parser = ParserRigheNumerate(n)
+    parser.aggiungi(raw_text)
+    parser.chiudi()
+
+    if not parser.valori:
+        logger.warning("Nessuna risposta valida estratta dal testo Gemini.")
+    elif len(parser.valori) < n:
+        logger.warning(f"Batch incompleto: atteso {n}, ricevuto {len(parser.valori)}")
+
+    return [parser.valori.get(i, default_value) for i in range(n)]
+
+
+async def call_gemini_batch_async(
+    prompts: list[str],
+    model_name: str = "gemini-2.5-flash",
+    max_retries: int = 3,
+    delay: int = 5,
+    default_value: str = "N/A",
+    limitatore: Optional[LimitatoreAIMD] = None,
+    usa_cache: bool = True,
+    al_valore: Optional[Callable[[int, str], None]] = None,
+    accetta: Optional[Callable[[str], bool]] = None,
+    dimensionatore: Optional[DimensionatoreBatch] = None
+) -> list[str]:
+    """
+    Versione asincrona di call_gemini_batch: la chiamata occupa uno slot del
+    limitatore AIMD, così più batch possono essere in volo contemporaneamente.
+    I prompt già presenti nella cache persistente non vengono inviati.
+
+    La risposta viene letta in streaming: al_valore(indice, valore) viene
+    chiamata per ogni riga appena arriva, e se lo stream si interrompe le
+    righe già ricevute vengono conservate. Le righe mancanti o scartate da
+    accetta vengono richieste di nuovo da sole (vedi genera_righe).
+    L'esito della chiamata aggiorna dimensionatore, se indicato.
+    """
+    limitatore = limitatore or get_limitatore()
+
+    async def chiedi(mancanti: list[str], al_valore_mancanti=None) -> list[str]:
+        model = crea_modello(model_name, GENERATION_CONFIG_BATCH)
+        ricevuti = await genera_righe(
+            model,
+            lambda richieste: costruisci_prompt_batch([mancanti[i] for i in richieste]),
+            len(mancanti),
+            ParserRigheNumerate,
+            limitatore,
+            max_retries=max_retries,
+            delay=delay,
+            al_valore=al_valore_mancanti,
+            accetta=accetta,
+            dimensionatore=dimensionatore
+        )
+        return [ricevuti.get(i, default_value) for i in range(len(mancanti))]
+
+    return await con_cache(
+        prompts, model_name, GENERATION_CONFIG_BATCH, PREAMBOLO_BATCH,
+        chiedi, valido=lambda r: r != default_value, usa_cache=usa_cache, al_valore=al_valore
+    )
+
+
 def call_gemini_batch(
     prompts: list[str], 
     model_name: str = "gemini-2.5-flash", 
     max_retries: int = 3, 
     delay: int = 5,
-    default_value: str = "N/A"
+    default_value: str = "N/A",
+    usa_cache: bool = True
 ) -> list[str]:
     """
     Esegue una chiamata batch a Gemini con retry e fallback.
+    usa_cache=False ignora la cache quando servono risposte sempre nuove.
+    """
+    return esegui_async(
+        call_gemini_batch_async(prompts, model_name, max_retries, delay, default_value, usa_cache=usa_cache)
+    )
+
+
+
+# CHIAMATA GEMINI PER VARIANTI DI UNO STESSO PROMPT
+
+MAX_VARIANTI_PER_RICHIESTA = 50
+
+PREAMBOLO_VARIANTI = (
+    "Stai generando valori per una colonna di una tabella CSV. "
+    "Per la richiesta qui sotto genera {k} valori diversi tra loro, numerati da 1 a {k}. "
+    "Evita ripetizioni: varia lo stile e il contenuto di ogni valore. "
+    "Non aggiungere spiegazioni, introduzioni, commenti, punto elenco, né testo extra. "
+    "Rispondi solo con i valori richiesti, uno per riga, nel formato:\n"
+    "1. <valore>\n2. <valore>\n ... \n\n"
+    "Richiesta:\n"
+)
+
+
+def blocchi_varianti(k: int, dimensionatore: Optional[DimensionatoreBatch] = None) -> list[tuple[int, int]]:
+    """
+    Blocchi (inizio, n) in cui dividere k varianti dello stesso prompt: al più
+    MAX_VARIANTI_PER_RICHIESTA per chiamata, o quelle che stanno nel budget di
+    uscita del dimensionatore (il prompt viene inviato una volta sola).
+    """
+    per_richiesta = MAX_VARIANTI_PER_RICHIESTA
+    if dimensionatore:
+        per_richiesta = min(per_richiesta, dimensionatore.dimensione(token_ingresso_riga=0))
+    return [(i, min(per_richiesta, k - i)) for i in range(0, k, per_richiesta)]
+
+
+def raggruppa_prompt_identici(prompts: list[str], raggruppa: bool = True) -> tuple[dict[str, list[int]], list[int]]:
+    """
+    Divide i prompt in ripetuti {prompt: indici}, da chiedere come k varianti
+    in un'unica richiesta, e indici dei prompt singoli. Con raggruppa=False
+    sono tutti singoli.
+    """
+    righe_per_prompt: dict[str, list[int]] = {}
+    if raggruppa:
+        for idx, prompt in enumerate(prompts):
+            righe_per_prompt.setdefault(prompt, []).append(idx)
+    ripetuti = {p: righe for p, righe in righe_per_prompt.items() if len(righe) > 1}
+    singoli = [idx for idx, prompt in enumerate(prompts) if prompt not in ripetuti]
+    return ripetuti, singoli
+
+
+async def call_gemini_varianti_async(
+    prompt: str,
+    k: int,
+    model_name: str = "gemini-2.5-flash",
+    max_retries: int = 3,
+    delay: int = 5,
+    default_value: str = "N/A",
+    limitatore: Optional[LimitatoreAIMD] = None,
+    al_valore: Optional[Callable[[int, str], None]] = None,
+    accetta: Optional[Callable[[str], bool]] = None,
+    dimensionatore: Optional[DimensionatoreBatch] = None
+) -> list[str]:
+    """
+    Chiede a Gemini k valori distinti per lo stesso prompt. Oltre
+    MAX_VARIANTI_PER_RICHIESTA valori (o quelli che stanno nel budget di
+    uscita del dimensionatore) la richiesta viene divisa in più chiamate
+    parallele. al_valore e accetta come in call_gemini_batch_async.
+    """
+    limitatore = limitatore or get_limitatore()
+    model = crea_modello(model_name, GENERATION_CONFIG_BATCH)
+
+    async def richiedi(blocco: tuple[int, int]) -> list[str]:
+        inizio, n = blocco
+        ricevuti = await genera_righe(
+            model,
+            lambda richieste: PREAMBOLO_VARIANTI.format(k=len(richieste)) + prompt,
+            n,
+            ParserRigheNumerate,
+            limitatore,
+            max_retries=max_retries,
+            delay=delay,
+            al_valore=al_valore and (lambda j, valore: al_valore(inizio + j, valore)),
+            accetta=accetta,
+            dimensionatore=dimensionatore
+        )
+        return [ricevuti.get(j, default_value) for j in range(n)]
+
+    blocchi = blocchi_varianti(k, dimensionatore)
+    risultati = await esegui_batch_concorrenti(blocchi, richiedi)
+    logger.info(f"Ricevute {k} varianti per un prompt in {len(blocchi)} richieste")
+    return [r for blocco in risultati for r in blocco]
+
+
+
+# GENERAZIONE DEI VALORI DI UNA COLONNA
+
+class ContatoreFallimenti:
+    """
+    Batch falliti per intero durante la generazione di una colonna: al terzo
+    la generazione viene interrotta invece di riempire la colonna di default.
+    """
+
+    def __init__(self, descrizione: str, massimo: int = 3):
+        self.descrizione = descrizione
+        self.massimo = massimo
+        self.conteggio = 0
+
+    def registra(self, fallito: bool):
+        if not fallito:
+            return
+        self.conteggio += 1
+        if self.conteggio >= self.massimo:
+            logger.error(f"Troppi batch falliti. Interrompo.")
+            raise ValueError(f"Troppi batch Gemini falliti per {self.descrizione}")
+
+
+async def genera_valori_async(
+    prompts: list[str],
+    colonna_target: str,
+    dimensionatore: DimensionatoreBatch,
+    limitatore: LimitatoreAIMD,
+    fallimenti: ContatoreFallimenti,
+    default_value: str = "N/A",
+    raggruppa_prompt: bool = True,
+    al_valore: Optional[Callable[[int, str], None]] = None,
+    accetta: Optional[Callable[[str], bool]] = None
+) -> list[str]:
     """
-    for attempt in range(1, max_retries + 1):
+    Un valore per prompt, con più richieste in volo secondo il limitatore.
+    I prompt distinti vengono numerati in batch riempiti fino al budget di
+    token del dimensionatore, quello del template della colonna; con
+    raggruppa_prompt i prompt identici diventano una sola richiesta di k varianti.
+    al_valore(indice del prompt, valore) riceve ogni valore appena arriva;
+    i valori scartati da accetta vengono richiesti di nuovo.
+    """
+
+    async def elabora(lavoro: tuple) -> list[str]:
+        """
+        lavoro = ("batch", i, prompts) per prompt distinti numerati in un batch,
+        oppure ("varianti", i, prompt, k) per k valori distinti dello stesso prompt.
+        """
+        tipo, i = lavoro[0], lavoro[1]
+        atteso = len(lavoro[2]) if tipo == "batch" else lavoro[3]
+
+        righe = singoli[i:i + atteso] if tipo == "batch" else ripetuti[lavoro[2]]
+        al_valore_righe = al_valore and (lambda j, valore: al_valore(righe[j], valore))
+
         try:
-            model = GenerativeModel(model_name, generation_config={"temperature": 1.7})
-    
-            # Prompt concatenato
-            full_prompt = (
-                "Stai generando valori per una colonna di una tabella CSV. "
-                "Ogni blocco numerato rappresenta una richiesta. "
-                "Rispondi con un solo valore per ciascuna richiesta, numerato da 1 a N. "
-                "Tutti i valori devono essere diversi tra loro: evita ripetizioni, varia lo stile e il contenuto. "
-                "Non aggiungere spiegazioni, introduzioni, commenti, punto elenco, né testo extra. "
-                "Rispondi solo con i valori richiesti, uno per riga, nel formato:\n"
-                "1. <valore>\n2. <valore>\n ... \n\n"
-                "Ecco le richieste:\n\n"
-                + "\n".join([f"{i+1}. {p}" for i, p in enumerate(prompts)])
-            )
+            if tipo == "batch":
+                responses = await call_gemini_batch_async(
+                    lavoro[2], default_value=default_value, limitatore=limitatore, usa_cache=False,
+                    al_valore=al_valore_righe, accetta=accetta, dimensionatore=dimensionatore
+                )
+            else:
+                responses = await call_gemini_varianti_async(
+                    lavoro[2], lavoro[3], default_value=default_value, limitatore=limitatore,
+                    al_valore=al_valore_righe, accetta=accetta, dimensionatore=dimensionatore
+                )
+        except Exception as e:
+            logger.error(f"Errore nella chiamata Gemini per il batch {i}-{i+atteso}: {e}")
+            responses = [default_value] * atteso
+        
+        # se Gemini ha restituito meno risposte
+        if len(responses) != atteso:
+            logger.warning(f"Batch incompleto: atteso {atteso}, ricevuto{len(responses)}")
+            responses += [default_value] * (atteso - len(responses))
+            responses = responses[:atteso]
+
+        # interruzione se tutto è fallito
+        fallimenti.registra(all(r == default_value for r in responses))
+        return responses
 
-            response = model.generate_content(full_prompt)
-            logger.info(f"Risposta Gemini batch ricevuta (tentativo {attempt})")
-            
-            # Split delle risposte
-            raw_text = response.text.strip()
-            answers = []
+    # raggruppamento dei prompt identici: un'unica richiesta con k varianti
+    ripetuti, singoli = raggruppa_prompt_identici(prompts, raggruppa_prompt)
 
-            for line in raw_text.splitlines():
-                if line.strip() and line[0].isdigit():
-                    parts = line.split(".", 1)
-                    if len(parts) == 2:
-                        answers.append(parts[1].strip())
+    prompts_singoli = [prompts[idx] for idx in singoli]
+    varianti = [("varianti", i, prompt, len(righe)) for i, (prompt, righe) in enumerate(ripetuti.items())]
+    richieste = [len(varianti)]
 
-            if not answers:
-                logger.warning("Nessuna risposta valida estratta dal testo Gemini.")
-                answers = [default_value] * len(prompts)
+    async def elabora_batch(intervallo: tuple[int, int]) -> list[str]:
+        inizio, fine = intervallo
+        richieste[0] += 1
+        return await elabora(("batch", inizio, prompts_singoli[inizio:fine]))
 
-            if len(answers) < len(prompts):
-                logger.warning(f"Batch incompleto: atteso {len(prompts)}, ricevuto {len(answers)}")
-                answers += [default_value] * (len(prompts) - len(answers))
+    # i batch dei prompt distinti vengono chiusi man mano, con le stime aggiornate
+    risposte_singoli, risposte_varianti = await esegui_batch_concorrenti(
+        [
+            lambda: esegui_batch_adattivi(prompts_singoli, dimensionatore, limitatore, elabora_batch),
+            lambda: esegui_batch_concorrenti(varianti, elabora)
+        ],
+        lambda avvia: avvia()
+    )
 
-            return answers
+    # ridistribuzione delle risposte sulle righe di origine
+    risposte = [default_value] * len(prompts)
+    for idx, valore in zip(singoli, risposte_singoli):
+        risposte[idx] = valore
+    for lavoro, valori in zip(varianti, risposte_varianti):
+        for idx, valore in zip(ripetuti[lavoro[2]], valori):
+            risposte[idx] = valore
 
-        except (api_exceptions.GoogleAPIError, Exception) as e:
-            logger.warning(f"Errore Gemini batch (tentativo {attempt}): {e}")
-            time.sleep(delay)
+    logger.info(
+        f"Colonna '{colonna_target}': {len(prompts)} righe, {len(singoli) + len(ripetuti)} prompt distinti, "
+        f"{richieste[0]} richieste, concorrenza {int(limitatore.limite)}, rate limit {limitatore.rate_limit}"
+    )
+    return risposte
 
-    logger.error("Gemini ha fallito dopo i retry.")
-    return [default_value] * len(prompts)
+
+
+# VALIDAZIONE DEL SINGOLO VALORE
+
+def accetta_valore(validatore: Optional[Callable[[list[str]], list]]) -> Optional[Callable[[str], bool]]:
+    """
+    Predicato per un singolo valore ricavato da un validatore di colonna: il
+    valore è accettato se il validatore non lo trasforma in None.
+    """
+    if validatore is None:
+        return None
+
+    def accetta(valore: str) -> bool:
+        try:
+            return validatore([valore])[0] is not None
+        except Exception:
+            return False
+    return accetta
+
+
+def accetta_oggetto(colonne: dict[str, Optional[Callable[[list[str]], list]]]) -> Optional[Callable[[dict], bool]]:
+    """Come accetta_valore per gli oggetti JSON: ogni campo deve superare il suo validatore."""
+    predicati = {campo: accetta_valore(v) for campo, v in colonne.items() if v is not None}
+    if not predicati:
+        return None
+    return lambda oggetto: all(accetta(str(oggetto[campo]).strip()) for campo, accetta in predicati.items())
 
 
 
@@ -76,11 +354,14 @@ def riempi_colonna_gemini(
     df: pd.DataFrame,
     colonna_target: str,
     prompt_template: str,
-    colonne_temp: Optional[dict[str, Callable[[pd.Series], any]]] = None,
-    batch_size: int = 10,
+    colonne_temp: Optional[dict[str, Callable[[pd.DataFrame], any]]] = None,
+    batch_size: Optional[int] = None,
     rimuovi_temp: bool = True,
     validatore: Optional[Callable[[list[str]], list]] = None,
-    default_value: str = "N/A"   
+    default_value: str = "N/A",
+    usa_cache: bool = True,
+    raggruppa_prompt: bool = True,
+    token_uscita: float = 50
 ) -> pd.DataFrame:
     """
     Modifica una colonna esistente nel DataFrame usando Gemini e un prompt generativo.
@@ -89,11 +370,17 @@ def riempi_colonna_gemini(
         df: DataFrame da modificare
         colonna_target: nome della colonna da sovrascrivere
         prompt_template: stringa con placeholder da usare per generare i prompt
-        colonne_temp: dizionario {nome_colonna: funzione(row) -> valore} per colonne di supporto
-        batch_size: numero di righe per chiamata batch
+        colonne_temp: dizionario {nome_colonna: funzione(df) -> valori} per colonne di supporto,
+            calcolate in modo vettoriale sull'intero DataFrame (vedi app.services.utils.indici)
+        batch_size: numero massimo di righe per chiamata (default settings.GEMINI_BATCH_RIGHE_MAX);
+            le chiamate vengono riempite fino al budget di token
         rimuovi_temp: se True, rimuove le colonne temporanee dopo la generazione
         validatore: funzione che prende una lista di stringhe e restituisce una lista di valori validati
         default_value: valore da inserire in caso di fallback
+        usa_cache: se False ignora la cache persistente e rigenera tutti i valori
+        raggruppa_prompt: se True i prompt identici vengono inviati una sola volta,
+            chiedendo tanti valori distinti quante sono le righe che li usano
+        token_uscita: stima iniziale dei token di un valore, poi adattata alle risposte
 
     Returns:
         DataFrame aggiornato
@@ -104,51 +391,42 @@ def riempi_colonna_gemini(
         try:
             for nome, funzione in colonne_temp.items():
                 # applico la funzione riga per riga
-                df[nome] = df.apply(funzione, axis=1)
+                df[nome] = funzione(df)
         except Exception as e:
             logger.error(f"Errore durante la creazione delle colonne temporanee: {e}")
             raise  
 
-    results = []
-    # generazione batch
-    batch_failures = 0
+    # costruzione dei prompt
+    try:
+        prompts = [prompt_template.format(**row) for _, row in df.iterrows()]
+    except Exception as e:
+        logger.error(f"Errore nella costruzione dei prompt per '{colonna_target}': {e}")
+        raise
 
-    for i in range(0, len(df), batch_size):
-        batch = df.iloc[i:i+batch_size]
-        try:
-            prompts = [prompt_template.format(**row) for _, row in batch.iterrows()]
-        except Exception as e:
-            logger.error(f"Errore nella costruzione del prompt per il batch {i}-{i+batch_size}: {e}")
-            raise
-
-        try:
-            responses = call_gemini_batch(prompts, default_value=default_value)
-        except Exception as e:
-            logger.error(f"Errore nella chiamata Gemini per il batch {i}-{i+batch_size}: {e}")
-            responses = [default_value] * len(batch)
-        
-        # se Gemini ha restituito meno risposte
-        if len(responses) != len(batch):
-            logger.warning(f"Batch incompleto: atteso {len(batch)}, ricevuto{len(responses)}")
-            responses += [default_value] * (len(batch) - len(responses))
+    # generazione: più richieste in volo, concorrenza adattata con AIMD
+    limitatore = get_limitatore()
+    fallimenti = ContatoreFallimenti(f"la colonna '{colonna_target}'")
+    dimensionatore = dimensionatore_condiviso(prompt_template, token_uscita, batch_size, PREAMBOLO_BATCH)
 
-        # validazione dei risultati
-        if validatore:
-            try:
-                responses = validatore(responses)
-            except Exception as e:
-                logger.error(f"Errore nel validatore per il batch{i}-{i+batch_size}: {e}")
-                responses = [None] * len(batch)
+    async def genera_mancanti(mancanti: list[str]) -> list[str]:
+        return await genera_valori_async(
+            mancanti, colonna_target, dimensionatore, limitatore, fallimenti, default_value, raggruppa_prompt,
+            accetta=accetta_valore(validatore)
+        )
 
-        # interruzione se tutto è fallito
-        if all(r == default_value for r in responses):
-            batch_failures += 1
-            if batch_failures >= 3:
-                logger.error(f"Troppi batch falliti. Interrompo.")
-                break
+    # i prompt già in cache non vengono inviati
+    results = esegui_async(con_cache(
+        prompts, MODEL_NAME, GENERATION_CONFIG_BATCH, PREAMBOLO_BATCH,
+        genera_mancanti, valido=lambda r: r != default_value, usa_cache=usa_cache
+    ))
 
-        # aggiungo le risposte alla lista results
-        results.extend(responses)
+    # validazione dei risultati
+    if validatore:
+        try:
+            results = validatore(results)
+        except Exception as e:
+            logger.error(f"Errore nel validatore per la colonna '{colonna_target}': {e}")
+            results = [None] * len(df)
 
     # scrittura colonna modificata
     if len(results) != len(df):
@@ -162,4 +440,308 @@ def riempi_colonna_gemini(
         df.drop(columns=list(colonne_temp.keys()), inplace=True)
     
     logger.info(f"Generazione completata: {len(results)} valori generati per '{colonna_target}'")
-    return df
\ No newline at end of file
+    return df
+
+
+# CHIAMATA GEMINI MULTI-COLONNA (JSON)
+
+GENERATION_CONFIG_JSON = {"temperature": 1.2, "response_mime_type": "application/json"}
+
+PREAMBOLO_JSON = (
+    "Stai generando righe di una tabella. Ogni blocco numerato rappresenta una riga. "
+    "Per ciascuna riga genera i campi: {campi}. "
+    "I campi della stessa riga devono essere coerenti tra loro; "
+    "righe diverse devono avere valori diversi: evita ripetizioni. "
+    "Rispondi SOLO con un array JSON valido, senza testo aggiuntivo, con un oggetto per riga "
+    "nello stesso ordine delle richieste, nel formato:\n"
+    '[{{"n": 1, {esempio}}}, {{"n": 2, {esempio}}}, ...]\n\n'
+    "Ecco le richieste:\n\n"
+)
+
+
+PREAMBOLO_VARIANTI_JSON = (
+    "Stai generando righe di una tabella. "
+    "Per la richiesta qui sotto genera {k} righe diverse tra loro, numerate da 1 a {k}, "
+    "ciascuna con i campi: {campi}. "
+    "I campi della stessa riga devono essere coerenti tra loro; "
+    "righe diverse devono avere valori diversi: evita ripetizioni. "
+    "Rispondi SOLO con un array JSON valido, senza testo aggiuntivo, con un oggetto per riga, nel formato:\n"
+    '[{{"n": 1, {esempio}}}, {{"n": 2, {esempio}}}, ...]\n\n'
+    "Richiesta:\n"
+)
+
+
+def _esempio_json(campi: list[str]) -> str:
+    return ", ".join(f'"{c}": <valore>' for c in campi)
+
+
+def costruisci_preambolo_json(campi: list[str]) -> str:
+    return PREAMBOLO_JSON.format(campi=", ".join(campi), esempio=_esempio_json(campi))
+
+
+def costruisci_prompt_varianti_json(campi: list[str], k: int, prompt: str) -> str:
+    """Prompt per k righe distinte della stessa richiesta."""
+    return PREAMBOLO_VARIANTI_JSON.format(k=k, campi=", ".join(campi), esempio=_esempio_json(campi)) + prompt
+
+
+def estrai_oggetti_json(raw_text: str, n: int, campi: list[str]) -> list[Optional[dict]]:
+    """
+    Interpreta la risposta come array JSON di oggetti e li allinea alle n
+    richieste usando il campo "n" (o la posizione se manca).
+    Restituisce None per le righe mancanti o prive di qualche campo; da una
+    risposta troncata vengono recuperati gli oggetti completi.
+    """
+    parser = ParserOggettiJson(n, campi)
+    parser.aggiungi(raw_text)
+    parser.chiudi()
+
+    if not parser.oggetti:
+        logger.warning("Nessun oggetto JSON valido nella risposta Gemini.")
+    elif len(parser.oggetti) < n:
+        logger.warning(f"Batch JSON incompleto: {n - len(parser.oggetti)} righe su {n} senza tutti i campi")
+    return [parser.oggetti.get(i) for i in range(n)]
+
+
+async def call_gemini_json_batch_async(
+    prompts: list[str],
+    campi: list[str],
+    model_name: str = "gemini-2.5-flash",
+    max_retries: int = 3,
+    delay: int = 5,
+    limitatore: Optional[LimitatoreAIMD] = None,
+    al_valore: Optional[Callable[[int, dict], None]] = None,
+    accetta: Optional[Callable[[dict], bool]] = None,
+    dimensionatore: Optional[DimensionatoreBatch] = None
+) -> list[Optional[dict]]:
+    """
+    Una sola chiamata per un batch di righe: ogni riga riceve un oggetto JSON
+    con tutti i campi richiesti. None per le righe non ricevute.
+    Gli oggetti vengono letti in streaming e passati ad al_valore(indice, oggetto)
+    appena completi; quelli mancanti o scartati da accetta vengono richiesti di nuovo.
+    """
+    limitatore = limitatore or get_limitatore()
+    model = crea_modello(model_name, GENERATION_CONFIG_JSON)
+    preambolo = costruisci_preambolo_json(campi)
+
+    ricevuti = await genera_righe(
+        model,
+        lambda richieste: preambolo + "\n".join([f"{j+1}. {prompts[i]}" for j, i in enumerate(richieste)]),
+        len(prompts),
+        lambda m: ParserOggettiJson(m, campi),
+        limitatore,
+        max_retries=max_retries,
+        delay=delay,
+        al_valore=al_valore,
+        accetta=accetta,
+        dimensionatore=dimensionatore
+    )
+    return [ricevuti.get(i) for i in range(len(prompts))]
+
+
+async def call_gemini_json_varianti_async(
+    prompt: str,
+    k: int,
+    campi: list[str],
+    model_name: str = "gemini-2.5-flash",
+    max_retries: int = 3,
+    delay: int = 5,
+    limitatore: Optional[LimitatoreAIMD] = None,
+    al_valore: Optional[Callable[[int, dict], None]] = None,
+    accetta: Optional[Callable[[dict], bool]] = None,
+    dimensionatore: Optional[DimensionatoreBatch] = None
+) -> list[Optional[dict]]:
+    """
+    Come call_gemini_varianti_async per la modalità fusa: k oggetti JSON
+    distinti per lo stesso prompt, che viene inviato una volta sola per blocco.
+    None per le righe non ricevute.
+    """
+    limitatore = limitatore or get_limitatore()
+    model = crea_modello(model_name, GENERATION_CONFIG_JSON)
+
+    async def richiedi(blocco: tuple[int, int]) -> list[Optional[dict]]:
+        inizio, n = blocco
+        ricevuti = await genera_righe(
+            model,
+            lambda richieste: costruisci_prompt_varianti_json(campi, len(richieste), prompt),
+            n,
+            lambda m: ParserOggettiJson(m, campi),
+            limitatore,
+            max_retries=max_retries,
+            delay=delay,
+            al_valore=al_valore and (lambda j, oggetto: al_valore(inizio + j, oggetto)),
+            accetta=accetta,
+            dimensionatore=dimensionatore
+        )
+        return [ricevuti.get(j) for j in range(n)]
+
+    blocchi = blocchi_varianti(k, dimensionatore)
+    risultati = await esegui_batch_concorrenti(blocchi, richiedi)
+    logger.info(f"Ricevute {k} righe JSON per un prompt in {len(blocchi)} richieste")
+    return [o for blocco in risultati for o in blocco]
+
+
+
+async def genera_oggetti_async(
+    prompts: list[str],
+    campi: list[str],
+    dimensionatore: DimensionatoreBatch,
+    limitatore: LimitatoreAIMD,
+    fallimenti: ContatoreFallimenti,
+    al_valore: Optional[Callable[[int, dict], None]] = None,
+    accetta: Optional[Callable[[dict], bool]] = None,
+    raggruppa_prompt: bool = True
+) -> list[Optional[dict]]:
+    """
+    Un oggetto JSON (o None) per prompt, con più batch in volo insieme, ciascuno
+    riempito fino al budget di token del dimensionatore (quello del template).
+    Con raggruppa_prompt i prompt identici diventano una sola richiesta di k
+    righe distinte, come in genera_valori_async.
+    al_valore(indice del prompt, oggetto) riceve ogni oggetto appena arriva;
+    gli oggetti scartati da accetta vengono richiesti di nuovo.
+    """
+    ripetuti, singoli = raggruppa_prompt_identici(prompts, raggruppa_prompt)
+    prompts_singoli = [prompts[idx] for idx in singoli]
+    richieste = [len(ripetuti)]
+
+    async def elabora_batch(intervallo: tuple[int, int]) -> list[Optional[dict]]:
+        i, fine = intervallo
+        richieste[0] += 1
+        righe = singoli[i:fine]
+        oggetti = await call_gemini_json_batch_async(
+            prompts_singoli[i:fine], campi, limitatore=limitatore,
+            al_valore=al_valore and (lambda j, oggetto: al_valore(righe[j], oggetto)),
+            accetta=accetta,
+            dimensionatore=dimensionatore
+        )
+
+        # interruzione se tutto è fallito
+        fallimenti.registra(all(o is None for o in oggetti))
+        return oggetti
+
+    async def elabora_varianti(voce: tuple[str, list[int]]) -> list[Optional[dict]]:
+        prompt, righe = voce
+        try:
+            oggetti = await call_gemini_json_varianti_async(
+                prompt, len(righe), campi, limitatore=limitatore,
+                al_valore=al_valore and (lambda j, oggetto: al_valore(righe[j], oggetto)),
+                accetta=accetta,
+                dimensionatore=dimensionatore
+            )
+        except Exception as e:
+            logger.error(f"Errore nella chiamata Gemini per {len(righe)} righe dello stesso prompt: {e}")
+            oggetti = [None] * len(righe)
+
+        fallimenti.registra(all(o is None for o in oggetti))
+        return oggetti
+
+    # i batch dei prompt distinti vengono chiusi man mano, con le stime aggiornate
+    oggetti_singoli, oggetti_ripetuti = await esegui_batch_concorrenti(
+        [
+            lambda: esegui_batch_adattivi(prompts_singoli, dimensionatore, limitatore, elabora_batch),
+            lambda: esegui_batch_concorrenti(list(ripetuti.items()), elabora_varianti)
+        ],
+        lambda avvia: avvia()
+    )
+
+    # ridistribuzione sulle righe di origine
+    oggetti: list[Optional[dict]] = [None] * len(prompts)
+    for idx, oggetto in zip(singoli, oggetti_singoli):
+        oggetti[idx] = oggetto
+    for righe, valori in zip(ripetuti.values(), oggetti_ripetuti):
+        for idx, oggetto in zip(righe, valori):
+            oggetti[idx] = oggetto
+
+    logger.info(
+        f"Colonne {campi}: {len(prompts)} righe, {len(singoli) + len(ripetuti)} prompt distinti, "
+        f"{richieste[0]} richieste JSON, concorrenza {int(limitatore.limite)}"
+    )
+    return oggetti
+
+
+# RIEMPIMENTO MULTI-COLONNA CON GEMINI
+
+def riempi_colonne_gemini(
+    df: pd.DataFrame,
+    colonne_target: dict[str, Optional[Callable[[list[str]], list]]],
+    prompt_template: str,
+    colonne_temp: Optional[dict[str, Callable[[pd.DataFrame], any]]] = None,
+    batch_size: Optional[int] = None,
+    rimuovi_temp: bool = True,
+    default_value: str = "N/A",
+    usa_cache: bool = True,
+    token_uscita: float = 150,
+    raggruppa_prompt: bool = True
+) -> pd.DataFrame:
+    """
+    Modalità fusa: una sola risposta JSON per riga riempie più colonne
+    dipendenti tra loro (es. fullname, shortname, summary, course_level),
+    invece di una passata completa per colonna.
+
+    Args:
+        df: DataFrame da modificare
+        colonne_target: {nome_colonna: validatore o None}; il validatore riceve la
+            lista dei valori (come stringhe) della colonna e restituisce i valori validati
+        prompt_template: stringa con placeholder che descrive la riga da generare
+        colonne_temp: dizionario {nome_colonna: funzione(df) -> valori} per colonne di supporto,
+            calcolate in modo vettoriale sull'intero DataFrame (vedi app.services.utils.indici)
+        batch_size: numero massimo di righe per chiamata (default settings.GEMINI_BATCH_RIGHE_MAX);
+            le chiamate vengono riempite fino al budget di token
+        rimuovi_temp: se True, rimuove le colonne temporanee dopo la generazione
+        default_value: valore per i campi non ricevuti
+        usa_cache: se False ignora la cache persistente
+        token_uscita: stima iniziale dei token dell'oggetto JSON di una riga, poi adattata
+        raggruppa_prompt: se True i prompt identici vengono inviati una sola volta,
+            chiedendo tante righe distinte quante sono le righe che li usano
+
+    Returns:
+        DataFrame aggiornato
+    """
+    campi = list(colonne_target)
+
+    # aggiunta colonne temporanee
+    if colonne_temp:
+        try:
+            for nome, funzione in colonne_temp.items():
+                df[nome] = funzione(df)
+        except Exception as e:
+            logger.error(f"Errore durante la creazione delle colonne temporanee: {e}")
+            raise
+
+    try:
+        prompts = [prompt_template.format(**row) for _, row in df.iterrows()]
+    except Exception as e:
+        logger.error(f"Errore nella costruzione dei prompt per {campi}: {e}")
+        raise
+
+    limitatore = get_limitatore()
+    fallimenti = ContatoreFallimenti(f"le colonne {campi}")
+    dimensionatore = dimensionatore_condiviso(prompt_template, token_uscita, batch_size, costruisci_preambolo_json(campi))
+
+    async def genera_mancanti(mancanti: list[str]) -> list[Optional[dict]]:
+        return await genera_oggetti_async(
+            mancanti, campi, dimensionatore, limitatore, fallimenti,
+            accetta=accetta_oggetto(colonne_target), raggruppa_prompt=raggruppa_prompt
+        )
+
+    oggetti = esegui_async(con_cache(
+        prompts, MODEL_NAME, GENERATION_CONFIG_JSON, costruisci_preambolo_json(campi),
+        genera_mancanti, valido=lambda o: o is not None, usa_cache=usa_cache
+    ))
+
+    # scrittura colonne, con validazione per campo
+    for campo, validatore in colonne_target.items():
+        valori = [default_value if o is None else str(o[campo]).strip() for o in oggetti]
+        if validatore:
+            try:
+                valori = validatore(valori)
+            except Exception as e:
+                logger.error(f"Errore nel validatore per la colonna '{campo}': {e}")
+                valori = [None] * len(df)
+        df[campo] = valori
+
+    # pulizia colonne temporanee
+    if rimuovi_temp and colonne_temp:
+        df.drop(columns=list(colonne_temp.keys()), inplace=True)
+
+    logger.info(f"Generazione fusa completata: {len(df)} righe per le colonne {campi}")
+    return df
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from typing import Any, Callable, Optional
+
+from app.core.config import settings
+from google.api_core import exceptions as api_exceptions
+
+from app.services.generators.gemini_async import LimitatoreAIMD, chiama_con_aimd
+from app.services.generators.gemini_batch import DimensionatoreBatch
+
+logger = logging.getLogger(__name__)
+
+# "12. valore" oppure "12) valore"
+RIGA_NUMERATA = re.compile(r"^\s*(\d+)\s*[.)]\s*(.*)$")
+
+# caratteri che cambiano lo stato del parser JSON
+_SPECIALI_JSON = re.compile(r'[{}"\\]')
+
+
+
+# PARSER INCREMENTALI
+
+class ParserRigheNumerate:
+    """
+    Risposta a righe numerate letta a pezzi: ogni riga completa "N. valore"
+    viene assegnata alla richiesta N, non alla posizione in cui compare,
+    quindi una riga malformata o mancante non sposta le successive.
+    Trattiene solo l'ultima riga incompleta.
+    """
+
+    def __init__(self, n: int):
+        self.n = n
+        self.valori: dict[int, str] = {}
+        self.scartate = 0
+        self._resto = ""
+
+    def aggiungi(self, testo: str) -> list[tuple[int, str]]:
+        """Valori delle righe completate da questo pezzo, come (indice, valore)."""
+        righe = (self._resto + testo).split("\n")
+        self._resto = righe.pop()
+        return self._analizza(righe)
+
+    def chiudi(self) -> list[tuple[int, str]]:
+        """Fine della risposta: analizza l'ultima riga rimasta."""
+        righe, self._resto = [self._resto], ""
+        return self._analizza(righe)
+
+    def _analizza(self, righe: list[str]) -> list[tuple[int, str]]:
+        nuovi = []
+        for riga in righe:
+            if not riga.strip():
+                continue
+            trovata = RIGA_NUMERATA.match(riga)
+            if not trovata:
+                self.scartate += 1
+                continue
+            idx = int(trovata.group(1)) - 1
+            valore = trovata.group(2).strip()
+            if not 0 <= idx < self.n or idx in self.valori or not valore:
+                self.scartate += 1
+                continue
+            self.valori[idx] = valore
+            nuovi.append((idx, valore))
+        return nuovi
+
+
+class ParserOggettiJson:
+    """
+    Array JSON di oggetti letto a pezzi: ogni oggetto viene decodificato
+    appena si chiude la sua parentesi e assegnato alla richiesta indicata dal
+    campo "n" (o alla sua posizione se manca). Una risposta troncata conserva
+    gli oggetti completi; testo attorno all'array (es. ```json) viene ignorato.
+    """
+
+    def __init__(self, n: int, campi: list[str]):
+        self.n = n
+        self.campi = campi
+        self.oggetti: dict[int, dict] = {}
+        self.scartati = 0
+        self._posizione = 0
+        self._profondita = 0
+        self._in_stringa = False
+        self._escape = False
+        self._parti: list[str] = []
+
+    def aggiungi(self, testo: str) -> list[tuple[int, dict]]:
+        """Oggetti completati da questo pezzo, come (indice, {campo: valore})."""
+        nuovi = []
+        inizio = 0
+        salta = 0
+        if self._escape:
+            salta, self._escape = 1, False
+
+        for trovato in _SPECIALI_JSON.finditer(testo):
+            pos = trovato.start()
+            if pos < salta:
+                continue
+            c = trovato.group()
+            if self._in_stringa:
+                if c == "\\":
+                    salta = pos + 2
+                    self._escape = salta > len(testo)
+                elif c == '"':
+                    self._in_stringa = False
+                continue
+            if c == '"':
+                self._in_stringa = self._profondita > 0
+            elif c == "{":
+                if self._profondita == 0:
+                    inizio = pos
+                    self._parti = []
+                self._profondita += 1
+            elif c == "}" and self._profondita:
+                self._profondita -= 1
+                if self._profondita == 0:
+                    oggetto = "".join(self._parti) + testo[inizio:pos + 1]
+                    self._parti = []
+                    nuovi += self._registra(oggetto)
+
+        if self._profondita:
+            self._parti.append(testo[inizio:])
+        return nuovi
+
+    def chiudi(self) -> list[tuple[int, dict]]:
+        if self._profondita:
+            logger.warning("Risposta JSON troncata: ultimo oggetto incompleto scartato")
+            self.scartati += 1
+        self._parti = []
+        self._profondita = 0
+        return []
+
+    def _registra(self, testo: str) -> list[tuple[int, dict]]:
+        posizione = self._posizione
+        self._posizione += 1
+        try:
+            oggetto = json.loads(testo)
+            idx = int(oggetto.get("n", posizione + 1)) - 1
+        except (ValueError, TypeError, AttributeError):
+            self.scartati += 1
+            return []
+        if not 0 <= idx < self.n or idx in self.oggetti or not all(c in oggetto for c in self.campi):
+            self.scartati += 1
+            return []
+        self.oggetti[idx] = {c: oggetto[c] for c in self.campi}
+        return [(idx, self.oggetti[idx])]
+
+
+
+# CHIAMATA IN STREAMING
+
+def _testo(parte) -> str:
+    # le parti senza testo (es. solo finish_reason) sollevano ValueError su .text
+    try:
+        return parte.text
+    except (ValueError, AttributeError):
+        return ""
+
+
+def _troncata(parte) -> bool:
+    """True se la risposta si è fermata per il limite di token in uscita."""
+    try:
+        return parte.candidates[0].finish_reason.name == "MAX_TOKENS"
+    except (AttributeError, IndexError):
+        return False
+
+
+async def genera_righe(
+    model,
+    costruisci_prompt: Callable[[list[int]], str],
+    n: int,
+    crea_parser: Callable[[int], Any],
+    limitatore: LimitatoreAIMD,
+    max_retries: int = 3,
+    delay: float = 5,
+    al_valore: Optional[Callable[[int, Any], None]] = None,
+    stream: Optional[bool] = None,
+    accetta: Optional[Callable[[Any], bool]] = None,
+    giri: Optional[int] = None,
+    dimensionatore: Optional[DimensionatoreBatch] = None
+) -> dict[int, Any]:
+    """
+    Chiede a Gemini n valori numerati e li assegna alle righe man mano che
+    arrivano, leggendo la risposta in streaming.
+
+    Se lo stream si interrompe le righe già ricevute restano: il tentativo
+    successivo chiede solo quelle mancanti, rinumerate da 1. Allo stesso modo,
+    le righe assenti dalla risposta, illeggibili o scartate da accetta vengono
+    richieste di nuovo in un batch ridotto, per al massimo giri volte.
+
+    Args:
+        model: modello del backend LLM (vedi gemini_client.crea_modello)
+        costruisci_prompt: prompt completo per le richieste indicate (indici 0..n-1)
+        n: numero di richieste
+        crea_parser: parser per m richieste (ParserRigheNumerate o ParserOggettiJson)
+        limitatore: limitatore AIMD condiviso
+        max_retries, delay: come chiama_con_aimd
+        al_valore: chiamata con (indice, valore) appena una riga è completa
+        stream: default settings.GEMINI_STREAMING
+        accetta: predicato sul singolo valore; quelli scartati vengono richiesti di nuovo
+        giri: richieste mirate dopo la prima (default settings.GEMINI_RICHIESTE_MIRATE)
+        dimensionatore: riceve l'esito di ogni chiamata (righe, lunghezza, durata, troncamento)
+
+    Returns:
+        {indice: valore} per le righe ricevute (anche meno di n)
+    """
+    stream = settings.GEMINI_STREAMING if stream is None else stream
+    giri = settings.GEMINI_RICHIESTE_MIRATE if giri is None else giri
+    ricevuti: dict[int, Any] = {}
+    inizio = time.perf_counter()
+    primo: list[float] = []
+    scartati = [0]
+
+    def registra(richieste: list[int], nuovi: list[tuple[int, Any]]) -> int:
+        """Assegna i valori accettati e ne restituisce il numero."""
+        accettati = 0
+        for j, valore in nuovi:
+            if accetta is not None and not accetta(valore):
+                scartati[0] += 1
+                continue
+            i = richieste[j]
+            ricevuti[i] = valore
+            accettati += 1
+            if al_valore:
+                al_valore(i, valore)
+        if accettati and not primo:
+            primo.append(time.perf_counter() - inizio)
+        return accettati
+
+    async def tentativo():
+        richieste = [i for i in range(n) if i not in ricevuti]
+        if not richieste:
+            return
+        parser = crea_parser(len(richieste))
+        prompt = costruisci_prompt(richieste)
+        avvio = time.perf_counter()
+        lette, caratteri, troncata = 0, 0, False
+        try:
+            if stream:
+                risposta = await model.generate_content_async(prompt, stream=True)
+                async for parte in risposta:
+                    testo = _testo(parte)
+                    caratteri += len(testo)
+                    troncata = troncata or _troncata(parte)
+                    lette += registra(richieste, parser.aggiungi(testo))
+            else:
+                risposta = await model.generate_content_async(prompt)
+                testo = _testo(risposta)
+                caratteri, troncata = len(testo), _troncata(risposta)
+                lette += registra(richieste, parser.aggiungi(testo))
+            lette += registra(richieste, parser.chiudi())
+        except (api_exceptions.DeadlineExceeded, asyncio.TimeoutError):
+            if dimensionatore:
+                dimensionatore.registra_timeout()
+            raise
+        if dimensionatore:
+            dimensionatore.registra(len(richieste), lette, caratteri, time.perf_counter() - avvio, troncata)
+
+    for giro in range(giri + 1):
+        if giro:
+            logger.info(f"Richiesta mirata di {n - len(ricevuti)} righe su {n} (giro {giro}/{giri})")
+        try:
+            await chiama_con_aimd(tentativo, limitatore, max_retries=max_retries, delay=delay)
+        except Exception as e:
+            logger.error(f"Gemini ha fallito dopo i retry: {e} ({len(ricevuti)}/{n} righe ricevute)")
+            break
+        if len(ricevuti) == n:
+            break
+
+    if len(ricevuti) < n:
+        logger.warning(f"Risposta incompleta: {len(ricevuti)} righe su {n}, {scartati[0]} valori non validi scartati")
+    logger.info(
+        f"Risposta Gemini: {len(ricevuti)}/{n} righe in {time.perf_counter() - inizio:.2f}s"
+        + (f", prima riga dopo {primo[0]:.2f}s" if primo else "")
+    )
+    return ricevuti
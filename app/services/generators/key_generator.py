@@ -1,39 +1,108 @@
+import numpy as np
 import pandas as pd
-import random
 import logging
 from typing import Optional
 
+from app.services.generators.distribuzioni import (
+    AssegnatoreBilanciato,
+    AssegnatoreFigli,
+    pesi_distribuzione
+)
+
 logger = logging.getLogger(__name__)
 
+# chiave di df.attrs con l'intervallo degli id generati
+ATTR_INTERVALLO_ID = "intervallo_id"
+
+
+# METADATI SULLO SPAZIO DELLE CHIAVI
+
+def intervallo_id(df: pd.DataFrame, colonna: str = "id") -> Optional[tuple[int, int]]:
+    """
+    Restituisce (primo, ultimo) se gli id della tabella sono l'intervallo
+    contiguo registrato da genera_chiavi_primarie, senza scandire la colonna.
+    None se i metadati mancano o non sono più validi (righe aggiunte o rimosse).
+    """
+    meta = df.attrs.get(ATTR_INTERVALLO_ID)
+    if not meta or meta["colonna"] != colonna:
+        return None
+    if meta["ultimo"] - meta["primo"] + 1 != len(df):
+        return None
+    return meta["primo"], meta["ultimo"]
+
+
+def valori_chiave(df: pd.DataFrame, colonna: str) -> np.ndarray:
+    """
+    Valori non nulli della colonna chiave. Se la tabella porta l'intervallo
+    degli id, l'array viene costruito da quello invece che dalla colonna.
+    """
+    intervallo = intervallo_id(df, colonna)
+    if intervallo is not None:
+        primo, ultimo = intervallo
+        return np.arange(primo, ultimo + 1, dtype=df[colonna].dtype)
+    return df[colonna].dropna().to_numpy()
+
+
 
 # GENERAZIONE CHIAVI PRIMARIE
 
-def genera_chiavi_primarie(df: pd.DataFrame, numero_righe: int) -> pd.DataFrame:
+def genera_chiavi_primarie(
+    df: pd.DataFrame,
+    numero_righe: int,
+    dtype=np.int64,
+    primo_id: Optional[int] = None
+) -> pd.DataFrame:
     """
     Aggiunge un numero specifico di righe con chiavi primarie incrementali a un DataFrame.
+    Le altre colonne delle nuove righe restano vuote (pd.NA).
 
     Args:
         df: DataFrame originale
         numero_righe: numero di nuove righe da aggiungere
+        dtype: tipo intero degli id (np.int64 o np.int32)
+        primo_id: id della prima riga se df è vuoto (default 1), per i chunk
+            di una tabella generata a pezzi
 
     Returns:
-        DataFrame aggiornato con nuove righe e colonna 'id'
+        DataFrame aggiornato con nuove righe e colonna 'id';
+        df.attrs["intervallo_id"] descrive l'intervallo degli id se è contiguo
     """
-    if "id" in df.columns and pd.api.types.is_numeric_dtype(df["id"]):
-        ultimo_id = df["id"].max()
+    if "id" in df.columns and pd.api.types.is_numeric_dtype(df["id"]) and not df.empty:
+        ultimo_id = int(df["id"].max())
+        intervallo = intervallo_id(df)
+        contiguo = intervallo is not None and intervallo[1] == ultimo_id
     else:
-        ultimo_id = 0
+        ultimo_id = 0 if primo_id is None or not df.empty else primo_id - 1
+        contiguo = df.empty
         df["id"] = pd.NA    # crea la colonna se non esiste
 
-    nuovi_id = list(range(ultimo_id + 1, ultimo_id + numero_righe + 1))
-    nuove_righe = pd.DataFrame({"id": nuovi_id})
+    if ultimo_id + numero_righe > np.iinfo(dtype).max:
+        raise ValueError(f"Id fino a {ultimo_id + numero_righe} non rappresentabili come {np.dtype(dtype)}")
+
+    nuovi_id = np.arange(ultimo_id + 1, ultimo_id + numero_righe + 1, dtype=dtype)
 
-    # aggiunge colonne vuote per compatibilità
-    for col in df.columns:
-        if col != "id":
-            nuove_righe[col] = pd.NA
+    # colonne vuote per compatibilità, in un unico blocco
+    altre = [col for col in df.columns if col != "id"]
+    nuove_righe = pd.DataFrame(
+        np.full((numero_righe, len(altre)), pd.NA, dtype=object),
+        columns=altre, dtype=object, copy=False
+    )
+    nuove_righe.insert(df.columns.get_loc("id"), "id", nuovi_id)
 
-    df_finale = pd.concat([df, nuove_righe], ignore_index=True)
+    if df.empty:
+        df_finale = nuove_righe
+    else:
+        df_finale = pd.concat([df, nuove_righe], ignore_index=True)
+
+    if contiguo:
+        primo_id = intervallo[0] if not df.empty else ultimo_id + 1
+        df_finale.attrs[ATTR_INTERVALLO_ID] = {
+            "colonna": "id",
+            "primo": primo_id,
+            "ultimo": ultimo_id + numero_righe
+        }
+    else:
+        df_finale.attrs.pop(ATTR_INTERVALLO_ID, None)
     return df_finale
 
 
@@ -45,55 +114,92 @@ def genera_chiavi_esterne(
     colonna_destinazione: str,
     df_ref: pd.DataFrame,
     colonna_riferimento: str,
-    seed: Optional[int] = None
+    seed: Optional[int] = None,
+    rng: Optional[np.random.Generator] = None,
+    distribuzione: Optional[dict] = None
 ) -> pd.DataFrame:
     """
-    Popola una colonna con chiavi esterne referenziando un'altra tabella,
-    distribuendo le chiavi in modo bilanciato con variazione casuale.
+    Popola una colonna con chiavi esterne referenziando un'altra tabella.
+
+    Per default le chiavi sono distribuite in modo bilanciato: ogni chiave di
+    riferimento riceve circa n_dest / n_ref righe (±1, almeno 1). Con
+    distribuzione si può chiedere una distribuzione diversa (vedi
+    app/schemas/fk_schemas.py), ad esempio Zipf per avere pochi genitori con
+    molti figli. Le assegnazioni vengono poi mescolate. Usa un generatore
+    locale, lo stato globale di random / numpy non viene toccato.
 
     Args:
         df_dest: DataFrame da modificare
         colonna_destinazione: colonna da riempire (es: "category")
         df_ref: DataFrame di riferimento
         colonna_riferimento: colonna chiave primaria di riferimento
-        seed: opzionale, per rendere la generazione riproducibilee
+        seed: opzionale, per rendere la generazione riproducibile
+        rng: generatore da usare al posto di uno creato da seed
+        distribuzione: {"distribuzione": nome, "args": {...}, "min_figli": n, "max_figli": n}
 
     Returns:
         DataFrame aggiornato
     """
-    if seed is not None:
-        random.seed(seed)
+    rng = rng or np.random.default_rng(seed)
+    distribuzione = distribuzione or {}
 
-    chiavi_rif = df_ref[colonna_riferimento].dropna().tolist()
-    if not chiavi_rif:
+    chiavi_rif = valori_chiave(df_ref, colonna_riferimento)
+    if len(chiavi_rif) == 0:
         logger.warning("Nessuna chiave di riferimento trovata")
         return df_dest
-    
-    random.shuffle(chiavi_rif)
 
-    n_dest = len(df_dest)
-    n_ref = len(chiavi_rif)
-    df_dest[colonna_destinazione] = pd.NA
+    generatore = GeneratoreChiaviEsterne(len(df_dest), chiavi_rif, rng, distribuzione)
+    df_dest[colonna_destinazione] = generatore.prossime(len(df_dest))
 
-    base = n_dest // n_ref
-    residue = n_dest % n_ref
+    return df_dest
 
-    assegnazioni = []
-    for chiave in chiavi_rif:
-        jitter = random.choice([-1, 0, 1])
-        n = max(1, base + jitter)
 
-        if residue > 0:
-            n += 1
-            residue -= 1
-
-        assegnazioni.extend([chiave] * n)
-
-    assegnazioni = assegnazioni[:n_dest]
-    while len(assegnazioni) < n_dest:
-        assegnazioni.append(random.choice(chiavi_rif))
-
-    random.shuffle(assegnazioni)
-    df_dest[colonna_destinazione] = assegnazioni
+class GeneratoreChiaviEsterne:
+    """
+    Chiavi esterne per n_dest righe, restituite a blocchi successivi nell'ordine
+    delle righe: genera_chiavi_esterne le chiede tutte insieme, la generazione
+    a chunk un blocco per volta. Le chiavi di riferimento possono essere un
+    semplice intervallo di id, senza la tabella di riferimento in memoria.
+    """
 
-    return df_dest
\ No newline at end of file
+    def __init__(
+        self,
+        n_dest: int,
+        chiavi_rif: np.ndarray,
+        rng: Optional[np.random.Generator] = None,
+        distribuzione: Optional[dict] = None
+    ):
+        rng = rng or np.random.default_rng()
+        distribuzione = distribuzione or {}
+        self.chiavi_rif = chiavi_rif
+
+        nome = distribuzione.get("distribuzione", "bilanciata")
+        min_figli = distribuzione.get("min_figli", 0)
+        max_figli = distribuzione.get("max_figli")
+
+        if nome == "bilanciata" and min_figli == 0 and max_figli is None:
+            self._assegnatore = AssegnatoreBilanciato(n_dest, len(chiavi_rif), rng)
+        else:
+            # con limiti, "bilanciata" equivale a pesi uguali
+            if nome == "bilanciata":
+                nome = "uniforme"
+            pesi = pesi_relazione(chiavi_rif, rng, nome, distribuzione.get("args"))
+            self._assegnatore = AssegnatoreFigli(n_dest, pesi, rng, min_figli, max_figli)
+
+    def prossime(self, n: int) -> np.ndarray:
+        return self.chiavi_rif[self._assegnatore.prossimi(n)]
+
+
+def pesi_relazione(
+    chiavi_rif: np.ndarray,
+    rng: np.random.Generator,
+    distribuzione: str,
+    args: Optional[dict] = None
+) -> np.ndarray:
+    """Pesi dei genitori; "pesi" accetta anche un dizionario {chiave: peso}."""
+    args = dict(args or {})
+    if distribuzione == "pesi" and isinstance(args.get("pesi"), dict):
+        # le chiavi non elencate hanno peso zero
+        pesi_per_chiave = args["pesi"]
+        args["pesi"] = [float(pesi_per_chiave.get(k, 0.0)) for k in chiavi_rif.tolist()]
+    return pesi_distribuzione(distribuzione, len(chiavi_rif), rng, args)
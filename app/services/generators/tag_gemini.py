@@ -1,107 +1,159 @@
 import json
 import logging
 import time
-from typing import List
+from typing import List, Optional
 import pandas as pd
-from vertexai.generative_models import GenerativeModel
 from google.api_core import exceptions as api_exceptions
+from app.services.generators.gemini_async import LimitatoreAIMD, chiama_con_aimd, esegui_async, get_limitatore
+from app.services.generators.gemini_batch import dimensionatore_condiviso, esegui_batch_adattivi
+from app.services.generators.gemini_cache import con_cache
+from app.services.generators.gemini_client import crea_modello
 
 logger = logging.getLogger(__name__)
 
+# token stimati per la risposta di una richiesta (lista di tag), poi adattati
+TOKEN_TAG_SELEZIONATI = 15
+TOKEN_TAG_GENERATI = 30
+
 
 
 # CALL GEMINI PER SELEZIONE TAG DA LISTA
 
+GENERATION_CONFIG_TAG_SELECTION = {"temperature": 0.7}
+
+PREAMBOLO_TAG_SELECTION = (
+    "Per ciascuna richiesta, scegli solo tra i tag elencati. "
+    "Non inventare nuovi tag. Rispondi con una lista di tag separati da virgola, senza commenti.\n\n"
+    "Ecco le richieste:\n\n"
+)
+
+
+def estrai_tag_selezionati(raw_text: str, n: int) -> List[List[str]]:
+    """
+    Estrae una lista di tag per ciascuna riga della risposta, allineata a n prompt.
+    """
+    parsed: List[List[str]] = []            
+    for line in raw_text.strip().splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        # cerca numerazione tipo "1. ..." o "1:" o "1 -"
+        if line[0].isdigit():
+            parts = line.split(".", 1)
+            if len(parts) != 2:
+                parts = line.split(":", 1)
+            if len(parts) != 2:
+                parts = line.split("-", 1)
+            if len(parts) == 2:
+                tag_text = parts[1].strip()
+                tag_list = [tag.strip() for tag in tag_text.split(",") if tag.strip()]
+                parsed.append(tag_list)
+        else:
+            # fallback: riga singola con tag separati da virgola
+            tag_list = [tag.strip() for tag in line.split(",") if tag.strip()]
+            if tag_list:
+                parsed.append(tag_list)
+
+    if not parsed:
+        logger.warning("Nessuna risposta valida estratta dal testo Gemini")
+        parsed = [[] for _ in range(n)]
+
+    if len(parsed) < n:
+        logger.warning(f"Batch incompleto: atteso {n}, ricevuto {len(parsed)}")
+        parsed += [[] for _ in range(n - len(parsed))]
+
+    return parsed[:n]
+
+
+async def call_gemini_tag_selection_async(
+    prompts: List[str], 
+    model_name: str = "gemini-2.5-flash", 
+    max_retries: int = 3, 
+    delay: int = 5,
+    batch_size: Optional[int] = None,
+    limitatore: Optional[LimitatoreAIMD] = None,
+    usa_cache: bool = True
+) -> List[List[str]]:
+    """
+    Versione asincrona di call_gemini_tag_selection: i sottobatch vengono
+    inviati in parallelo entro il limite AIMD e riassemblati in ordine.
+    I prompt già presenti nella cache persistente non vengono inviati.
+    """
+    limitatore = limitatore or get_limitatore()
+    dimensionatore = dimensionatore_condiviso(
+        PREAMBOLO_TAG_SELECTION, TOKEN_TAG_SELEZIONATI, batch_size, PREAMBOLO_TAG_SELECTION
+    )
+    logger.info(f"Avvio Gemini tag selection su {len(prompts)} prompt")
+
+    model = crea_modello(model_name, GENERATION_CONFIG_TAG_SELECTION)
+
+    async def seleziona(mancanti: List[str]) -> List[List[str]]:
+        total = len(mancanti)
+
+        async def elabora_batch(intervallo: tuple[int, int]) -> List[List[str]]:
+            start, end = intervallo
+            sub_prompts = mancanti[start:end]
+            full_prompt = PREAMBOLO_TAG_SELECTION + "\n".join([f"{i+1}. {p}" for i, p in enumerate(sub_prompts)])
+
+            logger.info(f"Invio batch {start}-{end-1} a Gemini ({len(sub_prompts)} prompt)")
+            avvio = time.perf_counter()
+            try:
+                response = await chiama_con_aimd(
+                    lambda: model.generate_content_async(full_prompt),
+                    limitatore,
+                    max_retries=max_retries,
+                    delay=delay
+                )
+            except (api_exceptions.GoogleAPIError, Exception) as e:
+                logger.error(f"Gemini ha fallito per batch {start}-{end-1} dopo {max_retries} tentativi: {e}")
+                return [[] for _ in sub_prompts]
+
+            raw_text = response.text.strip()
+            logger.debug("\n--- RAW TEXT DA GEMINI ---\n" + raw_text)
+            selezionati = estrai_tag_selezionati(raw_text, len(sub_prompts))
+            dimensionatore.registra(
+                len(sub_prompts), sum(1 for tags in selezionati if tags), len(raw_text), time.perf_counter() - avvio
+            )
+            return selezionati
+
+        all_results = await esegui_batch_adattivi(mancanti, dimensionatore, limitatore, elabora_batch)
+        logger.info(f"Completato: {len(all_results)} risposte totali su {total} prompt")
+        return all_results
+
+    return await con_cache(
+        prompts, model_name, GENERATION_CONFIG_TAG_SELECTION, PREAMBOLO_TAG_SELECTION,
+        seleziona, valido=bool, usa_cache=usa_cache
+    )
+
+
 def call_gemini_tag_selection(
     prompts: List[str], 
     model_name: str = "gemini-2.5-flash", 
     max_retries: int = 3, 
     delay: int = 5,
-    batch_size: int = 25
+    batch_size: Optional[int] = None,
+    usa_cache: bool = True
 ) -> List[List[str]]:
     """
     Chiamata batch a Gemini per selezionare tag da una lista predefinita.
-    Divide automaticamente i prompt in sottobatch per evitare timeout.
+    Divide automaticamente i prompt in sottobatch, dimensionati per token
+    stimati in modo da evitare timeout, e li invia in parallelo.
 
     Args:
         prompts: lista di prompt, ciascuno con tag disponibili e descrizione del corso o risorsa
         model_name: nome del modello Gemini da usare
         max_retries: numero massimo di tentativi in caso di errore
         delay: ritardo tra i retry
-        batch_size: numero massimo di prompt per batch
+        batch_size: numero massimo di prompt per batch (default settings.GEMINI_BATCH_RIGHE_MAX)
+        usa_cache: se False ignora la cache persistente
 
     Returns:
         Lista di liste di tag scelti (stringhe), uno per ciascun prompt
     """
-    all_results: List[List[str]] = []
-    total = len(prompts)
-    logger.info(f"Avvio Gemini tag selection su {total} prompt con batch da {batch_size}")
-
-    for start in range(0, total, batch_size):
-        end = min(start + batch_size, total)
-        sub_prompts = prompts[start:end]
-        logger.info(f"Elaborazione batch {start}-{end-1} ({len(sub_prompts)} prompt)")
-
-        for attempt in range(1, max_retries + 1):
-            try:
-                model = GenerativeModel(model_name, generation_config={"temperature": 0.7})
-                full_prompt = (
-                    "Per ciascuna richiesta, scegli solo tra i tag elencati. "
-                    "Non inventare nuovi tag. Rispondi con una lista di tag separati da virgola, senza commenti.\n\n"
-                    "Ecco le richieste:\n\n"
-                    + "\n".join([f"{i+1}. {p}" for i, p in enumerate(sub_prompts)])
-                )
-
-                logger.info(f"Invio batch {start}-{end-1} a Gemini (tentativo {attempt})")
-                response = model.generate_content(full_prompt)
-                raw_text = response.text.strip()
-                logger.debug("\n--- RAW TEXT DA GEMINI ---\n" + raw_text)
-
-                parsed: List[List[str]] = []            
-                for line in raw_text.splitlines():
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    # cerca numerazione tipo "1. ..." o "1:" o "1 -"
-                    if line[0].isdigit():
-                        parts = line.split(".", 1)
-                        if len(parts) != 2:
-                            parts = line.split(":", 1)
-                        if len(parts) != 2:
-                            parts = line.split("-", 1)
-                        if len(parts) == 2:
-                            tag_text = parts[1].strip()
-                            tag_list = [tag.strip() for tag in tag_text.split(",") if tag.strip()]
-                            parsed.append(tag_list)
-                    else:
-                        # fallback: riga singola con tag separati da virgola
-                        tag_list = [tag.strip() for tag in line.split(",") if tag.strip()]
-                        if tag_list:
-                            parsed.append(tag_list)
-
-                if not parsed:
-                    logger.warning(f"Nessuna risposta valida estratta per batch {start}-{end-1}")
-                    parsed = [[] for _ in sub_prompts]
-
-                if len(parsed) < len(sub_prompts):
-                    logger.warning(f"Batch incompleto: atteso {len(sub_prompts)}, ricevuto {len(parsed)}")
-                    parsed += [[] for _ in range(len(sub_prompts) - len(parsed))]
-
-                all_results.extend(parsed)
-                break   # esce dal retry loop se va tutto bene
-
-
-            except (api_exceptions.GoogleAPIError, Exception) as e:
-                logger.warning(f"Errore Gemini batch {start}-{end-1} (tentativo {attempt}): {e}")
-                time.sleep(delay)
-            
-        else:
-            logger.error(f"Gemini ha fallito per batch {start}-{end-1} dopo {max_retries} tentativi")
-            all_results.extend([[] for _ in sub_prompts])
-
-    logger.info(f"Completato: {len(all_results)} risposte totali su {total} prompt")
-    return all_results
+    return esegui_async(
+        call_gemini_tag_selection_async(prompts, model_name, max_retries, delay, batch_size, usa_cache=usa_cache)
+    )
 
 
 
@@ -128,91 +180,135 @@ def genera_prompt_risorsa(df_resource: pd.DataFrame) -> List[str]:
 
 # CALL GEMINI PER GENERAZIONE TAG LIBERA
 
-def call_gemini_tag_generation(
+GENERATION_CONFIG_TAG_GENERATION = {"temperature": 0.3}
+
+PREAMBOLO_TAG_GENERATION = (
+    "Genera da 1 a 3 tag sintetici per ciascuna risorsa. "
+    "Rispondi SOLO in formato JSON valido, senza testo aggiuntivo, "
+    "come lista di liste di stringhe.\n"
+    "Esempio di output valido:\n"
+    '[["tag1", "tag2"], ["tag3"], ["tag4", "tag5", "tag6]]\n\n'
+    "Ora genera i tag per queste risorse:\n"
+)
+
+
+def estrai_tag_json(raw_text: str, n: int, start: int = 0) -> List[List[str]]:
+    """
+    Interpreta la risposta JSON (lista di liste di tag) e la allinea a n prompt.
+    """
+    parsed_batch = None
+
+    # primo tentativo: parsing diretto
+    try:
+        parsed_batch = json.loads(raw_text)
+    except Exception:
+        if "[" in raw_text and "]" in raw_text:
+            candidate = raw_text[raw_text.find("["): raw_text.rfind("]")+1]
+            try:
+                parsed_batch = json.loads(candidate)
+            except Exception as e:
+                logger.error(f"Parsing JSON fallito nel batch {start} anche dopo fallback: {e}")
+        else:
+            logger.error(f"Nessun JSON rilevato nel batch {start}")
+
+    # se ancora None => placeholder
+    if parsed_batch is None:
+        parsed_batch = [[] for _ in range(n)]
+
+    # sanity check: deve essere una lista di liste
+    if not isinstance(parsed_batch, list):
+        parsed_batch = [[] for _ in range(n)]
+    else:
+        parsed_batch = [
+            [str(tag).strip() for tag in tags][:3] if isinstance(tags, list) else []
+            for tags in parsed_batch
+        ]
+
+    # forzatura dell'allineamento
+    if len(parsed_batch) < n:
+        # aggiunta di placeholder vuoti
+        parsed_batch.extend([[] for _ in range(n - len(parsed_batch))])
+    elif len(parsed_batch) > n:
+        # troncare l'eccesso
+        parsed_batch = parsed_batch[:n]
+
+    return parsed_batch
+
+
+async def call_gemini_tag_generation_async(
     prompts: List[str], 
     model_name: str = "gemini-2.5-flash", 
-    batch_size: int = 25
+    batch_size: Optional[int] = None,
+    max_retries: int = 3,
+    delay: int = 5,
+    limitatore: Optional[LimitatoreAIMD] = None,
+    usa_cache: bool = True
 ) -> List[List[str]]:
     """
-    Genera tag per le risorse usando Gemini, con output JSON per garantire allineamento.
-    Ogni batch restituisce una lista di liste di tag, una per ciascun prompt. 
+    Versione asincrona di call_gemini_tag_generation con batch in parallelo.
+    I prompt già presenti nella cache persistente non vengono inviati.
     """
-    all_results: List[List[str]] = []
+    limitatore = limitatore or get_limitatore()
+    dimensionatore = dimensionatore_condiviso(
+        PREAMBOLO_TAG_GENERATION, TOKEN_TAG_GENERATI, batch_size, PREAMBOLO_TAG_GENERATION
+    )
     logger.info(f"Avvio generazione tag liberi per {len(prompts)} risorse")
 
-    model = GenerativeModel(model_name, generation_config={"temperature": 0.3})
+    model = crea_modello(model_name, GENERATION_CONFIG_TAG_GENERATION)
 
-    for start in range(0, len(prompts), batch_size):
-        sub_prompts = prompts[start:start+batch_size]
-        logger.info(f"Batch {start}-{start+len(sub_prompts)-1}")
+    async def genera(mancanti: List[str]) -> List[List[str]]:
 
-        # prompt JSON-based
-        full_prompt = (
-            "Genera da 1 a 3 tag sintetici per ciascuna risorsa. "
-            "Rispondi SOLO in formato JSON valido, senza testo aggiuntivo, "
-            "come lista di liste di stringhe.\n"
-            "Esempio di output valido:\n"
-            '[["tag1", "tag2"], ["tag3"], ["tag4", "tag5", "tag6]]\n\n'
-            "Ora genera i tag per queste risorse:\n"
-        )
-        for i, p in enumerate(sub_prompts, start=1):
-            full_prompt += f"{i}. {p}\n"
+        async def elabora_batch(intervallo: tuple[int, int]) -> List[List[str]]:
+            start, end = intervallo
+            sub_prompts = mancanti[start:end]
+            logger.info(f"Batch {start}-{start+len(sub_prompts)-1}")
+
+            # prompt JSON-based
+            full_prompt = PREAMBOLO_TAG_GENERATION
+            for i, p in enumerate(sub_prompts, start=1):
+                full_prompt += f"{i}. {p}\n"
+
+            avvio = time.perf_counter()
+            try:
+                response = await chiama_con_aimd(
+                    lambda: model.generate_content_async(full_prompt),
+                    limitatore,
+                    max_retries=max_retries,
+                    delay=delay
+                )
+                raw_text = response.text.strip()
+            except Exception as e:
+                logger.error(f"Errore batch {start}: {e}")
+                return [[] for _ in sub_prompts]
 
-        try:
-            response = model.generate_content(full_prompt)
-            raw_text = response.text.strip()
             logger.debug(f"\n--- RAW TEXT BATCH ({start}) ---\n{raw_text}")
+            parsed_batch = estrai_tag_json(raw_text, len(sub_prompts), start)
+            dimensionatore.registra(
+                len(sub_prompts), sum(1 for tags in parsed_batch if tags), len(raw_text), time.perf_counter() - avvio
+            )
 
-            parsed_batch = None
+            return parsed_batch
 
-            # primo tentativo: parsing diretto
-            try:
-                parsed_batch = json.loads(raw_text)
-            except Exception:
-                if "[" in raw_text and "]" in raw_text:
-                    candidate = raw_text[raw_text.find("["): raw_text.rfind("]")+1]
-                    try:
-                        parsed_batch = json.loads(candidate)
-                    except Exception as e:
-                        logger.error(f"Parsing JSON fallito nel batch {start} anche dopo fallback: {e}")
-                else:
-                    logger.error(f"Nessun JSON rilevato nel batch {start}")
-
-            # se ancora None => placeholder
-            if parsed_batch is None:
-                parsed_batch = [[] for _ in sub_prompts]
-
-            # sanity check: deve essere una lista di liste
-            if not isinstance(parsed_batch, list):
-                parsed_batch = [[] for _ in sub_prompts]
-            else:
-                parsed_batch = [
-                    [str(tag).strip() for tag in tags][:3] if isinstance(tags, list) else []
-                    for tags in parsed_batch
-                ]
-
-            # forzatura dell'allineamento
-            if len(parsed_batch) < len(sub_prompts):
-                # aggiunta di placeholder vuoti
-                parsed_batch.extend([[] for _ in range(len(sub_prompts) - len(parsed_batch))])
-            elif len(parsed_batch) > len(sub_prompts):
-                # troncare l'eccesso
-                parsed_batch = parsed_batch[:len(sub_prompts)]
-
-            # aggiunta dei risultati del batch a all_results
-            all_results.extend(parsed_batch)
-
-            # debug: salva batch problematici
-            if any(len(tags) == 0 for tags in parsed_batch):
-                with open(f"debug_batch_{start}.txt", "w", encoding="utf-8") as f:
-                    f.write(raw_text)
-
-        except Exception as e:
-            logger.error(f"Errore batch {start}: {e}")
-            all_results += [[] for _ in sub_prompts]
+        return await esegui_batch_adattivi(mancanti, dimensionatore, limitatore, elabora_batch)
+
+    all_results = await con_cache(
+        prompts, model_name, GENERATION_CONFIG_TAG_GENERATION, PREAMBOLO_TAG_GENERATION,
+        genera, valido=bool, usa_cache=usa_cache
+    )
 
     assert len(all_results) == len(prompts), "Mismatch tra numero di prompt e risultati!"
     return all_results
 
 
-
+def call_gemini_tag_generation(
+    prompts: List[str], 
+    model_name: str = "gemini-2.5-flash", 
+    batch_size: Optional[int] = None,
+    usa_cache: bool = True
+) -> List[List[str]]:
+    """
+    Genera tag per le risorse usando Gemini, con output JSON per garantire allineamento.
+    Ogni batch restituisce una lista di liste di tag, una per ciascun prompt. 
+    I batch vengono inviati in parallelo; usa_cache=False ignora la cache persistente.
+    """
+    return esegui_async(call_gemini_tag_generation_async(prompts, model_name, batch_size, usa_cache=usa_cache))
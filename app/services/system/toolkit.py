@@ -1,7 +1,9 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from app.services.utils.helpers import save_table
 
-def promuovi_output(df, nome_base: str, base_dir: str = "app/data/schema"):
+def promuovi_output(df, nome_base: str, base_dir: str = "app/data/schema", formato: str = "csv") -> str:
     """
     Sposta un DataFrame validato nella cartella schema.
 
@@ -9,9 +11,35 @@ def promuovi_output(df, nome_base: str, base_dir: str = "app/data/schema"):
         df: DataFrame da salvare
         nome_base: nome base del file (senza estensione), es: "mdl_user"
         base_dir: directory di destinazione (default: app/data/schema)
+        formato: csv, csv.gz, csv.zst, parquet, arrow o feather (default: csv)
+
+    Returns:
+        Percorso del file scritto
     """
     os.makedirs(base_dir, exist_ok=True)
-    schema_path = os.path.join(base_dir, f"{nome_base}.csv")
-    save_table(df, schema_path.replace(".csv", "")) # save_table aggiunge .csv
+    schema_path = save_table(df, os.path.join(base_dir, nome_base), formato) # save_table aggiunge l'estensione
     
-    print(f"File promosso in: {schema_path}")
\ No newline at end of file
+    print(f"File promosso in: {schema_path}")
+    return schema_path
+
+
+def promuovi_tabelle(
+    dfs: dict,
+    base_dir: str = "app/data/schema",
+    formato: str = "csv",
+    max_workers: Optional[int] = None
+) -> list[str]:
+    """
+    Promuove più tabelle in parallelo, una per thread.
+
+    Args:
+        dfs: dizionario {nome_base: DataFrame}
+        base_dir: directory di destinazione
+        formato: formato dei file
+        max_workers: numero massimo di thread (default: scelto da ThreadPoolExecutor)
+
+    Returns:
+        Percorsi dei file scritti, nell'ordine di dfs
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="promuovi") as executor:
+        return list(executor.map(lambda nome: promuovi_output(dfs[nome], nome, base_dir, formato), dfs))
@@ -1,10 +1,19 @@
 import pandas as pd
+from app.services.exporters.formati import nome_file, scrivi_tabella
+from app.services.utils.indici import valore_per_id
 
-def load_table(table_path: str) -> pd.DataFrame:
-    return pd.read_csv(f"{table_path}.csv")
+def load_table(table_path: str, formato: str = "csv") -> pd.DataFrame:
+    path = nome_file(table_path, formato)
+    if formato == "parquet":
+        return pd.read_parquet(path)
+    if formato in ("arrow", "feather"):
+        return pd.read_feather(path)
+    return pd.read_csv(path)
 
-def save_table(df: pd.DataFrame, table_path: str):
-    df.to_csv(f"{table_path}.csv", index=False)
+def save_table(df: pd.DataFrame, table_path: str, formato: str = "csv") -> str:
+    path = nome_file(table_path, formato)
+    scrivi_tabella(df, path, formato)
+    return path
 
 def valida_interi(responses: list[str]) -> list[int | None]:
     risultati = []
@@ -15,6 +24,9 @@ def valida_interi(responses: list[str]) -> list[int | None]:
             risultati.append(None)
     return risultati
 
+def valida_livelli(responses: list[str], minimo: int = 1, massimo: int = 5) -> list[int | None]:
+    return [v if v is not None and minimo <= v <= massimo else None for v in valida_interi(responses)]
+
 def get_value_by_id(
         df: pd.DataFrame,
         row_id: int,
@@ -32,8 +44,7 @@ def get_value_by_id(
 
     Returns:
         Valore corrispondente o None se non trovato
+
+    Per risolvere molti ID usare mappa_per_id (app.services.utils.indici).
     """
-    match = df[df[id_column] == row_id]
-    if not match.empty:
-        return match.iloc[0][column_name]
-    return None
\ No newline at end of file
+    return valore_per_id(df, row_id, column_name, id_column)
\ No newline at end of file
@@ -0,0 +1,143 @@
+import logging
+import threading
+import weakref
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+
+# INDICE PER ID DI UNA TABELLA
+
+class IndiceId:
+    """
+    Indice id -> posizione di riga di una tabella, per risolvere molti ID
+    con un'unica operazione vettoriale invece di una scansione per ID.
+
+    L'indice memorizza solo le posizioni: i valori vengono letti dalla tabella
+    al momento della ricerca, quindi le modifiche alle altre colonne sono
+    sempre visibili. Se un ID compare più volte vale la prima occorrenza,
+    come in get_value_by_id.
+    """
+
+    def __init__(self, df: pd.DataFrame, id_column: str = "id"):
+        self.id_column = id_column
+        self.ids = df[id_column].to_numpy(copy=True)
+        univoci = ~pd.Index(self.ids).duplicated(keep="first")
+        self._index = pd.Index(self.ids[univoci])
+        self._posizioni = np.flatnonzero(univoci)
+
+    def valido_per(self, df: pd.DataFrame) -> bool:
+        """False se la colonna ID della tabella è cambiata dopo la costruzione."""
+        if self.id_column not in df.columns or len(df) != len(self.ids):
+            return False
+        return bool(np.array_equal(df[self.id_column].to_numpy(), self.ids))
+
+    def posizioni(self, chiavi) -> np.ndarray:
+        """Posizione di riga per ciascuna chiave, -1 se l'ID non esiste."""
+        trovate = self._index.get_indexer(pd.Index(np.asarray(chiavi)))
+        return np.where(trovate >= 0, self._posizioni[np.maximum(trovate, 0)], -1)
+
+
+_indici: dict[int, tuple[weakref.ref, dict[str, IndiceId]]] = {}
+_lock = threading.Lock()
+
+
+def _rimuovi(chiave: int):
+    with _lock:
+        _indici.pop(chiave, None)
+
+
+def indice(df: pd.DataFrame, id_column: str = "id") -> IndiceId:
+    """
+    Indice della tabella, costruito alla prima richiesta e riusato finché
+    la colonna ID non cambia (righe aggiunte, rimosse o riassegnate).
+    Viene scartato automaticamente quando il DataFrame non è più in uso.
+    """
+    chiave = id(df)
+    with _lock:
+        voce = _indici.get(chiave)
+        if voce is None or voce[0]() is not df:
+            voce = (weakref.ref(df, lambda _ref, k=chiave: _rimuovi(k)), {})
+            _indici[chiave] = voce
+        per_colonna = voce[1]
+        esistente = per_colonna.get(id_column)
+
+    if esistente is not None and esistente.valido_per(df):
+        return esistente
+
+    nuovo = IndiceId(df, id_column)
+    logger.debug(f"Indice su '{id_column}' costruito ({len(df)} righe)")
+    with _lock:
+        per_colonna[id_column] = nuovo
+    return nuovo
+
+
+def invalida(df: pd.DataFrame):
+    """Scarta gli indici della tabella (es. dopo una modifica in place degli ID)."""
+    _rimuovi(id(df))
+
+
+
+# RICERCHE VETTORIALI
+
+def mappa_per_id(
+    df: pd.DataFrame,
+    chiavi,
+    column_name: str,
+    id_column: str = "id",
+    default=None
+) -> pd.Series:
+    """
+    Versione vettoriale di get_value_by_id: restituisce, per ogni chiave,
+    il valore di column_name nella riga con quell'ID.
+
+    Args:
+        df: tabella in cui cercare
+        chiavi: sequenza o Series di ID (se Series, l'indice viene mantenuto)
+        column_name: colonna da restituire
+        id_column: colonna ID (default 'id')
+        default: valore per gli ID non trovati
+
+    Returns:
+        Series allineata alle chiavi
+    """
+    index = chiavi.index if isinstance(chiavi, pd.Series) else None
+    posizioni = indice(df, id_column).posizioni(chiavi)
+    trovate = posizioni >= 0
+
+    valori = df[column_name].to_numpy()
+    if trovate.all():
+        return pd.Series(valori[posizioni], index=index, name=column_name)
+
+    risultato = np.empty(len(posizioni), dtype=object)
+    risultato[:] = [default] * len(posizioni)
+    risultato[trovate] = valori[posizioni[trovate]]
+    return pd.Series(risultato, index=index, name=column_name, dtype=object)
+
+
+def colonna_da(
+    df: pd.DataFrame,
+    column_name: str,
+    chiave: str,
+    id_column: str = "id",
+    default=None
+):
+    """
+    Funzione per colonne_temp: dato il DataFrame di destinazione, legge
+    column_name dalla riga di df il cui ID è nella colonna chiave.
+
+    Esempio: colonna_da(df_course, "fullname", chiave="course")
+    """
+    def funzione(destinazione: pd.DataFrame) -> pd.Series:
+        return mappa_per_id(df, destinazione[chiave], column_name, id_column, default)
+    return funzione
+
+
+def valore_per_id(df: pd.DataFrame, row_id, column_name: str, id_column: str = "id") -> Optional[object]:
+    """Ricerca puntuale tramite l'indice; None se l'ID non esiste."""
+    posizione = indice(df, id_column).posizioni([row_id])[0]
+    return None if posizione < 0 else df[column_name].iloc[posizione]
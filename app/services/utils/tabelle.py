@@ -0,0 +1,90 @@
+import io
+import json
+import logging
+from typing import Optional
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+
+# PAGINAZIONE
+
+def pagina_tabella(
+    df: pd.DataFrame,
+    offset: int = 0,
+    limit: int = 100,
+    colonne: Optional[list[str]] = None
+) -> pd.DataFrame:
+    """
+    Restituisce una fetta della tabella senza copiare l'intero DataFrame.
+
+    Args:
+        df: DataFrame di partenza
+        offset: prima riga (inclusa)
+        limit: numero massimo di righe
+        colonne: sottoinsieme di colonne da restituire (default: tutte)
+
+    Returns:
+        DataFrame con al più limit righe
+
+    Raises:
+        KeyError: se una delle colonne richieste non esiste
+    """
+    if colonne:
+        mancanti = [c for c in colonne if c not in df.columns]
+        if mancanti:
+            raise KeyError(f"Colonne non trovate: {mancanti}")
+        df = df[colonne]
+    return df.iloc[offset:offset + limit]
+
+
+
+# ENCODING JSON (orient split)
+
+def encode_split(df: pd.DataFrame, **meta) -> str:
+    """
+    Serializza il DataFrame in JSON orient="split" (columns + data),
+    aggiungendo in testa i metadati passati come keyword.
+    """
+    split = df.to_json(orient="split", index=False, date_format="iso")
+    if not meta:
+        return split
+    testa = json.dumps(meta)
+    return testa[:-1] + ", " + split[1:]
+
+
+
+# ENCODING ARROW
+
+def tabella_arrow(df: pd.DataFrame):
+    """
+    Converte un DataFrame in pyarrow.Table. Le colonne object con tipi misti
+    (es. interi e stringhe) vengono convertite in stringa invece di fallire.
+    """
+    import pyarrow as pa
+
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.columns:
+            if df[col].dtype == object:
+                try:
+                    pa.array(df[col], from_pandas=True)
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    logger.info(f"Colonna '{col}' con tipi misti: converto in stringa")
+                    df[col] = df[col].astype("string")
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def encode_arrow_ipc(df: pd.DataFrame) -> bytes:
+    """Serializza il DataFrame nel formato Arrow IPC stream."""
+    import pyarrow as pa
+
+    tabella = tabella_arrow(df)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, tabella.schema) as writer:
+        writer.write_table(tabella)
+    return sink.getvalue()
@@ -1,4 +1,4 @@
-import { renderTable } from "./tables.js";
+import { loadTablePage } from "./tables.js";
 
 const tableOrder = [
     "mdl_user",
@@ -36,6 +36,13 @@ document.getElementById("dataset-form").addEventListener("submit", function(e) {
     evtSource.onmessage = function(event) {
         const data = JSON.parse(event.data);
 
+        if (data.status === "errore") {
+            document.getElementById("status").innerText = data.message;
+            evtSource.close();
+            btn.disabled = false;
+            return;
+        }
+
         const bar = document.getElementById("progress-bar");
         bar.style.width = data.progress + "%";
         bar.innerText = data.progress + "%";
@@ -46,8 +53,7 @@ document.getElementById("dataset-form").addEventListener("submit", function(e) {
             let contentHtml = `<div class="tab-content mt-3" id="tableTabsContent">`;
 
             tableOrder.forEach((name, idx) => {
-                const records = data.result[name];
-                if (!records) return;
+                if (!(name in data.tables)) return;
 
                 const activeClass = idx === 0 ? "active" : "";
                 const showActive = idx === 0 ? "show active" : "";
@@ -67,7 +73,7 @@ document.getElementById("dataset-form").addEventListener("submit", function(e) {
                 contentHtml += `
                     <div class="tab-pane fade ${showActive}" id="${name}-pane" 
                          role="tabpanel" aria-labelledby="${name}-tab">
-                        ${renderTable(name, records)}
+                        <div id="${name}-body">Caricamento...</div>
                     </div>
                 `;
             });
@@ -77,7 +83,7 @@ document.getElementById("dataset-form").addEventListener("submit", function(e) {
 
             const downloadBtn = `
                 <div class="text-center mt-4">
-                    <a href="/api/dataset/download_all" class="btn btn-lg btn-success">
+                    <a href="/api/dataset/${data.job_id}/download_all" class="btn btn-lg btn-success">
                         Scarica tutte le tabelle (ZIP)
                     </a>
                 </div>
@@ -85,6 +91,10 @@ document.getElementById("dataset-form").addEventListener("submit", function(e) {
 
             document.getElementById("tables-container").innerHTML = navHtml + contentHtml + downloadBtn;
 
+            tableOrder.forEach(name => {
+                if (name in data.tables) loadTablePage(data.job_id, name, data.tables[name], 0);
+            });
+
             evtSource.close();
             btn.disabled = false;
         }
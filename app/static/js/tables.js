@@ -1,19 +1,46 @@
-export function renderTable(title, records) {
-    if (!records || records.length === 0) return "";
+const PAGE_SIZE = 100;
 
-    const headers = Object.keys(records[0]);
+export function renderTable(title, page) {
+    if (!page || page.data.length === 0) return "";
+
+    const headers = page.columns;
     let html = `<h3 class="mt-4">${title}</h3>`;
     html += `<div class="table-responsive"><table class="table table-bordered table-hover table-sm align-middle">`;
     html += `<thead class="table-dark"><tr>`;
     headers.forEach(h => { html += `<th scope="col">${h}</th>`; });
     html += `</tr></thead><tbody>`;
 
-    records.forEach(row => {
+    page.data.forEach(row => {
         html += "<tr>";
-        headers.forEach(h => { html += `<td>${row[h] ?? ""}</td>`; });
+        row.forEach(value => { html += `<td>${value ?? ""}</td>`; });
         html += "</tr>";
     });
 
     html += "</tbody></table></div>";
     return html;
-}
\ No newline at end of file
+}
+
+export async function loadTablePage(jobId, name, total, offset) {
+    const container = document.getElementById(`${name}-body`);
+    const response = await fetch(`/api/dataset/${jobId}/tables/${name}?offset=${offset}&limit=${PAGE_SIZE}`);
+    if (!response.ok) {
+        container.innerHTML = `<p class="text-danger">Errore nel caricamento di ${name}</p>`;
+        return;
+    }
+    const page = await response.json();
+
+    const last = Math.min(offset + PAGE_SIZE, total);
+    let html = renderTable(name, page);
+    html += `
+        <div class="d-flex justify-content-between align-items-center">
+            <button class="btn btn-sm btn-outline-secondary" data-offset="${offset - PAGE_SIZE}" ${offset === 0 ? "disabled" : ""}>&laquo; Precedenti</button>
+            <span>Righe ${total === 0 ? 0 : offset + 1}-${last} di ${total}</span>
+            <button class="btn btn-sm btn-outline-secondary" data-offset="${offset + PAGE_SIZE}" ${last >= total ? "disabled" : ""}>Successive &raquo;</button>
+        </div>
+    `;
+    container.innerHTML = html;
+
+    container.querySelectorAll("button[data-offset]").forEach(btn => {
+        btn.addEventListener("click", () => loadTablePage(jobId, name, total, Number(btn.dataset.offset)));
+    });
+}